@@ -0,0 +1,108 @@
+import os
+from typing import Callable, Dict
+
+# The benchmarked modules read these at import, no connection is made
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB", "benchmarks")
+os.environ.setdefault("UNIQUE_ID", "BENCHMARK")
+
+from benchmarks import fixtures
+from controllers.sms_manager import decode_ascii_concat, parse_sms_data
+from helpers.at_reader import AtResponseReader, read_with
+from helpers.re_string import balance_to_dict
+from microservices.com_manager import replace_data, split_info_snapshot
+from routes.sim import _serialize_sim, dumps
+
+
+class FakeSerial:
+    # serial.Serial as read_with uses it, replaying the chunks of one response
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.position = 0
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.chunks[self.position]) if self.position < len(self.chunks) else 0
+
+    def read(self, size: int = 1) -> bytes:
+        if self.position >= len(self.chunks):
+            return b""
+        self.position += 1
+        return self.chunks[self.position - 1]
+
+
+def _parse_sms_data(count: int) -> Callable:
+    data = fixtures.cmgl_dump(count)
+    return lambda: parse_sms_data(data)
+
+
+def _decode_ascii_concat() -> Callable:
+    codes = fixtures.sender_codes(100)
+
+    def run():
+        for code in codes:
+            decode_ascii_concat(code)
+    return run
+
+
+def _balance_to_dict() -> Callable:
+    texts = fixtures.balance_texts()
+
+    def run():
+        for text in texts:
+            balance_to_dict(text, "8984048000000000001")
+    return run
+
+
+def _replace_data() -> Callable:
+    responses = fixtures.info_responses()
+
+    def run():
+        for response in responses:
+            replace_data(response)
+    return run
+
+
+def _split_info_snapshot() -> Callable:
+    lines = [response.replace("OK", "").strip() for response in fixtures.info_responses()]
+    result = "\r\n" + "\r\n".join(lines) + "\r\nOK\r\n"
+    return lambda: split_info_snapshot(result)
+
+
+def _at_reader_feed(count: int) -> Callable:
+    chunks = fixtures.serial_chunks(fixtures.cmgl_dump(count))
+
+    def run():
+        reader = AtResponseReader()
+        for chunk in chunks:
+            if reader.feed(chunk):
+                break
+        return reader.text()
+    return run
+
+
+def _at_read_with(count: int) -> Callable:
+    chunks = fixtures.serial_chunks(fixtures.cmgl_dump(count))
+    return lambda: read_with(AtResponseReader(), FakeSerial(chunks), 2.0)
+
+
+def _serialize_sim_page(count: int) -> Callable:
+    sims = fixtures.sim_documents(count)
+    # The route gets fresh cursor documents every time, _serialize_sim converts in place
+    return lambda: dumps({"items": [_serialize_sim(dict(sim)) for sim in sims]})
+
+
+# name -> setup, setup() returns the callable that is timed
+CASES: Dict[str, Callable[[], Callable]] = {
+    "parse_sms_data.cmgl_1": lambda: _parse_sms_data(1),
+    "parse_sms_data.cmgl_50": lambda: _parse_sms_data(50),
+    "parse_sms_data.cmgl_255": lambda: _parse_sms_data(255),
+    "decode_ascii_concat.senders_100": _decode_ascii_concat,
+    "balance_to_dict.cusd_3": _balance_to_dict,
+    "replace_data.info_7": _replace_data,
+    "split_info_snapshot.compound": _split_info_snapshot,
+    "at_reader.feed_cmgl_1": lambda: _at_reader_feed(1),
+    "at_reader.feed_cmgl_255": lambda: _at_reader_feed(255),
+    "at_reader.read_with_cmgl_50": lambda: _at_read_with(50),
+    "serialize_sim.page_100": lambda: _serialize_sim_page(100),
+}
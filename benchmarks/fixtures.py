@@ -0,0 +1,97 @@
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+
+
+# Same shapes as the modems in production answer, generated from a fixed seed so every run sees the same bytes
+SENDERS = ("+84901234567", "+84987654321", "VIETTEL", "Zalo", "+84356789012", "MobiFone")
+BODIES = (
+    "Ma xac thuc cua ban la {code}",
+    "Your OTP is {code}\nValid for 5 minutes.\nDo not share it with anyone.",
+    "TKC cua quy khach da duoc cong 10000 VND. Han su dung den 31/12/2026.",
+    "Chuc mung! Ban nhan duoc uu dai {code}.\nSoan TC gui 1234 de tu choi.\nChi tiet LH 198",
+    "Quy khach da dang ky thanh cong goi cuoc ST{code}, cuoc phi 10000d/ngay. OK de xac nhan",
+)
+BALANCE_TEXTS = (
+    '0,"TKC 125000 VND, han su dung den 01/01/2027. So thue bao +84901234567",15',
+    '0,"TK chinh: TKC 5000 d, KM1 10000 d. So thue bao +84987654321. Soan KTTK gui 191",15',
+    '0,"Quy khach khong du dieu kien su dung dich vu",15',
+)
+
+
+def encode_sender(sender: str) -> str:
+    # Concatenated ASCII codes, as CMGL reports the sender in this deployment
+    return "".join(str(ord(char)) for char in sender)
+
+
+def cmgl_dump(count: int, seed: int = 1) -> str:
+    # AT+CMGL="ALL" answer with count messages, single and multi-line bodies
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    lines = []
+    for index in range(count):
+        when = start + timedelta(seconds=rng.randint(0, 30 * 86400))
+        status = rng.choice(("REC READ", "REC UNREAD"))
+        sender = encode_sender(rng.choice(SENDERS))
+        body = rng.choice(BODIES).format(code=rng.randint(100000, 999999))
+        lines.append(f'+CMGL: {index},"{status}","{sender}",,"{when:%y/%m/%d,%H:%M:%S}+28"\r\n{body}')
+    return "\r\n" + "\r\n".join(lines) + "\r\n\r\nOK\r\n"
+
+
+def sender_codes(count: int, seed: int = 2) -> List[str]:
+    rng = random.Random(seed)
+    return [encode_sender(rng.choice(SENDERS)) for _ in range(count)]
+
+
+def info_responses() -> List[str]:
+    # One snapshot, as the sequential path reads it (replace_data input)
+    return [
+        "\r\n+CPIN: READY\r\n\r\nOK\r\n",
+        "\r\n+CREG: 0,1\r\n\r\nOK\r\n",
+        '\r\n+COPS: 0,0,"Viettel",7\r\n\r\nOK\r\n',
+        "\r\n+CCID: 8984048000000000001\r\n\r\nOK\r\n",
+        "\r\n+CSQ: 21,99\r\n\r\nOK\r\n",
+        "\r\n452040000000001\r\n\r\nOK\r\n",
+        '\r\n+QNWINFO: "FDD LTE","45204","LTE BAND 3",1650\r\n\r\nOK\r\n',
+    ]
+
+
+def balance_texts() -> List[str]:
+    return list(BALANCE_TEXTS)
+
+
+def sim_documents(count: int, seed: int = 3) -> List[dict]:
+    # /sims page documents, as the cursor returns them
+    rng = random.Random(seed)
+    now = datetime(2026, 6, 1)
+    return [{
+        "_id": ObjectId(f"{index:024x}"),
+        "iccid": f"8984048{index:012d}",
+        "cimi": f"45204{index:010d}",
+        "com_port": f"/dev/ttyUSB{index * 4 + 2}",
+        "unique_id": "LINUX-00:11:22:33:44:55",
+        "cpin": "READY",
+        "creg": "+CREG: 0,1",
+        "creg_stat": 1,
+        "cops": '+COPS: 0,0,"Viettel",7',
+        "operator": "Viettel",
+        "csq": f"+CSQ: {rng.randint(5, 31)},99",
+        "rssi": rng.randint(5, 31),
+        "rssi_dbm": -113 + 2 * rng.randint(5, 31),
+        "ber": 99,
+        "network_act": "FDD LTE",
+        "band": "LTE BAND 3",
+        "balance": str(rng.randint(0, 500) * 1000),
+        "phone": f"+8490{index:07d}",
+        "time_update_info_sim": now,
+        "balance_update_time": now - timedelta(minutes=rng.randint(0, 120)),
+        "sms_scan_status": True,
+    } for index in range(count)]
+
+
+def serial_chunks(response: str, size: int = 64) -> List[bytes]:
+    # What ser.read(in_waiting) hands the reader: the response in small pieces
+    data = response.encode()
+    return [data[i:i + size] for i in range(0, len(data), size)]
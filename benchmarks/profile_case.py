@@ -0,0 +1,36 @@
+import argparse
+import cProfile
+import pstats
+import sys
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="cProfile one benchmark case on its fixed fixtures")
+    parser.add_argument("name", help="case name, see benchmarks/cases.py")
+    parser.add_argument("--loops", type=int, default=1000, help="calls to profile")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key")
+    parser.add_argument("--limit", type=int, default=25, help="rows to print")
+    parser.add_argument("--out", help="also dump the raw stats (snakeviz, pstats) to this file")
+    args = parser.parse_args()
+
+    from benchmarks.cases import CASES
+
+    if args.name not in CASES:
+        print(f"Unknown case {args.name}, cases: {', '.join(CASES)}")
+        return 2
+    # Setup (fixtures, imports) and one warm-up call stay out of the profile
+    fn = CASES[args.name]()
+    fn()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(args.loops):
+        fn()
+    profiler.disable()
+    if args.out:
+        profiler.dump_stats(args.out)
+    pstats.Stats(profiler).strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def calibration() -> None:
+    # Fixed pure-Python work (string ops, dict, sort): with --normalized results are compared relative to it,
+    # for a baseline recorded on another machine
+    words = [f"+CMGL: {i},\"REC READ\"" for i in range(200)]
+    counts: Dict[str, int] = {}
+    for word in words:
+        key = word.split(",", 1)[0].replace("+CMGL: ", "")
+        counts[key] = counts.get(key, 0) + len(word)
+    sorted(counts.items(), key=lambda item: item[1])
+
+
+def measure(fn: Callable, repeat: int = 7, min_time: float = 0.05) -> dict:
+    """
+    Seconds per call: loops grow until one repeat takes min_time, then `repeat` repeats.
+    min is what is gated (noise only ever adds time), the median is reported alongside.
+    The garbage collector is off while timing, like timeit.
+    """
+    fn()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _measure(fn, repeat, min_time)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _measure(fn: Callable, repeat: int, min_time: float) -> dict:
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed < min_time / 4 else 1 + int(min_time / max(elapsed, 1e-9))
+    times: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    return {"median": statistics.median(times), "min": min(times), "loops": loops}
+
+
+def run_cases(names: List[str], repeat: int, min_time: float) -> dict:
+    from benchmarks.cases import CASES
+
+    timings = {}
+    references = []
+    for name in names:
+        fn = CASES[name]()
+        # Calibrated between the cases, the fastest calibration is the machine's speed for this run
+        references.append(measure(calibration, repeat, min_time)["min"])
+        timings[name] = measure(fn, repeat, min_time)
+    reference = min(references)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_ns": round(reference * 1e9, 1),
+        "cases": {name: case_result(timing, reference) for name, timing in timings.items()},
+    }
+
+
+def median_result(results: List[dict]) -> dict:
+    # Baselines from several rounds: the typical time of every case, not the luckiest one
+    first = results[0]
+    return {
+        **{key: value for key, value in first.items() if key != "cases"},
+        "calibration_ns": round(statistics.median(result["calibration_ns"] for result in results), 1),
+        "cases": {
+            name: {
+                key: round(statistics.median(result["cases"][name][key] for result in results), 4 if key == "normalized" else 1)
+                for key in first["cases"][name]
+            }
+            for name in first["cases"]
+        },
+    }
+
+
+def case_result(timing: dict, reference: float) -> dict:
+    return {
+        "ns": round(timing["min"] * 1e9, 1),
+        "median_ns": round(timing["median"] * 1e9, 1),
+        "normalized": round(timing["min"] / reference, 4),
+    }
+
+
+def confirm_regressions(result: dict, baselines: dict, threshold: float, normalized: bool, repeat: int, min_time: float, retries: int = 2) -> None:
+    """
+    A case over the threshold is measured again (up to `retries` times) and keeps its best time:
+    a regression has to show every time, a noisy moment does not.
+    """
+    from benchmarks.cases import CASES
+
+    reference = result["calibration_ns"] / 1e9
+    for _ in range(retries):
+        suspects = [row["name"] for row in compare(result, baselines, threshold, normalized) if row["status"] == "REGRESSION"]
+        if not suspects:
+            return
+        for name in suspects:
+            entry = case_result(measure(CASES[name](), repeat, min_time), reference)
+            if entry["ns"] < result["cases"][name]["ns"]:
+                result["cases"][name] = entry
+
+
+def compare(result: dict, baselines: dict, threshold: float, normalized: bool) -> List[dict]:
+    key = "normalized" if normalized else "ns"
+    rows = []
+    for name, entry in result["cases"].items():
+        baseline = baselines.get("cases", {}).get(name)
+        if baseline is None:
+            rows.append({"name": name, "ns": entry["ns"], "change": None, "status": "new"})
+            continue
+        change = entry[key] / baseline[key] - 1
+        rows.append({
+            "name": name,
+            "ns": entry["ns"],
+            "baseline_ns": baseline["ns"],
+            "change": change,
+            "status": "REGRESSION" if change > threshold else "ok",
+        })
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the per-poll parsers, gated against baselines.json")
+    parser.add_argument("names", nargs="*", help="case names or prefixes (default: all)")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_THRESHOLD", "0.5")),
+                        help="allowed slowdown against the baseline, 0.5 = 50%%: the regressions worth stopping a deploy "
+                             "for (backtracking regexes, quadratic reads) are multiples, shared machines are noisy")
+    parser.add_argument("--normalized", action="store_true",
+                        help="compare times relative to the calibration loop, for baselines recorded on another machine")
+    parser.add_argument("--update", action="store_true", help="write the results as the new baselines")
+    parser.add_argument("--rounds", type=int, default=3, help="with --update: full runs, the median of each case is kept")
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05, help="seconds per repeat")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    from benchmarks.cases import CASES
+
+    names = [name for name in CASES if not args.names or any(name.startswith(prefix) for prefix in args.names)]
+    if not names:
+        print(f"No case matches {args.names}, cases: {', '.join(CASES)}")
+        return 2
+    if args.update:
+        result = median_result([run_cases(names, args.repeat, args.min_time) for _ in range(max(1, args.rounds))])
+    else:
+        result = run_cases(names, args.repeat, args.min_time)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if not args.update:
+        confirm_regressions(result, baselines, args.threshold, args.normalized, args.repeat, args.min_time)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.update:
+        merged = dict(baselines, **{k: v for k, v in result.items() if k != "cases"})
+        merged["cases"] = dict(baselines.get("cases", {}), **result["cases"])
+        with open(args.baselines, "w") as f:
+            json.dump(merged, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written: {args.baselines}")
+
+    rows = compare(result, baselines, args.threshold, args.normalized)
+    print(f"python {result['python']}, calibration {result['calibration_ns'] / 1000:.1f} us, threshold {args.threshold:.0%}")
+    print(f"{'case':36} {'now us':>10} {'base us':>10} {'change':>8}  status")
+    for row in rows:
+        base = f"{row['baseline_ns'] / 1000:10.2f}" if "baseline_ns" in row else f"{'-':>10}"
+        change = f"{row['change']:+8.1%}" if row["change"] is not None else f"{'-':>8}"
+        print(f"{row['name']:36} {row['ns'] / 1000:10.2f} {base} {change}  {row['status']}")
+    regressions = [row["name"] for row in rows if row["status"] == "REGRESSION"]
+    if regressions and not args.update:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
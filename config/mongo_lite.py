@@ -14,4 +14,6 @@ client = MongoClient(
 )
 db = client[os.getenv("MONGO_DB")]
 sim_collection = db["sims"]
-sms_collection = db["sms"]
\ No newline at end of file
+sms_collection = db["sms"]
+lease_collection = db["leases"]
+outbox_collection = db["sms_outbox"]
\ No newline at end of file
@@ -1,6 +1,13 @@
+from bson import ObjectId
 from config import mongo_lite
-from typing import Optional
-from microservices.com_manager import ComPort
+from typing import Optional, Set
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from database.sim_registry import sim_registry
+from database.write_batcher import sms_writer
+from microservices import com_manager
+from microservices.port_worker import PRIORITY_SMS
+import os
 import re
 import traceback
 import logging
@@ -8,6 +15,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+CMGR_PATTERN = re.compile(r'\+CMGR: "(.*?)","(.*?)",(?:".*?")?,"(.*?)"\r?\n(.*?)\r?\n\r?\nOK', re.DOTALL)
+CMT_PATTERN = re.compile(r'\+CMT: "(.*?)",(?:".*?")?,"(.*?)"')
+
 def decode_ascii_concat(s):
     result = ""
     i = 0
@@ -27,9 +37,30 @@ def decode_ascii_concat(s):
     return result
 
 
+def decode_sender(s):
+    # Some modems report the sender as concatenated ASCII codes, others as the plain number
+    try:
+        return decode_ascii_concat(s)
+    except ValueError:
+        return s
+
+
 def replace_line_end(str):
     return "".join(str.splitlines()).strip()
 
+def parse_cmgr(data, index):
+    match = CMGR_PATTERN.search(data)
+    if not match:
+        return None
+    return {
+        "index": str(index),
+        "status": match.group(1),
+        "sender": decode_sender(match.group(2)),
+        "time": match.group(3),
+        "content": match.group(4).strip()
+    }
+
+
 def parse_sms_data(data):
     # Regex này sẽ bắt: Index, Status, Sender, Timestamp và Nội dung (bao gồm cả xuống dòng)
     pattern = r'\+CMGL: (\d+),"(.*?)","(.*?)",,"(.*?)"\r?\n(.*?)(?=\r?\n\+CMGL:|\r?\n\r?\nOK)'
@@ -41,7 +72,7 @@ def parse_sms_data(data):
         results.append({
             "index": m[0],
             "status": m[1],
-            "sender": decode_ascii_concat(m[2]),
+            "sender": decode_sender(m[2]),
             "time": m[3],
             "content": m[4].strip()
         })
@@ -49,73 +80,203 @@ def parse_sms_data(data):
 
 
 class SMSManager:
-    def __init__(self):
+    def __init__(self, manager=None):
         self.sms_collection = mongo_lite.sms_collection
         self.sim_collection = mongo_lite.sim_collection
+        self._manager = manager
+        # Sims whose messages are saved up to the last fetch: later fetches list only "REC UNREAD".
+        # Reading marks a message read on the SIM, so after a failed save the next fetch lists "ALL" again
+        self._synced: Set[str] = set()
+        self.delete_after_save = os.getenv("SMS_DELETE_AFTER_SAVE", "false").lower() in ("1", "true", "yes")
+
+    @property
+    def manager(self):
+        return self._manager or com_manager.get_com_manager()
         
-    def get_sms_all(self, iccid: str):
+    def get_sms_all(self, iccid: str, priority: int = PRIORITY_SMS):
+        """
+        Incremental fetch: the first call per SIM lists "ALL", later calls only "REC UNREAD",
+        so the cost follows the number of new messages. A failed save puts the SIM back to "ALL"
+        (the upserts are idempotent). Returns the newly fetched messages.
+        """
         try:
             print(f"Getting SMS for iccid: {iccid}")
-            sim = self.sim_collection.find_one({"iccid": iccid})
+            sim = sim_registry.get(iccid)
             if not sim:
                 print(f"Sim not found for iccid: {iccid}")
                 return None
-            print(f"Sim: {sim}")
             com_port = sim["com_port"]
-            comport = ComPort(com_port)
-            _ = comport.connect()
-            if _ is None:
-                print(f"Error connecting to com port: {com_port}")
-                return None
-            print(f"Connected to com port: {com_port}")
-            result, time_taken = comport.write('AT+CSCS?')
-            if "OK" not in result:
-                logger.error(f"Error getting SMS mode: {replace_line_end(result)}, iccid: {iccid}")
-                return None
-            result, time_taken = comport.write('AT+CSCS="GSM"')
-            if "OK" not in result:
-                logger.error(f"Error setting SMS mode to GSM: {replace_line_end(result)}, iccid: {iccid}")
-                return None
-            result, time_taken = comport.write("AT+CMGF=1")
-            if "OK" not in result:
-                logger.error(f"Error setting SMS mode to text: {replace_line_end(result)}, iccid: {iccid}")
-                return None
-            result, time_taken = comport.write('AT+CPMS="SM"')
-            if "OK" not in result:
-                logger.error(f"Error setting SMS mode to SIM memory: {replace_line_end(result)}, iccid: {iccid}")
+            status = "REC UNREAD" if iccid in self._synced else "ALL"
+            result = self.manager.submit(com_port, lambda comport: self._read_sms_list(comport, iccid, status), priority).result()
+            if result is None:
                 return None
-            result, time_taken = comport.write('AT+CMGL="ALL"')
-            if "OK" not in result:
-                logger.error(f"Error getting all SMS: {replace_line_end(result)}, iccid: {iccid}")
-                return None
-            comport.disconnect()
             sms = parse_sms_data(result)
             result_sms = {
                 'phone': sim['phone'],
                 'sms': sms,
                 'cimi': sim['cimi'],
             }
-            self.save_sms(result_sms)
-            print(f"Found {len(sms)} messages.")
+            try:
+                self.save_sms(result_sms)
+            except Exception:
+                self._synced.discard(iccid)
+                raise
+            self._synced.add(iccid)
+            indices = [m["index"] for m in sms]
+            if self.delete_after_save and indices:
+                self.manager.submit(com_port, lambda comport: self._delete_sms(comport, iccid, indices), priority).result()
+            print(f"Found {len(sms)} new messages.")
             return result_sms
         except Exception as e:
             print(f"Error getting SMS: {e}, traceback: {traceback.format_exc()}")
             return None
-        
+
+    def stored_sms(self, cimi: str, after: Optional[str] = None, limit: int = 100):
+        """
+        At most `limit` saved messages, oldest first: the latest ones, or with `after` (an "id" from a
+        previous answer) the ones saved after it.
+        """
+        query = {"cimi": cimi}
+        projection = {"index": 1, "status": 1, "sender": 1, "time_received": 1, "content": 1}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+            docs = list(self.sms_collection.find(query, projection).sort("_id", 1).limit(limit))
+        else:
+            docs = list(self.sms_collection.find(query, projection).sort("_id", -1).limit(limit))[::-1]
+        return [{
+            "id": str(doc["_id"]),
+            "index": doc.get("index"),
+            "status": doc.get("status"),
+            "sender": doc.get("sender"),
+            "time": doc.get("time_received"),
+            "content": doc.get("content"),
+        } for doc in docs]
+
+    def _delete_sms(self, comport, iccid: str, indices):
+        # Runs on the port worker, only after save_sms made the messages durable
+        if comport is None:
+            return False
+        for index in indices:
+            result, time_taken = comport.write(f"AT+CMGD={index}")
+            if result is None or "OK" not in result:
+                logger.error(f"Error deleting SMS {index} on {comport.port}: {result}")
+        return True
     
+    def sim_for_port(self, com_port: str):
+        return sim_registry.get_by_port(com_port)
+
+    def read_sms_index(self, comport, index: int):
+        # Runs on the port worker, the modem is already in text mode (ComManager.configure_sms_urc)
+        if not self._prepare_text_mode(comport):
+            return None
+        result, time_taken = comport.write(f"AT+CMGR={index}")
+        if result is None or "OK" not in result:
+            logger.error(f"Error reading SMS {index} on {comport.port}: {result}")
+            return None
+        return parse_cmgr(result, index)
+
+    def on_new_sms(self, comport, storage: str, index: int):
+        """
+        +CMTI handler, runs on the port worker: read only the new message and persist it.
+        """
+        if comport is None:
+            return None
+        if storage != "SM":
+            logger.error(f"SMS {index} stored in {storage} on {comport.port}, left for the SMS sweep")
+            return None
+        sms = self.read_sms_index(comport, index)
+        if sms is None:
+            return None
+        sim = self.sim_for_port(comport.port)
+        if not sim:
+            logger.error(f"Sim not found for com port: {comport.port}, SMS {index} left on the SIM")
+            return None
+        result_sms = {
+            'phone': sim.get('phone'),
+            'sms': [sms],
+            'cimi': sim['cimi'],
+        }
+        try:
+            self.save_sms(result_sms)
+        except Exception as e:
+            # CMGR marked it read: only an "ALL" listing finds it again
+            self._synced.discard(sim['iccid'])
+            logger.error(f"Error saving SMS {index} on {comport.port}, iccid: {sim['iccid']}: {e}")
+            return None
+        if self.delete_after_save:
+            self._delete_sms(comport, sim['iccid'], [sms["index"]])
+        logger.info(f"New SMS on {comport.port}, iccid: {sim['iccid']}, index: {index}")
+        return result_sms
+
+    def on_direct_sms(self, com_port: str, line: str, body: str):
+        # +CMT delivers the message without storing it on the SIM, persist it straight away
+        match = CMT_PATTERN.search(line)
+        if not match:
+            logger.error(f"Unknown +CMT on {com_port}: {line}")
+            return None
+        sim = self.sim_for_port(com_port)
+        if not sim:
+            logger.error(f"Sim not found for com port: {com_port}, +CMT dropped")
+            return None
+        result_sms = {
+            'phone': sim.get('phone'),
+            'sms': [{
+                "index": None,
+                "status": "REC UNREAD",
+                "sender": decode_sender(match.group(1)),
+                "time": match.group(2),
+                "content": body.strip(),
+            }],
+            'cimi': sim['cimi'],
+        }
+        self.save_sms(result_sms)
+        return result_sms
+
+    def _prepare_text_mode(self, comport) -> bool:
+        # GSM charset, text mode, SIM storage. No round trip for what the port already has
+        return (
+            comport.configure("cscs", "GSM")
+            and comport.configure("cmgf", "1")
+            and comport.configure("cpms", com_manager.SMS_STORAGE)
+        )
+
+    def _read_sms_list(self, comport, iccid: str, status: str = "ALL"):
+        # Runs on the port worker
+        if comport is None:
+            logger.error(f"Error connecting to com port for iccid: {iccid}")
+            return None
+        for attempt in range(2):
+            if not self._prepare_text_mode(comport):
+                logger.error(f"Error setting SMS text mode on {comport.port}, iccid: {iccid}")
+                return None
+            result, time_taken = comport.write(f'AT+CMGL="{status}"')
+            if result is not None and "OK" in result:
+                return result
+            # The modem may not be in the state the port remembers (reset without RDY): redo it once
+            comport.reset_session()
+        logger.error(f"Error getting {status} SMS: {replace_line_end(result or '')}, iccid: {iccid}")
+        return None
+
     def save_sms(self, sms_data):
+        """
+        Upserts go through the SMS write batcher, returns once their batches are acknowledged.
+        """
         list_sms = list(sms_data['sms'])
-        for sms in list_sms:
-            print(f"Saving SMS: {sms}")
-            self.sms_collection.update_one({
-                "cimi": sms_data['cimi'],
-                "time_received": sms['time'],
-                "sender": sms['sender'],
-            }, {
-                "$set": {
-                    "content": sms['content'],
-                    "status": sms['status'],
-                    "index": sms['index'],
-                }
-            }, upsert=True)
-        print(f"Saved {len(list_sms)} SMS")
\ No newline at end of file
+        futures = [sms_writer.submit(UpdateOne({
+            "cimi": sms_data['cimi'],
+            "time_received": sms['time'],
+            "sender": sms['sender'],
+        }, {
+            "$set": {
+                "content": sms['content'],
+                "status": sms['status'],
+                "index": sms['index'],
+            }
+        }, upsert=True)) for sms in list_sms]
+        for future in futures:
+            try:
+                future.result()
+            except DuplicateKeyError:
+                # Upserted concurrently (+CMTI and the sweep), the unique sms_key kept one copy
+                pass
+        logger.info(f"Saved {len(list_sms)} SMS, cimi: {sms_data['cimi']}")
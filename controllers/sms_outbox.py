@@ -0,0 +1,448 @@
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+
+from config import mongo_lite
+from database.sim_registry import sim_registry
+from database.write_batcher import outbox_writer
+from helpers import at_parser, sms_pdu
+from microservices.port_worker import PRIORITY_SMS
+
+
+logger = logging.getLogger(__name__)
+unique_id = os.environ["UNIQUE_ID"]
+
+CMGS_PATTERN = re.compile(r'\+CMGS:\s*(\d+)')
+# Text mode status report: +CMGR: <stat>,<fo>,<mr>,[<ra>],[<tora>],<scts>,<dt>,<st>
+CMGR_STATUS_REPORT_PATTERN = re.compile(
+    r'\+CMGR:\s*"[^"]*",\s*\d+,\s*(\d+),\s*"([^"]*)",\s*\d*,\s*"([^"]*)",\s*"([^"]*)",\s*(\d+)'
+)
+
+STATUS_QUEUED = "queued"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_DELIVERED = "delivered"
+STATUS_FAILED = "failed"
+
+
+def report_status(st: int) -> str:
+    # TP-Status (3GPP 23.040 9.2.3.15): 0-31 done, 32-63 still trying, 64+ gave up
+    if st < 32:
+        return STATUS_DELIVERED
+    if st < 64:
+        return "pending"
+    return STATUS_FAILED
+
+
+class SmsOutbox:
+    """
+    Durable outbound SMS queue in the sms_outbox collection:
+      - enqueue() stores the message as queued, the dispatcher sends it from any ready modem
+      - Each tick, one indexed find reads the due messages' preferences; only the free registered sims on this
+        bridge that one of them accepts claim with find_one_and_update, best signal first (rssi_dbm).
+        With nothing claimed the dispatcher sleeps idle_interval, enqueue() and finished sends wake it
+      - Per sim: min_interval between sends and at most per_minute sends per minute
+      - Sent in PDU mode, split into concatenated parts when longer than one SMS, with a status report requested
+      - A failed send is retried max_attempts times with backoff, on another sim when there is one,
+        on the same sim otherwise; a message no sim could take within max_age is marked failed
+      - The sent / retry status goes through the write batcher; a write that fails is kept and retried
+        before the next claim, so a message that went out is never left "sending" to be claimed and sent again
+      - Status reports (+CDSI) are matched on iccid + message reference: sent -> delivered / failed
+      - stats() reports queue depth, send latency and per-sim throughput
+    """
+
+    def __init__(
+        self,
+        manager,
+        min_interval: float = 2.0,
+        per_minute: int = 20,
+        max_attempts: int = 3,
+        retry_delay: float = 30.0,
+        claim_timeout: float = 300.0,
+        idle_interval: float = 2.0,
+        max_age: float = 3600.0,
+    ):
+        self.manager = manager
+        self.collection = mongo_lite.outbox_collection
+        self.min_interval = min_interval
+        self.per_minute = per_minute
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # A claimed message whose bridge died goes back to the queue after this
+        self.claim_timeout = claim_timeout
+        self.tick_interval = 0.2
+        self.idle_interval = idle_interval
+        self.max_age = max_age
+        self._wake = threading.Event()
+        # Due messages were found on the last check: keep ticking fast until the queue is drained
+        self._backlog = False
+        self._last_expire = 0.0
+        self._lock = threading.Lock()
+        self._busy: set = set()
+        self._last_send: Dict[str, float] = {}
+        self._sent_times: Dict[str, deque] = {}
+        self._latencies = deque(maxlen=500)
+        # message _id -> status update whose write failed, retried by the dispatcher
+        self._unsaved: Dict[ObjectId, dict] = {}
+        self._queue_depth = {"value": 0, "time": 0.0}
+        # Status report correlation is a Mongo round trip, kept off the port workers
+        self._reports = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sms-report")
+        self._stats = {"enqueued": 0, "claimed": 0, "sent": 0, "parts": 0, "retried": 0, "failed": 0, "delivered": 0, "reports": 0, "expired": 0, "status_write_errors": 0}
+
+    def enqueue(self, to: str, text: str, iccid: Optional[str] = None, operator: Optional[str] = None) -> str:
+        now = datetime.now(tz=timezone.utc)
+        result = self.collection.insert_one({
+            "to": to,
+            "text": text,
+            # Preferences: a given sim, or any sim on this operator
+            "iccid_hint": iccid,
+            "operator_hint": operator,
+            "status": STATUS_QUEUED,
+            "attempts": 0,
+            "failed_iccids": [],
+            "created_at": now,
+            "next_attempt_at": now,
+        })
+        with self._lock:
+            self._stats["enqueued"] += 1
+        self._wake.set()
+        return str(result.inserted_id)
+
+    def get(self, message_id: str) -> Optional[dict]:
+        try:
+            message = self.collection.find_one({"_id": ObjectId(message_id)})
+        except Exception:
+            return None
+        if message is not None:
+            message["_id"] = str(message["_id"])
+        return message
+
+    def run(self) -> None:
+        logger.info(f"Starting SMS outbox dispatcher, unique_id: {unique_id}")
+        while True:
+            try:
+                # No new claim while a status of this bridge is not saved: Mongo is failing anyway
+                if self.retry_unsaved():
+                    self.dispatch()
+                self.expire()
+            except Exception as e:
+                logger.error(f"Error dispatching SMS: {e}")
+                logger.error(traceback.format_exc())
+            self._wake.wait(self.tick_interval if self._backlog else self.idle_interval)
+            self._wake.clear()
+
+    def free_sims(self) -> List[dict]:
+        # Registered sims on this bridge that are not sending and are under their rate limits, best signal first
+        now = time.monotonic()
+        sims = []
+        for device in list(self.manager.com_ports):
+            sim = sim_registry.get_by_port(device)
+            if not sim or at_parser.creg_stat(sim) not in at_parser.REGISTERED_STATS:
+                continue
+            iccid = sim["iccid"]
+            with self._lock:
+                if iccid in self._busy:
+                    continue
+                if now - self._last_send.get(iccid, 0.0) < self.min_interval:
+                    continue
+                sent = self._sent_times.get(iccid)
+                while sent and now - sent[0] > 60:
+                    sent.popleft()
+                if sent and len(sent) >= self.per_minute:
+                    continue
+            sims.append(sim)
+        sims.sort(key=lambda sim: sim.get("rssi_dbm") if sim.get("rssi_dbm") is not None else -113, reverse=True)
+        return sims
+
+    @staticmethod
+    def _due_query(now: datetime) -> dict:
+        return {"$or": [
+            {"status": STATUS_QUEUED, "next_attempt_at": {"$lte": now}},
+            # Claimed by a bridge that never finished
+            {"status": STATUS_SENDING, "claimed_until": {"$lte": now}},
+        ]}
+
+    def dispatch(self) -> int:
+        """
+        One round: nothing is written unless a due message accepts the sim. Sims that have not failed
+        a message get it first; a second pass lets the remaining free sims take messages they failed before.
+        Returns the number of messages claimed.
+        """
+        sims = self.free_sims()
+        if not sims:
+            # No Mongo round trip while every sim is busy or rate limited
+            return 0
+        now = datetime.now(tz=timezone.utc)
+        due = list(
+            self.collection.find(self._due_query(now), {"iccid_hint": 1, "operator_hint": 1, "failed_iccids": 1})
+            .sort("next_attempt_at", 1)
+            .limit(2 * len(sims))
+        )
+        claimed = 0
+        for avoid_failed in (True, False):
+            for sim in list(sims):
+                if not any(self._accepts(message, sim, avoid_failed) for message in due):
+                    continue
+                message = self._claim(sim, avoid_failed)
+                if message is None:
+                    continue
+                sims.remove(sim)
+                due = [candidate for candidate in due if candidate["_id"] != message["_id"]]
+                claimed += 1
+                self._send(sim, message)
+        # Keep ticking fast only while messages are going out
+        self._backlog = claimed > 0
+        return claimed
+
+    @staticmethod
+    def _accepts(message: dict, sim: dict, avoid_failed: bool) -> bool:
+        # Same preference rules as the _claim query, on the projected due messages
+        if message.get("iccid_hint") not in (None, sim["iccid"]):
+            return False
+        if message.get("operator_hint") not in (None, sim.get("operator")):
+            return False
+        return not avoid_failed or sim["iccid"] not in (message.get("failed_iccids") or [])
+
+    def expire(self) -> int:
+        # Once a minute: queued messages no sim took within max_age (hinted sim gone, operator absent) fail
+        now = time.monotonic()
+        if now - self._last_expire < 60:
+            return 0
+        self._last_expire = now
+        cutoff = datetime.now(tz=timezone.utc) - timedelta(seconds=self.max_age)
+        result = self.collection.update_many(
+            {"status": STATUS_QUEUED, "created_at": {"$lte": cutoff}},
+            {"$set": {"status": STATUS_FAILED, "error": "no_eligible_sim", "next_attempt_at": None}},
+        )
+        if result.modified_count:
+            logger.error(f"{result.modified_count} SMS expired in the outbox without an eligible sim")
+            with self._lock:
+                self._stats["expired"] += result.modified_count
+        return result.modified_count
+
+    def _claim(self, sim: dict, avoid_failed: bool = True) -> Optional[dict]:
+        now = datetime.now(tz=timezone.utc)
+        query = {
+            "$and": [
+                self._due_query(now),
+                {"$or": [{"iccid_hint": None}, {"iccid_hint": sim["iccid"]}]},
+                {"$or": [{"operator_hint": None}, {"operator_hint": sim.get("operator")}]},
+            ],
+        }
+        if avoid_failed:
+            # Retries prefer another sim, the fallback pass allows the one that failed
+            query["failed_iccids"] = {"$ne": sim["iccid"]}
+        message = self.collection.find_one_and_update(
+            query,
+            {"$set": {
+                "status": STATUS_SENDING,
+                "owner": unique_id,
+                "iccid": sim["iccid"],
+                "com_port": sim["com_port"],
+                "claimed_at": now,
+                "claimed_until": now + timedelta(seconds=self.claim_timeout),
+            }},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if message is not None:
+            with self._lock:
+                self._stats["claimed"] += 1
+        return message
+
+    def _send(self, sim: dict, message: dict) -> None:
+        iccid = sim["iccid"]
+        pdus = sms_pdu.encode_message(message["to"], message["text"])
+        with self._lock:
+            self._busy.add(iccid)
+            self._last_send[iccid] = time.monotonic()
+
+        def job(comport):
+            # Runs on the port worker: PDU mode for the send, the SMS read path switches back to text mode
+            if comport is None:
+                return [], "comport_connect_error"
+            if not comport.configure("cmgf", "0"):
+                return [], "pdu_mode_error"
+            references = []
+            for pdu, length in pdus:
+                result, _ = comport.write_prompted(f"AT+CMGS={length}", pdu.encode(), timeout=60)
+                match = CMGS_PATTERN.search(result or "")
+                if not match:
+                    return references, " ".join((result or "timeout").split())
+                references.append(int(match.group(1)))
+            return references, None
+
+        future = self.manager.submit(sim["com_port"], job, PRIORITY_SMS)
+        future.add_done_callback(lambda f: self._on_sent(sim, message, f))
+
+    def _on_sent(self, sim: dict, message: dict, future) -> None:
+        # Done callback on the port worker: bookkeeping only, the update goes through the write batcher
+        iccid = sim["iccid"]
+        try:
+            references, error = future.result()
+        except Exception as e:
+            references, error = [], str(e)
+        now = datetime.now(tz=timezone.utc)
+        with self._lock:
+            self._busy.discard(iccid)
+        # The sim is free again
+        self._wake.set()
+        if error is None:
+            latency = (now - message["created_at"].replace(tzinfo=timezone.utc)).total_seconds()
+            with self._lock:
+                self._sent_times.setdefault(iccid, deque()).append(time.monotonic())
+                self._latencies.append(latency)
+                self._stats["sent"] += 1
+                self._stats["parts"] += len(references)
+            update = {"$set": {
+                "status": STATUS_SENT,
+                "sent_at": now,
+                "parts": [{"reference": reference, "status": STATUS_SENT} for reference in references],
+                "error": None,
+            }, "$inc": {"attempts": 1}}
+            logger.info(f"SMS {message['_id']} sent from {iccid} to {message['to']}, parts: {len(references)}")
+        else:
+            attempts = message.get("attempts", 0) + 1
+            logger.error(f"SMS {message['_id']} from {iccid} failed ({attempts}/{self.max_attempts}): {error}")
+            if attempts >= self.max_attempts:
+                status, next_attempt_at = STATUS_FAILED, None
+            else:
+                # Parts already out are sent again with the whole message: the receiver may see them twice
+                status = STATUS_QUEUED
+                next_attempt_at = now + timedelta(seconds=self.retry_delay * (2 ** (attempts - 1)))
+            with self._lock:
+                self._stats["failed" if status == STATUS_FAILED else "retried"] += 1
+            update = {
+                "$set": {"status": status, "error": error, "next_attempt_at": next_attempt_at},
+                "$inc": {"attempts": 1},
+                "$addToSet": {"failed_iccids": iccid},
+            }
+        self._write_status(message["_id"], update)
+
+    def _write_status(self, message_id: ObjectId, update: dict) -> None:
+        future = outbox_writer.submit(UpdateOne({"_id": message_id, "owner": unique_id}, update))
+
+        def on_written(f):
+            if f.exception() is None:
+                return
+            logger.error(f"Error saving SMS {message_id} status, retrying: {f.exception()}")
+            with self._lock:
+                self._unsaved[message_id] = update
+                self._stats["status_write_errors"] += 1
+            self._wake.set()
+
+        future.add_done_callback(on_written)
+
+    def retry_unsaved(self) -> bool:
+        """
+        Write the status updates whose batch failed, one by one on the dispatcher thread.
+        Returns True when none is left.
+        """
+        with self._lock:
+            unsaved = list(self._unsaved.items())
+        for message_id, update in unsaved:
+            try:
+                self.collection.update_one({"_id": message_id, "owner": unique_id}, update)
+            except Exception as e:
+                logger.error(f"Error saving SMS {message_id} status: {e}")
+                return False
+            with self._lock:
+                self._unsaved.pop(message_id, None)
+        return True
+
+    def on_status_report_indication(self, comport, storage: str, index: int) -> None:
+        """
+        +CDSI job on the port worker: read the stored status report in text mode, delete it,
+        correlate it off the worker.
+        """
+        if comport is None:
+            return
+        if not comport.configure("cmgf", "1") or not comport.configure("cpms", f'"{storage}","SM","SM"'):
+            return
+        result, _ = comport.write(f"AT+CMGR={index}")
+        match = CMGR_STATUS_REPORT_PATTERN.search(result or "")
+        if not match:
+            logger.error(f"Unknown status report {storage} {index} on {comport.port}: {result}")
+            return
+        comport.write(f"AT+CMGD={index}")
+        reference, recipient, st = int(match.group(1)), match.group(2), int(match.group(5))
+        sim = sim_registry.get_by_port(comport.port)
+        if not sim:
+            return
+        self._reports.submit(self.on_status_report, sim["iccid"], reference, st, recipient)
+
+    def on_status_report(self, iccid: str, reference: int, st: int, recipient: str = None) -> Optional[dict]:
+        status = report_status(st)
+        with self._lock:
+            self._stats["reports"] += 1
+        # Message references wrap at 256: the latest message sent from this sim with that reference
+        message = self.collection.find_one_and_update(
+            {"iccid": iccid, "parts.reference": reference, "status": {"$in": [STATUS_SENT, STATUS_DELIVERED]}},
+            {"$set": {"parts.$.status": status, "parts.$.report_st": st, "parts.$.report_at": datetime.now(tz=timezone.utc)}},
+            sort=[("sent_at", -1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if message is None:
+            logger.info(f"Status report for unknown message, iccid: {iccid}, reference: {reference}")
+            return None
+        statuses = {part["status"] for part in message["parts"]}
+        if statuses == {STATUS_DELIVERED}:
+            final = STATUS_DELIVERED
+        elif STATUS_FAILED in statuses:
+            final = STATUS_FAILED
+        else:
+            return message
+        self.collection.update_one(
+            {"_id": message["_id"]},
+            {"$set": {"status": final, "delivered_at" if final == STATUS_DELIVERED else "report_failed_at": datetime.now(tz=timezone.utc)}},
+        )
+        if final == STATUS_DELIVERED:
+            with self._lock:
+                self._stats["delivered"] += 1
+        message["status"] = final
+        return message
+
+    def queue_depth(self) -> int:
+        # count_documents on the status index, refreshed at most every 5 s
+        now = time.monotonic()
+        if now - self._queue_depth["time"] > 5:
+            self._queue_depth = {
+                "value": self.collection.count_documents({"status": {"$in": [STATUS_QUEUED, STATUS_SENDING]}}),
+                "time": now,
+            }
+        return self._queue_depth["value"]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            per_sim = {}
+            for iccid, sent in self._sent_times.items():
+                while sent and now - sent[0] > 60:
+                    sent.popleft()
+                if sent:
+                    per_sim[iccid] = len(sent)
+            latencies = sorted(self._latencies)
+            stats = {
+                **self._stats,
+                "sending": len(self._busy),
+                "per_minute": sum(per_sim.values()),
+                "per_sim_per_minute": per_sim,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+                "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            }
+        try:
+            stats["queue_depth"] = self.queue_depth()
+        except Exception as e:
+            stats["queue_depth"] = None
+            logger.error(f"Error counting SMS outbox: {e}")
+        return stats
@@ -0,0 +1,196 @@
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+
+logger = logging.getLogger(__name__)
+
+
+# collection name -> indexes the bridge queries rely on
+INDEXES: Dict[str, List[IndexModel]] = {
+    "sims": [
+        IndexModel([("iccid", ASCENDING)], name="iccid", unique=True),
+        # SimRegistry.get_by_port, latest snapshot first when two documents still claim the port
+        IndexModel(
+            [("com_port", ASCENDING), ("unique_id", ASCENDING), ("time_update_info_sim", DESCENDING)],
+            name="com_port_unique_id_updated",
+        ),
+        # BalanceScheduler.scan, sorted on balance_next_time
+        IndexModel(
+            [("unique_id", ASCENDING), ("balance_next_time", ASCENDING), ("creg_stat", ASCENDING)],
+            name="balance_due",
+        ),
+        # get_sms_background
+        IndexModel(
+            [("unique_id", ASCENDING), ("sms_scan_status", ASCENDING), ("sms_scan_time", ASCENDING)],
+            name="sms_scan",
+        ),
+        # /sims filters
+        IndexModel([("creg_stat", ASCENDING), ("rssi_dbm", ASCENDING)], name="creg_stat_rssi_dbm"),
+    ],
+    "sms": [
+        # save_sms upsert key: unique, concurrent upserts of one message cannot duplicate it
+        IndexModel(
+            [("cimi", ASCENDING), ("time_received", ASCENDING), ("sender", ASCENDING)],
+            name="sms_key",
+            unique=True,
+        ),
+        # SMSManager.stored_sms
+        IndexModel([("cimi", ASCENDING), ("_id", ASCENDING)], name="cimi_id"),
+    ],
+    "sms_outbox": [
+        # SmsOutbox dispatch, _claim, expire and queue_depth
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt"),
+        # Status report correlation: iccid + message reference, latest first
+        IndexModel(
+            [("iccid", ASCENDING), ("parts.reference", ASCENDING), ("sent_at", DESCENDING)],
+            name="iccid_reference_sent",
+        ),
+    ],
+}
+
+
+def ensure_indexes(db=None) -> dict:
+    """
+    Create the declared indexes, idempotent: existing ones with the same spec are left alone.
+    One failing index (duplicates under a unique key, conflicting options) is logged, the others still go.
+    """
+    if db is None:
+        from config import mongo_lite
+        db = mongo_lite.db
+    result = {"created": [], "failed": {}}
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        for model in models:
+            name = model.document["name"]
+            try:
+                collection.create_indexes([model])
+                result["created"].append(f"{collection_name}.{name}")
+            except Exception as e:
+                logger.error(f"Error creating index {collection_name}.{name}: {e}")
+                result["failed"][f"{collection_name}.{name}"] = str(e)
+    logger.info(f"Indexes ensured: {len(result['created'])}, failed: {len(result['failed'])}")
+    return result
+
+
+def hot_queries(unique_id: str) -> List[dict]:
+    # Same shapes as the code paths named, with placeholder values
+    now = datetime.now(tz=timezone.utc)
+    return [
+        {"name": "sim by iccid", "collection": "sims", "filter": {"iccid": "0"}},
+        {
+            "name": "sim by port",
+            "collection": "sims",
+            "filter": {"com_port": "COM0", "unique_id": unique_id},
+            "sort": [("time_update_info_sim", DESCENDING)],
+        },
+        {
+            "name": "balance due",
+            "collection": "sims",
+            "filter": {
+                "unique_id": unique_id,
+                "com_port": {"$ne": None},
+                "creg_stat": {"$in": [1, 5]},
+                "$or": [
+                    {"balance_next_time": {"$lte": now}},
+                    {"balance_next_time": None, "balance_update_time": None},
+                    {"balance_next_time": None, "balance_update_time": {"$lt": now - timedelta(hours=1)}},
+                ],
+            },
+            "sort": [("balance_next_time", ASCENDING)],
+        },
+        {
+            "name": "sms scan",
+            "collection": "sims",
+            "filter": {
+                "sms_scan_status": True,
+                "sms_scan_time": {"$gt": now - timedelta(minutes=15)},
+                "com_port": {"$ne": None},
+                "unique_id": unique_id,
+            },
+        },
+        {
+            "name": "sms upsert key",
+            "collection": "sms",
+            "filter": {"cimi": "0", "time_received": "0", "sender": "0"},
+        },
+        {"name": "stored sms", "collection": "sms", "filter": {"cimi": "0"}, "sort": [("_id", ASCENDING)]},
+        {
+            "name": "outbox claim",
+            "collection": "sms_outbox",
+            "filter": {"status": "queued", "next_attempt_at": {"$lte": now}},
+            "sort": [("next_attempt_at", ASCENDING)],
+        },
+        {
+            "name": "outbox status report",
+            "collection": "sms_outbox",
+            "filter": {"iccid": "0", "parts.reference": 0, "status": {"$in": ["sent", "delivered"]}},
+            "sort": [("sent_at", DESCENDING)],
+        },
+    ]
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def explain_hot_queries(db=None, unique_id: str = None) -> List[dict]:
+    """
+    explain() every hot query, collscan is True where the winning plan scans the collection.
+    """
+    if db is None:
+        from config import mongo_lite
+        db = mongo_lite.db
+    unique_id = unique_id or os.getenv("UNIQUE_ID", "")
+    report = []
+    for query in hot_queries(unique_id):
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = [stage for stage in _stages(plan) if stage]
+        report.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Ensure the bridge indexes, optionally explain the hot queries")
+    parser.add_argument("--explain", action="store_true", help="explain() the hot queries and flag collection scans")
+    parser.add_argument("--no-create", action="store_true", help="do not create missing indexes")
+    args = parser.parse_args()
+
+    # .env and UNIQUE_ID, like main.py
+    from helpers import startup  # noqa: F401
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.no_create:
+        result = ensure_indexes()
+        for name, error in result["failed"].items():
+            print(f"FAILED  {name}: {error}")
+    if not args.explain:
+        return 0
+    collscans = 0
+    for entry in explain_hot_queries():
+        flag = "COLLSCAN" if entry["collscan"] else "ok"
+        collscans += entry["collscan"]
+        print(f"{flag:9} {entry['collection']:5} {entry['name']:16} {' <- '.join(entry['stages'])}")
+    return 1 if collscans else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
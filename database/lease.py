@@ -0,0 +1,135 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config import mongo_lite
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseManager:
+    """
+    Work claims shared by every bridge on one Mongo:
+      - One document per (kind, key), e.g. ("balance", iccid), in the leases collection
+      - claim() is one find_one_and_update: free, expired or already ours -> ours until now + ttl
+      - A heartbeat thread extends every lease held by this owner each ttl / 3
+      - release() when the job is done; a crashed bridge's leases expire after ttl
+    """
+
+    def __init__(self, collection, owner: Optional[str], ttl: float = 60.0):
+        self.collection = collection
+        self.owner = owner or "unknown"
+        self.ttl = ttl
+        self._held: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"claimed": 0, "contended": 0, "lost": 0, "errors": 0}
+
+    @staticmethod
+    def lease_id(kind: str, key: str) -> str:
+        return f"{kind}:{key}"
+
+    def claim(self, kind: str, key: str) -> bool:
+        lease_id = self.lease_id(kind, key)
+        now = datetime.now(tz=timezone.utc)
+        try:
+            lease = self.collection.find_one_and_update(
+                {"_id": lease_id, "$or": [{"owner": self.owner}, {"expires_at": {"$lte": now}}]},
+                {
+                    "$set": {
+                        "kind": kind,
+                        "key": key,
+                        "owner": self.owner,
+                        "expires_at": now + timedelta(seconds=self.ttl),
+                        "heartbeat_at": now,
+                    },
+                    "$setOnInsert": {"acquired_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The filter missed because another owner holds it, and the upsert hit its _id
+            with self._lock:
+                self.stats["contended"] += 1
+            return False
+        except Exception as e:
+            logger.error(f"Error claiming lease {lease_id}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            return False
+        if lease is None or lease.get("owner") != self.owner:
+            with self._lock:
+                self.stats["contended"] += 1
+            return False
+        with self._lock:
+            self._held.add(lease_id)
+            self.stats["claimed"] += 1
+            self._ensure_started()
+        return True
+
+    def release(self, kind: str, key: str) -> None:
+        lease_id = self.lease_id(kind, key)
+        with self._lock:
+            self._held.discard(lease_id)
+        try:
+            self.collection.delete_one({"_id": lease_id, "owner": self.owner})
+        except Exception as e:
+            # Expires on its own after ttl
+            logger.error(f"Error releasing lease {lease_id}: {e}")
+
+    def holds(self, kind: str, key: str) -> bool:
+        with self._lock:
+            return self.lease_id(kind, key) in self._held
+
+    def heartbeat(self) -> None:
+        with self._lock:
+            held = list(self._held)
+        if not held:
+            return
+        now = datetime.now(tz=timezone.utc)
+        result = self.collection.update_many(
+            {"_id": {"$in": held}, "owner": self.owner},
+            {"$set": {"expires_at": now + timedelta(seconds=self.ttl), "heartbeat_at": now}},
+        )
+        if result.matched_count < len(held):
+            # Expired before this heartbeat (Mongo unreachable too long) and taken by another bridge
+            owned = {lease["_id"] for lease in self.collection.find({"_id": {"$in": held}, "owner": self.owner}, {"_id": 1})}
+            lost = set(held) - owned
+            with self._lock:
+                self._held -= lost
+                self.stats["lost"] += len(lost)
+            logger.error(f"Lost {len(lost)} leases: {sorted(lost)}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "held": len(self._held), "owner": self.owner, "ttl": self.ttl}
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="lease-heartbeat", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.ttl / 3)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Error renewing leases: {e}")
+                with self._lock:
+                    self.stats["errors"] += 1
+
+
+leases = LeaseManager(
+    mongo_lite.lease_collection,
+    owner=os.getenv("UNIQUE_ID"),
+    ttl=float(os.getenv("LEASE_TTL", "60")),
+)
@@ -1,16 +1,26 @@
 
 from config import mongo_lite
+from database.sim_registry import sim_registry
+
+# Called with the iccid whenever a sim document is changed outside the polling loop
+change_listeners = [sim_registry.invalidate]
+
+
+def notify_changed(iccid):
+    for listener in change_listeners:
+        listener(iccid)
 
 
 def delete_com_port(iccid):
     print(f"Delete com port for iccid: {iccid}")
-    sim = mongo_lite.sim_collection.find_one({"iccid": iccid})
+    sim = sim_registry.get(iccid)
     if not sim:
         return False
-    old_com_port = sim["old_com_port"] if "old_com_port" in sim else []
+    old_com_port = list(sim["old_com_port"]) if "old_com_port" in sim else []
     old_com_port.append(sim["com_port"])
     mongo_lite.sim_collection.update_one({"iccid": iccid}, {"$set": {
         "old_com_port": old_com_port,
         "com_port": None
     }}, upsert=True)
+    notify_changed(iccid)
     return True
\ No newline at end of file
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from config import mongo_lite
+
+
+class SimRegistry:
+    """
+    In-process cache of sim documents:
+      - iccid -> sim document, entries expire after ttl seconds, a miss falls back to one find_one
+      - com_port -> iccid is bound by every polling snapshot (bind_port), not taken from cached documents:
+        after a sim swap Mongo can hold two documents with the same com_port until the old one is rewritten
+      - The polling loop merges fresh info into cached entries, hot-plug and sim_db changes invalidate them
+      - Callers get a copy, never the cached dict
+    """
+
+    def __init__(self, collection, unique_id: Optional[str] = None, ttl: float = 30.0):
+        self.collection = collection
+        self.unique_id = unique_id
+        self.ttl = ttl
+        self._sims: Dict[str, dict] = {}
+        self._expires: Dict[str, float] = {}
+        # Bound by bind_port: com_port -> iccid and back
+        self._ports: Dict[str, str] = {}
+        self._port_of: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _cached(self, iccid: str) -> Optional[dict]:
+        sim = self._sims.get(iccid)
+        if sim is None:
+            return None
+        if self._expires.get(iccid, 0.0) < time.monotonic():
+            self._drop(iccid)
+            return None
+        return sim
+
+    def _drop(self, iccid: str) -> None:
+        self._sims.pop(iccid, None)
+        self._expires.pop(iccid, None)
+
+    def _unbind(self, com_port: str) -> Optional[str]:
+        iccid = self._ports.pop(com_port, None)
+        if iccid is not None and self._port_of.get(iccid) == com_port:
+            self._port_of.pop(iccid, None)
+        return iccid
+
+    def get(self, iccid: str) -> Optional[dict]:
+        with self._lock:
+            sim = self._cached(iccid)
+            if sim is not None:
+                self.stats["hits"] += 1
+                return dict(sim)
+            self.stats["misses"] += 1
+        sim = self.collection.find_one({"iccid": iccid})
+        if sim is not None:
+            self.put(sim)
+            return dict(sim)
+        return None
+
+    def get_by_port(self, com_port: str) -> Optional[dict]:
+        with self._lock:
+            iccid = self._ports.get(com_port)
+            sim = self._cached(iccid) if iccid is not None else None
+            if sim is not None:
+                self.stats["hits"] += 1
+                return dict(sim, com_port=com_port)
+        if iccid is not None:
+            sim = self.get(iccid)
+            # The snapshot that bound the port is newer than a document still in the write-behind queue
+            return dict(sim, com_port=com_port) if sim is not None else None
+        with self._lock:
+            self.stats["misses"] += 1
+        # Not polled yet: the most recently polled document claiming the port, never cached under the port
+        query = {"com_port": com_port}
+        if self.unique_id:
+            query["unique_id"] = self.unique_id
+        sim = self.collection.find_one(query, sort=[("time_update_info_sim", -1)])
+        if sim is not None:
+            self.put(sim)
+            return dict(sim)
+        return None
+
+    def bind_port(self, com_port: str, iccid: str) -> Optional[str]:
+        """
+        Record that the sim `iccid` was just read on `com_port`. Returns the iccid previously bound
+        to the port when it was another sim, whose cached entry is dropped.
+        """
+        with self._lock:
+            previous = self._ports.get(com_port)
+            if previous == iccid:
+                return None
+            if previous is not None:
+                self._unbind(com_port)
+                self._drop(previous)
+            old_port = self._port_of.get(iccid)
+            if old_port is not None:
+                self._unbind(old_port)
+            self._ports[com_port] = iccid
+            self._port_of[iccid] = com_port
+            sim = self._sims.get(iccid)
+            if sim is not None:
+                sim["com_port"] = com_port
+            return previous
+
+    def put(self, sim: dict) -> None:
+        iccid = sim.get("iccid")
+        if not iccid:
+            return
+        with self._lock:
+            self._drop(iccid)
+            self._sims[iccid] = dict(sim)
+            self._expires[iccid] = time.monotonic() + self.ttl
+            if self._port_of.get(iccid):
+                self._sims[iccid]["com_port"] = self._port_of[iccid]
+
+    def update(self, iccid: str, fields: dict) -> None:
+        """
+        Merge fields just written to Mongo into a cached entry and refresh its ttl.
+        Nothing is cached from a partial document.
+        """
+        with self._lock:
+            sim = self._cached(iccid)
+            if sim is None:
+                return
+            sim.update(fields)
+            self._expires[iccid] = time.monotonic() + self.ttl
+
+    def invalidate(self, iccid: str) -> None:
+        with self._lock:
+            self._drop(iccid)
+
+    def invalidate_port(self, com_port: str) -> Optional[str]:
+        # Returns the iccid that was bound to the port
+        with self._lock:
+            iccid = self._unbind(com_port)
+            if iccid is not None:
+                self._drop(iccid)
+            return iccid
+
+
+sim_registry = SimRegistry(
+    mongo_lite.sim_collection,
+    unique_id=os.getenv("UNIQUE_ID"),
+    ttl=float(os.getenv("SIM_REGISTRY_TTL", "30")),
+)
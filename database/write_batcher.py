@@ -0,0 +1,179 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from config import mongo_lite
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBatcher:
+    """
+    Write-behind queue in front of one collection:
+      - submit() queues a pymongo write model (UpdateOne, InsertOne, ...) and returns a Future
+      - A flush thread sends unordered bulk_write batches when max_batch ops are queued or the oldest is max_delay old
+      - Every Future resolves once its batch is acknowledged, so a batch is durable as a whole
+      - stats() reports flush metrics
+    """
+
+    def __init__(self, collection, name: str, max_batch: int = 500, max_delay: float = 0.5):
+        self.collection = collection
+        self.name = name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Tuple[object, Future]] = []
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._stats = {
+            "batches": 0,
+            "ops": 0,
+            "errors": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"write-batcher-{self.name}", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, op) -> Future:
+        future: Future = Future()
+        with self._cond:
+            if self._stopped:
+                future.set_exception(RuntimeError(f"Write batcher {self.name} is stopped"))
+                return future
+            self._ensure_started()
+            self._pending.append((op, future))
+            if self._oldest is None:
+                # The flush thread sleeps without a deadline while nothing is queued
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return future
+
+    def flush(self) -> None:
+        # Send what is queued now, on the caller thread
+        while True:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _take(self) -> List[Tuple[object, Future]]:
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        self._oldest = time.monotonic() if self._pending else None
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if len(self._pending) >= self.max_batch:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._stopped:
+                    return
+                batch = self._take()
+            self._write(batch)
+
+    def _write(self, batch: List[Tuple[object, Future]]) -> None:
+        if not batch:
+            return
+        time_start = time.monotonic()
+        errors = {}
+        try:
+            self.collection.bulk_write([op for op, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = error
+            logger.error(f"Bulk write {self.name}: {len(errors)}/{len(batch)} ops failed")
+        except Exception as e:
+            logger.error(f"Bulk write {self.name} failed ({len(batch)} ops): {e}")
+            errors = {i: str(e) for i in range(len(batch))}
+        flush_ms = (time.monotonic() - time_start) * 1000
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["ops"] += len(batch)
+            self._stats["errors"] += len(errors)
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_flush_ms"] = flush_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], flush_ms)
+            self._stats["total_flush_ms"] += flush_ms
+        for i, (_, future) in enumerate(batch):
+            if i in errors:
+                error = errors[i]
+                if isinstance(error, dict) and error.get("code") == 11000:
+                    # Unique index hit, e.g. two upserts of the same SMS racing each other
+                    future.set_exception(DuplicateKeyError(error.get("errmsg", ""), 11000, error))
+                else:
+                    future.set_exception(RuntimeError(f"Bulk write {self.name} error: {error}"))
+            else:
+                future.set_result(True)
+
+
+sim_writer = WriteBatcher(
+    mongo_lite.sim_collection,
+    "sims",
+    max_batch=int(os.getenv("SIM_WRITE_BATCH", "500")),
+    max_delay=float(os.getenv("SIM_WRITE_DELAY", "0.5")),
+)
+# Journaled: SMS may be deleted from the SIM once their batch is acknowledged
+sms_writer = WriteBatcher(
+    mongo_lite.sms_collection.with_options(write_concern=WriteConcern(w=1, j=True)),
+    "sms",
+    max_batch=int(os.getenv("SMS_WRITE_BATCH", "500")),
+    max_delay=float(os.getenv("SMS_WRITE_DELAY", "0.1")),
+)
+
+# Outbound SMS status updates, written from the port worker callbacks
+outbox_writer = WriteBatcher(
+    mongo_lite.outbox_collection,
+    "sms_outbox",
+    max_batch=int(os.getenv("OUTBOX_WRITE_BATCH", "500")),
+    max_delay=float(os.getenv("OUTBOX_WRITE_DELAY", "0.1")),
+)
+
+
+def writer_stats() -> dict:
+    return {
+        "sims": sim_writer.stats(),
+        "sms": sms_writer.stats(),
+        "sms_outbox": outbox_writer.stats(),
+    }
@@ -1,11 +1,13 @@
-import serial, re, traceback
+import traceback
 import time
 from typing import Iterable, Optional
-from helpers import re_string
+from helpers import at_parser, re_string
 from config import mongo_lite
 import logging
 from database import sim_db
+from database.sim_registry import sim_registry
 from datetime import datetime, timezone
+from microservices.port_worker import PRIORITY_BALANCE, PRIORITY_INFO
 
 
 logger = logging.getLogger(__name__)
@@ -16,62 +18,21 @@ def send_at_command_fast(
     baudrate: int = 115200,
     timeout: float = 2.0,
     expected: Optional[Iterable[str]] = ("OK", "ERROR"),
+    priority: int = PRIORITY_INFO,
 ) -> str:
-    expected = tuple(expected) if expected else ()
+    # Runs on the port worker owning `port`, the tty stays open in the ComPortPool
+    from microservices import com_manager
     time_start = time.time()
-    result = None
-    with serial.Serial(
-        port,
-        baudrate,
-        timeout=0.05,     # timeout nhỏ
-        write_timeout=0.2
-    ) as ser:
 
-        ser.reset_input_buffer()
-        ser.write((command + "\r").encode())
-
-        buffer = ""
-        deadline = time.time() + timeout
-
-        while time.time() < deadline:
-            try:
-                line = ser.readline().decode(errors="ignore")
-            except serial.SerialException:
-                break
-
-            if not line:
-                continue
-
-            buffer += line
-
-            if expected and any(token in buffer for token in expected):
-                result = buffer
-                break
-        time_taken = time.time() - time_start
-        return result, time_taken
-# ================================================
-def send_at_command_fast_with_serial(ser: serial.Serial, command: str, timeout: float = 2, expected: Optional[Iterable[str]] = ("OK", "ERROR")):
-    ser.reset_input_buffer()
-    ser.write((command + "\r").encode())
-
-    buffer = ""
-    deadline = time.time() + timeout
-    result = None
-    while time.time() < deadline:
-        try:
-            line = ser.readline().decode(errors="ignore")
-        except serial.SerialException:
-            break
-
-        if not line:
-            continue
-
-        buffer += line
+    def job(comport):
+        if comport is None:
+            return None
+        result, _ = comport.write(command, timeout=timeout, expected=expected)
+        return result
 
-        if expected and any(token in buffer for token in expected):
-            result = buffer
-            break
-    return result
+    result = com_manager.get_com_manager().submit(port, job, priority).result()
+    time_taken = time.time() - time_start
+    return result, time_taken
 
 
 def ping_serial(serial_port):
@@ -88,17 +49,14 @@ def ping_serial(serial_port):
 def get_cops(serial_port):
     try:
         response, time_taken = send_at_command_fast("AT+COPS?", serial_port)
-        str_tmp = response.replace("+COPS: ", "")
-        str_tmp = str_tmp.replace('OK', '').strip()
-        str_tmp = str_tmp.replace('"', '')
-        if "OK" not in response:
-            return str_tmp
-        cops = str_tmp.split(",")
+        cops = at_parser.parse_cops(response)
+        if cops is None:
+            return None
         return {
-            "mode": cops[0],
-            "format": cops[1],
-            "operator": cops[2],
-            "other": cops[3:],
+            "mode": cops.mode,
+            "format": cops.format,
+            "operator": cops.operator,
+            "act": cops.act,
         }
     except Exception as e:
         print(f"Error parsing COPS: {e}")
@@ -109,12 +67,11 @@ def get_cops(serial_port):
 def get_csq(serial_port):
     try:
         response, time_taken = send_at_command_fast("AT+CSQ", serial_port)
-        match = re.search(r'\d+', response)
-        if match:
-            result = int(match.group())
-            return result
-        else:
+        csq = at_parser.parse_csq(response)
+        if csq is None:
             return None
+        # 99 (not known) as before, Csq keeps it as None
+        return csq.rssi if csq.rssi is not None else 99
     except Exception as e:
         print(f"Error parsing CSQ: {e}")
         print(traceback.format_exc())
@@ -123,9 +80,12 @@ def get_csq(serial_port):
 def get_creg(serial_port):
     try:
         response, time_taken = send_at_command_fast("AT+CREG?", serial_port)
-        if "0,5" in response:
+        creg = at_parser.parse_creg(response)
+        if creg is None:
+            return "unknown"
+        if creg.stat == at_parser.RegStat.ROAMING:
             return "roaming"
-        elif "0,1" in response:
+        elif creg.stat == at_parser.RegStat.HOME:
             return "home"
         else:
             return "unknown"    
@@ -149,20 +109,6 @@ def get_cpin(serial_port):
         print(traceback.format_exc())
         return None
     
-def get_iccid(serial):
-    try:
-        response = send_at_command_fast_with_serial(serial, "AT+CCID")
-        if "OK" not in response:
-            return "unknown"
-        iccid = response.replace("+CCID: ", "").replace('OK', '').strip()
-        if iccid == "":
-            return "unknown"
-        return iccid
-    except Exception as e:
-        print(f"Error parsing ICCID: {e}")
-        print(traceback.format_exc())
-        return None
-    
 def get_cnum(serial_port):
     try:
         response, time_taken = send_at_command_fast("AT+CNUM", serial_port)
@@ -176,33 +122,40 @@ def get_cnum(serial_port):
         return None
     
 
-def get_balance(iccid):
+def get_balance(iccid, manager=None):
     try:
-        from microservices.com_manager import ComPort
+        from microservices import com_manager
+        manager = manager or com_manager.get_com_manager()
         # name_func = "[at_command][get_balance]"
-        sim = mongo_lite.sim_collection.find_one({"iccid": iccid})
+        sim = sim_registry.get(iccid)
         if not sim:
             logger.error(f"Sim not found for iccid: {iccid}")
             return "sim_not_found"
         if not sim['com_port']:
             return "comport_not_found"
-        if "0,1" not in sim['creg'] and "0,5" not in sim['creg']:
+        if at_parser.creg_stat(sim) not in at_parser.REGISTERED_STATS:
             # print(f"Sim is not in home network, com port: {sim['com_port']}")
             return "no_network"
         logger.info(f"================================================")
         logger.info(f"Getting balance for sim: {sim['iccid']}, com port: {sim['com_port']}")
-        comport = ComPort(sim["com_port"])
-        
-        _ = comport.connect()
-        if not _:
+
+        def job(comport):
+            if comport is None:
+                return "comport_connect_error", None
+            if not comport.check_iccid(iccid):
+                return "comport_check_iccid_error", None
+            result, time_taken = comport.write('AT+CUSD=1,"*101#",15', timeout=20, expected=("+CUSD:", "ERROR", "+CME ERROR"))
+            return None, result
+
+        error, result = manager.submit(sim["com_port"], job, PRIORITY_BALANCE).result()
+        if error == "comport_connect_error":
             logger.error(f"Error connect com port: {sim['com_port']}, delete com port from database")
+            manager.pool.evict(sim["com_port"])
             sim_db.delete_com_port(iccid)
-            return "comport_connect_error"
-        check_iccid = comport.check_iccid(iccid)
-        if not check_iccid:
+            return error
+        if error == "comport_check_iccid_error":
             logger.info(f"Comport is not the same as iccid: {iccid}")
-            return "comport_check_iccid_error"
-        result, time_taken = comport.write('AT+CUSD=1,"*101#",15', timeout=20, expected=("+CUSD:", "ERROR", "+CME ERROR"))
+            return error
         if result is None:
             logger.error(f"Error getting balance, com port: {sim['com_port']}")
             return "comport_write_error"
@@ -212,17 +165,19 @@ def get_balance(iccid):
         result = "".join(result.splitlines()).replace("+CUSD:", "").strip()
         balance_dict = re_string.balance_to_dict(result, sim['iccid'])
         logger.info(f"Balance: {balance_dict}, com port: {sim['com_port']}")
-        comport.disconnect()
+        balance_save = {
+            "balance": balance_dict['balance'],
+            "balance_update_time": datetime.now(tz=timezone.utc),
+            "phone": balance_dict['phone'],
+            "balance_raw": result
+        }
         mongo_lite.sim_collection.update_one(
             {"iccid": sim['iccid']},
             {
-                "$set": {
-                    "balance": balance_dict['balance'],
-                    "balance_update_time": datetime.now(tz=timezone.utc),
-                    "phone": balance_dict['phone'],
-                    "balance_raw": result
-                }
+                "$set": balance_save
             }, upsert=True)
+        sim_registry.update(sim['iccid'], balance_save)
+        return "ok"
     except Exception as e:
         logger.error(f"Error getting balance: {e}")
         print(traceback.format_exc())
@@ -0,0 +1,165 @@
+import re
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Optional
+
+
+class RegStat(IntEnum):
+    # <stat> of +CREG / +CGREG / +CEREG (3GPP 27.007 7.2)
+    NOT_REGISTERED = 0
+    HOME = 1
+    SEARCHING = 2
+    DENIED = 3
+    UNKNOWN = 4
+    ROAMING = 5
+    HOME_SMS_ONLY = 6
+    ROAMING_SMS_ONLY = 7
+    EMERGENCY_ONLY = 8
+    HOME_CSFB_NOT_PREFERRED = 9
+    ROAMING_CSFB_NOT_PREFERRED = 10
+
+
+# Registered on a network that answers USSD / SMS
+REGISTERED_STATS = (RegStat.HOME, RegStat.ROAMING)
+
+_CSQ_PATTERN = re.compile(r'\+CSQ:\s*(\d+)\s*,\s*(\d+)')
+# Read command form: +CREG: <n>,<stat>[,<lac>,<ci>[,<AcT>]]
+_CREG_PATTERN = re.compile(
+    r'\+CREG:\s*(\d+)\s*,\s*(\d+)(?:\s*,\s*"?([0-9A-Fa-f]*)"?\s*,\s*"?([0-9A-Fa-f]*)"?(?:\s*,\s*(\d+))?)?'
+)
+# +COPS: <mode>[,<format>,<oper>[,<AcT>]]
+_COPS_PATTERN = re.compile(r'\+COPS:\s*(\d+)(?:\s*,\s*(\d+)\s*,\s*"([^"]*)"(?:\s*,\s*(\d+))?)?')
+# +QNWINFO: <act>,<oper>,<band>,<channel>, or +QNWINFO: No Service
+_QNWINFO_PATTERN = re.compile(r'\+QNWINFO:\s*"([^"]*)"\s*,\s*"?([^",]*)"?\s*,\s*"([^"]*)"\s*,\s*(\d+)')
+
+
+@dataclass(frozen=True)
+class Csq:
+    rssi: Optional[int]
+    ber: Optional[int]
+    rssi_dbm: Optional[int]
+
+
+@dataclass(frozen=True)
+class Creg:
+    n: int
+    stat: RegStat
+    lac: Optional[str] = None
+    ci: Optional[str] = None
+    act: Optional[int] = None
+
+    @property
+    def registered(self) -> bool:
+        return self.stat in REGISTERED_STATS
+
+
+@dataclass(frozen=True)
+class Cops:
+    mode: int
+    format: Optional[int] = None
+    operator: Optional[str] = None
+    act: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class Qnwinfo:
+    act: str
+    operator: str
+    band: str
+    channel: int
+
+
+def rssi_to_dbm(rssi: int) -> Optional[int]:
+    # 0: -113 dBm or less, 2..30: -109..-53 dBm, 31: -51 dBm or more, 99: not known
+    if 0 <= rssi <= 31:
+        return -113 + 2 * rssi
+    return None
+
+
+def parse_csq(response: str) -> Optional[Csq]:
+    match = _CSQ_PATTERN.search(response or "")
+    if not match:
+        return None
+    rssi, ber = int(match.group(1)), int(match.group(2))
+    return Csq(
+        rssi=None if rssi == 99 else rssi,
+        ber=None if ber == 99 else ber,
+        rssi_dbm=rssi_to_dbm(rssi),
+    )
+
+
+def parse_creg(response: str) -> Optional[Creg]:
+    match = _CREG_PATTERN.search(response or "")
+    if not match:
+        return None
+    n, stat, lac, ci, act = match.groups()
+    try:
+        stat = RegStat(int(stat))
+    except ValueError:
+        stat = RegStat.UNKNOWN
+    return Creg(
+        n=int(n),
+        stat=stat,
+        lac=lac or None,
+        ci=ci or None,
+        act=int(act) if act else None,
+    )
+
+
+def parse_cops(response: str) -> Optional[Cops]:
+    match = _COPS_PATTERN.search(response or "")
+    if not match:
+        return None
+    mode, fmt, operator, act = match.groups()
+    return Cops(
+        mode=int(mode),
+        format=int(fmt) if fmt else None,
+        operator=operator,
+        act=int(act) if act else None,
+    )
+
+
+def parse_qnwinfo(response: str) -> Optional[Qnwinfo]:
+    match = _QNWINFO_PATTERN.search(response or "")
+    if not match:
+        return None
+    act, operator, band, channel = match.groups()
+    return Qnwinfo(act=act, operator=operator, band=band, channel=int(channel))
+
+
+def creg_stat(sim: dict) -> Optional[int]:
+    """
+    Registration state of a sim document: the stored creg_stat, or parsed from the raw
+    +CREG line for documents saved before creg_stat existed.
+    """
+    stat = sim.get("creg_stat")
+    if stat is not None:
+        return stat
+    creg = parse_creg(sim.get("creg") or "")
+    return int(creg.stat) if creg else None
+
+
+def snapshot_fields(values: dict) -> dict:
+    """
+    Typed fields for a sim snapshot (raw csq / creg / cops / cpsi strings), stored next to
+    the raw strings so Mongo can index and range-query them. Plain ints: no enum in BSON.
+    """
+    fields = {
+        "rssi": None, "rssi_dbm": None, "ber": None,
+        "creg_stat": None, "lac": None, "ci": None,
+        "operator": None, "cops_act": None,
+        "network_act": None, "band": None, "channel": None,
+    }
+    csq = parse_csq(values.get("csq"))
+    if csq:
+        fields.update(rssi=csq.rssi, rssi_dbm=csq.rssi_dbm, ber=csq.ber)
+    creg = parse_creg(values.get("creg"))
+    if creg:
+        fields.update(creg_stat=int(creg.stat), lac=creg.lac, ci=creg.ci)
+    cops = parse_cops(values.get("cops"))
+    if cops:
+        fields.update(operator=cops.operator, cops_act=cops.act)
+    qnwinfo = parse_qnwinfo(values.get("cpsi"))
+    if qnwinfo:
+        fields.update(network_act=qnwinfo.act, band=qnwinfo.band, channel=qnwinfo.channel)
+    return fields
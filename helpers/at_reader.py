@@ -0,0 +1,79 @@
+import time
+from typing import Callable, Iterable, Optional
+
+
+# Always final, whatever the caller expects (3GPP 27.007 / 27.005)
+ERROR_RESULT_CODES = ("+CME ERROR", "+CMS ERROR")
+
+
+class AtResponseReader:
+    """
+    Collects one AT response and detects its final result code:
+      - Bytes accumulate in a bytearray, every line is looked at once: linear in the response size
+      - Only complete lines are matched, an SMS body containing "OK" or "ERROR" does not end the read
+      - "OK" / "ERROR" must be the whole line, "+..." tokens (+CUSD:, +CME ERROR) match as a line prefix
+      - Lines starting with urc_prefixes go to on_urc and stay out of the response
+      - Decoded once, by text()
+    """
+
+    def __init__(
+        self,
+        expected: Optional[Iterable[str]] = ("OK", "ERROR"),
+        on_urc: Optional[Callable[[str], None]] = None,
+        urc_prefixes: tuple = ("+CMTI:",),
+    ):
+        tokens = tuple(expected) if expected else ()
+        self._exact = tuple(t.encode() for t in tokens if not t.startswith("+"))
+        self._prefixes = tuple(t.encode() for t in tokens if t.startswith("+"))
+        if tokens:
+            self._prefixes += tuple(t.encode() for t in ERROR_RESULT_CODES)
+        self._on_urc = on_urc
+        self._urc_prefixes = tuple(p.encode() for p in urc_prefixes)
+        self._pending = bytearray()
+        self._response = bytearray()
+        self.done = False
+        # Bytes received after the final line (usually a URC), for the caller to keep
+        self.leftover = b""
+
+    def feed(self, data: bytes) -> bool:
+        if self.done:
+            self.leftover += data
+            return True
+        pending = self._pending
+        pending.extend(data)
+        start = 0
+        while True:
+            end = pending.find(b"\n", start)
+            if end < 0:
+                break
+            line = pending[start:end + 1]
+            start = end + 1
+            stripped = bytes(line).strip()
+            if self._on_urc is not None and stripped.startswith(self._urc_prefixes):
+                self._on_urc(stripped.decode(errors="ignore"))
+                continue
+            self._response += line
+            if stripped in self._exact or (self._prefixes and stripped.startswith(self._prefixes)):
+                self.done = True
+                self.leftover = bytes(pending[start:])
+                start = len(pending)
+                break
+        del pending[:start]
+        return self.done
+
+    def text(self) -> str:
+        return self._response.decode(errors="ignore")
+
+
+def read_with(reader: AtResponseReader, ser, timeout: float) -> Optional[str]:
+    """
+    Feed `reader` from a serial.Serial until a final result code. None on timeout.
+    Blocks in ser.read() (select on POSIX) instead of spinning on readline().
+    SerialException is left to the caller.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        data = ser.read(ser.in_waiting or 1)
+        if data and reader.feed(data):
+            return reader.text()
+    return None
@@ -0,0 +1,83 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+
+@dataclass(frozen=True)
+class ModemProfile:
+    name: str
+    # USB interface number of the AT command port, None when the device has a single tty
+    at_interface: Optional[int] = None
+    # Takes several commands on one line (AT+CPIN?;+CREG?;...), False forces one command per round trip
+    compound_at: bool = True
+
+
+# (VID, PID) -> profile
+MODEM_PROFILES: Dict[tuple, ModemProfile] = {
+    # Quectel: 0 DIAG, 1 NMEA, 2 AT, 3 modem
+    (0x2C7C, 0x0125): ModemProfile("Quectel EC25", at_interface=2),
+    (0x2C7C, 0x0121): ModemProfile("Quectel EC21", at_interface=2),
+    (0x2C7C, 0x0195): ModemProfile("Quectel EG95", at_interface=2),
+    (0x2C7C, 0x0296): ModemProfile("Quectel BG96", at_interface=2),
+    # SIMCom: 0 DIAG, 1 NMEA, 2 AT, 3 modem, 4 audio
+    (0x1E0E, 0x9001): ModemProfile("SIMCom SIM7600", at_interface=2),
+    # USB-UART bridges in front of SIM800 / SIM900 boards: one tty per modem
+    (0x1A86, 0x7523): ModemProfile("CH340 serial modem"),
+    (0x10C4, 0xEA60): ModemProfile("CP210x serial modem"),
+    (0x0403, 0x6001): ModemProfile("FTDI serial modem"),
+    (0x067B, 0x2303): ModemProfile("PL2303 serial modem"),
+}
+
+# hwid of the ports added from EXTRA_SERIAL_PORTS (microservices.hotplug): always probed
+EXTRA_PORT_HWID = "EXTRA_SERIAL_PORTS"
+
+# "1-1.2:1.3" (Linux) / "1-1.2:x.3" (Windows): physical path, then configuration.interface
+_LOCATION_PATTERN = re.compile(r'^(?P<path>[^:]+):[^.]*\.(?P<interface>\d+)$')
+
+
+def profile_for(port) -> Optional[ModemProfile]:
+    if port.vid is None or port.pid is None:
+        return None
+    return MODEM_PROFILES.get((port.vid, port.pid))
+
+
+def usb_interface(port) -> Optional[int]:
+    match = _LOCATION_PATTERN.match(port.location or "")
+    return int(match.group("interface")) if match else None
+
+
+def physical_key(port) -> str:
+    """
+    Same key for every tty of one physical modem.
+    """
+    match = _LOCATION_PATTERN.match(port.location or "")
+    if match:
+        return f"usb:{match.group('path')}"
+    if port.serial_number:
+        return f"sn:{port.vid}:{port.pid}:{port.serial_number}"
+    return f"dev:{port.device}"
+
+
+def group_ports(ports: Iterable) -> Dict[str, List]:
+    groups: Dict[str, List] = {}
+    for port in ports:
+        groups.setdefault(physical_key(port), []).append(port)
+    for siblings in groups.values():
+        siblings.sort(key=lambda port: (usb_interface(port) is None, usb_interface(port) or 0, port.device))
+    return groups
+
+
+def is_at_candidate(port) -> bool:
+    """
+    False for the sibling interfaces (DIAG, NMEA, modem) of a known profile.
+    Unknown devices stay candidates, the probe finds out.
+    """
+    if port.hwid == EXTRA_PORT_HWID:
+        return True
+    profile = profile_for(port)
+    if profile is None:
+        return "USB" in (port.description or "")
+    if profile.at_interface is None:
+        return True
+    interface = usb_interface(port)
+    return interface is None or interface == profile.at_interface
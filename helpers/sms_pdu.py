@@ -0,0 +1,145 @@
+import random
+import re
+from typing import List, Tuple
+
+
+# GSM 03.38 default alphabet, index = septet value
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Extension table, sent as ESC (0x1B) + septet
+GSM7_EXTENSION = {"\f": 0x0A, "^": 0x14, "{": 0x28, "}": 0x29, "\\": 0x2F, "[": 0x3C, "~": 0x3D, "]": 0x3E, "|": 0x40, "€": 0x65}
+_GSM7_INDEX = {char: i for i, char in enumerate(GSM7_BASIC)}
+
+# Destination number: international (+84...) or national digits, nothing else reaches AT+CMGS / the PDU
+PHONE_NUMBER_PATTERN = re.compile(r'^\+?\d{3,15}$')
+
+ENCODING_GSM7 = "gsm7"
+ENCODING_UCS2 = "ucs2"
+
+# (single message, per part of a concatenated message): septets for GSM 7-bit, UTF-16 units for UCS2
+PART_LIMITS = {ENCODING_GSM7: (160, 153), ENCODING_UCS2: (70, 67)}
+# Concatenation UDH: IEI 00 (8-bit reference), length 3, reference, total, sequence
+UDH_LENGTH = 6
+
+
+def is_phone_number(number) -> bool:
+    return isinstance(number, str) and PHONE_NUMBER_PATTERN.match(number) is not None
+
+
+def is_gsm7(text: str) -> bool:
+    return all(char in _GSM7_INDEX or char in GSM7_EXTENSION for char in text)
+
+
+def gsm7_septets(text: str) -> List[int]:
+    septets = []
+    for char in text:
+        if char in _GSM7_INDEX:
+            septets.append(_GSM7_INDEX[char])
+        else:
+            septets.extend((0x1B, GSM7_EXTENSION[char]))
+    return septets
+
+
+def split_text(text: str) -> Tuple[str, List[list]]:
+    """
+    Encoding and the units (septets / UTF-16 code units) of every part.
+    Parts never end between an escape and its character, or inside a surrogate pair.
+    """
+    if is_gsm7(text):
+        encoding, units = ENCODING_GSM7, gsm7_septets(text)
+    else:
+        encoding, raw = ENCODING_UCS2, text.encode("utf-16-be")
+        units = [int.from_bytes(raw[i:i + 2], "big") for i in range(0, len(raw), 2)]
+    single, per_part = PART_LIMITS[encoding]
+    if len(units) <= single:
+        return encoding, [units]
+    parts, start = [], 0
+    while start < len(units):
+        end = min(start + per_part, len(units))
+        if end < len(units):
+            last = units[end - 1]
+            if (encoding == ENCODING_GSM7 and last == 0x1B) or (encoding == ENCODING_UCS2 and 0xD800 <= last <= 0xDBFF):
+                end -= 1
+        parts.append(units[start:end])
+        start = end
+    return encoding, parts
+
+
+def pack_septets(septets: List[int], fill_bits: int = 0) -> bytes:
+    # LSB first, fill_bits zero bits in front to align after a UDH
+    out = bytearray()
+    acc, bits = 0, fill_bits
+    for septet in septets:
+        acc |= septet << bits
+        bits += 7
+        while bits >= 8:
+            out.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+    if bits:
+        out.append(acc & 0xFF)
+    return bytes(out)
+
+
+def encode_address(number: str) -> bytes:
+    digits = "".join(char for char in number if char.isdigit())
+    address_type = 0x91 if number.startswith("+") else 0x81
+    padded = digits + ("F" if len(digits) % 2 else "")
+    swapped = "".join(padded[i + 1] + padded[i] for i in range(0, len(padded), 2))
+    return bytes([len(digits), address_type]) + bytes.fromhex(swapped)
+
+
+def new_reference() -> int:
+    return random.randint(0, 255)
+
+
+def encode_submit(
+    to: str,
+    units: list,
+    encoding: str,
+    reference: int = 0,
+    total: int = 1,
+    sequence: int = 1,
+    status_report: bool = True,
+) -> Tuple[str, int]:
+    """
+    SMS-SUBMIT PDU for AT+CMGS in PDU mode (AT+CMGF=0).
+    Returns (hex with the default SMSC prefix "00", TPDU length in octets for AT+CMGS=<length>).
+    """
+    first_octet = 0x01 | 0x10  # SMS-SUBMIT, relative validity period
+    if status_report:
+        first_octet |= 0x20
+    udh = b""
+    if total > 1:
+        first_octet |= 0x40
+        udh = bytes([UDH_LENGTH - 1, 0x00, 0x03, reference & 0xFF, total, sequence])
+    if encoding == ENCODING_GSM7:
+        dcs = 0x00
+        udh_septets = (len(udh) * 8 + 6) // 7
+        fill_bits = udh_septets * 7 - len(udh) * 8
+        user_data = udh + pack_septets(units, fill_bits)
+        user_data_length = udh_septets + len(units)
+    else:
+        dcs = 0x08
+        user_data = udh + b"".join(unit.to_bytes(2, "big") for unit in units)
+        user_data_length = len(user_data)
+    tpdu = (
+        bytes([first_octet, 0x00])  # message reference set by the modem
+        + encode_address(to)
+        + bytes([0x00, dcs, 0xAA])  # PID, DCS, validity 4 days
+        + bytes([user_data_length])
+        + user_data
+    )
+    return "00" + tpdu.hex().upper(), len(tpdu)
+
+
+def encode_message(to: str, text: str, status_report: bool = True) -> List[Tuple[str, int]]:
+    # One (pdu, length) per part, concatenated with a shared random reference when it does not fit one SMS
+    encoding, parts = split_text(text)
+    reference = new_reference()
+    return [
+        encode_submit(to, units, encoding, reference, len(parts), sequence, status_report)
+        for sequence, units in enumerate(parts, 1)
+    ]
@@ -9,6 +9,7 @@ from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI
 from config import mongo_lite
+from database import indexes
 from microservices import com_manager
 from routes import register_routes
 from services import ably_listen
@@ -17,6 +18,7 @@ from services import ably_listen
 async def lifespan(_: FastAPI):
     # 2. Đưa logic khởi chạy của bạn vào đây
     print("Starting GSM Bridge...")
+    indexes.ensure_indexes()
     com_manager.start_com_manager()
     ably_listen.start_ably_listen()
     # mongo_manager = mongo_lite.sim_collection
@@ -0,0 +1,172 @@
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Set
+
+from pymongo import UpdateOne
+
+from config import mongo_lite
+from database.lease import leases
+from database.sim_registry import sim_registry
+from database.write_batcher import sim_writer
+from helpers import at_command, at_parser
+
+
+logger = logging.getLogger(__name__)
+unique_id = os.environ["UNIQUE_ID"]
+
+
+class BalanceScheduler:
+    """
+    USSD balance refresh for the whole fleet:
+      - Due sims (balance_next_time passed, or never refreshed) are loaded every scan_interval into a queue
+      - Up to `concurrency` USSD sessions run at once, at most one per com port (the port worker serialises them anyway)
+      - Sessions to one operator start at least operator_interval apart, to stay under network throttling
+      - Only sims on this bridge (unique_id), each session holds a "balance" lease so no two bridges run it
+      - balance_next_time = refresh_interval (retry_delay after a failure) +- jitter, so sims do not go stale together
+      - stats() reports queue depth, in-flight sessions, throughput and results
+    """
+
+    def __init__(
+        self,
+        manager,
+        concurrency: int = 16,
+        operator_interval: float = 2.0,
+        refresh_interval: float = 3600.0,
+        retry_delay: float = 300.0,
+        jitter: float = 0.2,
+        scan_interval: float = 5.0,
+        scan_limit: int = 500,
+    ):
+        self.manager = manager
+        self.concurrency = concurrency
+        self.operator_interval = operator_interval
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self.jitter = jitter
+        self.scan_interval = scan_interval
+        self.scan_limit = scan_limit
+        self.tick_interval = 0.2
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="balance")
+        self._lock = threading.Lock()
+        # iccid -> sim (iccid, com_port, operator), in due order
+        self._queue: Dict[str, dict] = {}
+        # Until balance_next_time is written, so a rescan does not pick the sim again
+        self._in_flight: Set[str] = set()
+        self._busy_ports: Set[str] = set()
+        self._operator_next: Dict[str, float] = {}
+        self._last_scan = 0.0
+        self._completed = deque()
+        self._stats = {"started": 0, "ok": 0, "failed": 0, "results": {}, "last_scan_due": 0}
+
+    def run(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._last_scan >= self.scan_interval:
+                    self.scan()
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Error scheduling balance: {e}")
+                logger.error(traceback.format_exc())
+            time.sleep(self.tick_interval)
+
+    def scan(self) -> None:
+        self._last_scan = time.monotonic()
+        now = datetime.now(tz=timezone.utc)
+        query = {
+            "unique_id": unique_id,
+            "com_port": {"$ne": None},
+            # USSD needs a registered sim, no point in queueing the others
+            "creg_stat": {"$in": [int(stat) for stat in at_parser.REGISTERED_STATS]},
+            "$or": [
+                {"balance_next_time": {"$lte": now}},
+                {"balance_next_time": None, "balance_update_time": None},
+                {"balance_next_time": None, "balance_update_time": {"$lt": now - timedelta(seconds=self.refresh_interval)}},
+            ],
+        }
+        projection = {"_id": 0, "iccid": 1, "com_port": 1, "operator": 1}
+        cursor = mongo_lite.sim_collection.find(query, projection).sort("balance_next_time", 1).limit(self.scan_limit)
+        due = {sim["iccid"]: sim for sim in cursor if sim.get("iccid")}
+        with self._lock:
+            # Rebuilt on every scan: sims that moved port or went away drop out
+            self._queue = {iccid: sim for iccid, sim in due.items() if iccid not in self._in_flight}
+            self._stats["last_scan_due"] = len(due)
+        if due:
+            logger.info(f"Found {len(due)} sims to get balance, {len(self._in_flight)} in flight")
+
+    def dispatch(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for iccid, sim in list(self._queue.items()):
+                if len(self._in_flight) >= self.concurrency:
+                    break
+                port = sim.get("com_port")
+                operator = sim.get("operator") or "unknown"
+                if port in self._busy_ports or self._operator_next.get(operator, 0.0) > now:
+                    continue
+                self._operator_next[operator] = now + self.operator_interval
+                del self._queue[iccid]
+                self._in_flight.add(iccid)
+                self._busy_ports.add(port)
+                self._stats["started"] += 1
+                self.executor.submit(self._refresh, iccid, port)
+
+    def _refresh(self, iccid: str, port: str) -> None:
+        result = None
+        if not leases.claim("balance", iccid):
+            # Another bridge is on it and writes balance_next_time when done
+            with self._lock:
+                self._busy_ports.discard(port)
+                results = self._stats["results"]
+                results["leased_elsewhere"] = results.get("leased_elsewhere", 0) + 1
+                self._in_flight.discard(iccid)
+            return
+        try:
+            result = at_command.get_balance(iccid, self.manager)
+        except Exception as e:
+            logger.error(f"Error getting balance for {iccid}: {e}")
+        finally:
+            with self._lock:
+                self._busy_ports.discard(port)
+        ok = result == "ok"
+        delay = self.refresh_interval if ok else self.retry_delay
+        next_time = datetime.now(tz=timezone.utc) + timedelta(seconds=delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+        with self._lock:
+            self._stats["ok" if ok else "failed"] += 1
+            results = self._stats["results"]
+            results[str(result)] = results.get(str(result), 0) + 1
+            self._completed.append(time.monotonic())
+        try:
+            future = sim_writer.submit(UpdateOne({"iccid": iccid}, {"$set": {"balance_next_time": next_time}}))
+            sim_registry.update(iccid, {"balance_next_time": next_time})
+            # Done callbacks run on the batcher flush thread, keep the lease round trip off it
+            future.add_done_callback(lambda f: self.executor.submit(self._release, iccid))
+        except Exception as e:
+            logger.error(f"Error scheduling next balance for {iccid}: {e}")
+            self._release(iccid)
+
+    def _release(self, iccid: str) -> None:
+        leases.release("balance", iccid)
+        with self._lock:
+            self._in_flight.discard(iccid)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            while self._completed and now - self._completed[0] > 60:
+                self._completed.popleft()
+            return {
+                **self._stats,
+                "results": dict(self._stats["results"]),
+                "queue_depth": len(self._queue),
+                "in_flight": len(self._in_flight),
+                "busy_ports": len(self._busy_ports),
+                "per_minute": len(self._completed),
+                "concurrency": self.concurrency,
+            }
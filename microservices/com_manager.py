@@ -1,14 +1,26 @@
+from concurrent.futures import Future, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
-from typing import Iterable, Optional
+from typing import Dict, Iterable, Optional
 import serial
-import serial.tools.list_ports
 import os
 from config import mongo_lite
-from helpers import at_command, re_string
+from helpers import at_parser, modem_profile, re_string
+from helpers.at_reader import AtResponseReader, read_with
+import re
 import time, logging
 import threading
 import traceback
 from database import sim_db
+from database.lease import leases
+from database.sim_registry import sim_registry
+from database.write_batcher import sim_writer
+from pymongo import UpdateOne
+from microservices.balance_scheduler import BalanceScheduler
+from microservices.hotplug import HotplugWatcher
+from microservices.probe_cache import ProbeCache, PROBE_NO_ANSWER, PROBE_NOT_READY
+from microservices.port_worker import PortWorker, PRIORITY_INFO, PRIORITY_INTERACTIVE, PRIORITY_SMS
+from microservices.urc_watcher import UrcWatcher
 
 
 logger = logging.getLogger(__name__)
@@ -16,21 +28,141 @@ print_log = False
 unique_id = os.environ["UNIQUE_ID"]
 
 
+# Refreshed on every snapshot, not compared by the change detection in ComManager._info_update
+INFO_VOLATILE_FIELDS = ("time_update_info_sim", "time_save")
+# Rewritten by every heartbeat: another bridge may have taken the document over since our last write
+INFO_OWNER_FIELDS = ("unique_id", "com_port")
+# Unsolicited result codes handled by ComPort.urc_handler (new SMS indications)
+URC_PREFIXES = ("+CMTI:", "+CMT:", "+CDSI:")
+# Single line URCs, taken out of command responses by AtResponseReader
+READER_URC_PREFIXES = ("+CMTI:", "+CDSI:")
+# Printed by the modem after a reset (UART boards keep the tty open): configured state is gone
+RESET_URCS = ("RDY", "+CFUN: 1")
+# ComPort.session setting -> command that applies it
+SESSION_COMMANDS = {
+    "cscs": 'AT+CSCS="{}"',
+    "cmgf": "AT+CMGF={}",
+    "cpms": "AT+CPMS={}",
+    "cnmi": "AT+CNMI={}",
+}
+# Preferred storage for reading, writing and receiving SMS
+SMS_STORAGE = '"SM","SM","SM"'
+# Sim snapshot as one command line, answered in one round trip. +QNWINFO is last: firmwares
+# without it (SIMCom, SIM800) answer ERROR there after the other responses
+INFO_COMPOUND_COMMAND = "AT+CPIN?;+CREG?;+COPS?;+CCID;+CSQ;+CIMI;+QNWINFO"
+# Response line prefix -> snapshot field
+INFO_COMPOUND_PREFIXES = {
+    "+CPIN:": "cpin",
+    "+CREG:": "creg",
+    "+COPS:": "cops",
+    "+CCID:": "iccid",
+    "+ICCID:": "iccid",
+    "+QCCID:": "iccid",
+    "+CSQ:": "csq",
+    "+CIMI:": "cimi",
+    "+QNWINFO:": "cpsi",
+}
+# Snapshot fields stored without their response prefix
+INFO_BARE_FIELDS = ("iccid", "cimi")
+INFO_COMPOUND_REQUIRED = ("cpin", "creg", "cops", "iccid", "csq", "cimi")
+
+
 def replace_data(str):
     str_tmp = str.replace("+CPIN: ", "").replace('OK', '').strip()
     return str_tmp
 
+
+def split_info_snapshot(result: str) -> dict:
+    """
+    Split the answer to INFO_COMPOUND_COMMAND into fields, formatted like the one command per
+    round trip path (replace_data). ICCID and IMSI are stored bare, with or without a prefix
+    (+CCID:, +ICCID:, +QCCID:, +CIMI:): a bare digit line is the IMSI (15 digits) or the ICCID (19-20 digits).
+    """
+    values = {}
+    for line in result.splitlines():
+        line = line.strip()
+        if not line or line in ("OK", "ERROR") or line.startswith(("+CME ERROR", "+CMS ERROR")):
+            continue
+        prefix = line.split(" ", 1)[0]
+        key = INFO_COMPOUND_PREFIXES.get(prefix)
+        if key == "cpin":
+            values["cpin"] = replace_data(line)
+        elif key in INFO_BARE_FIELDS:
+            values[key] = line[len(prefix):].strip()
+        elif key is not None:
+            values[key] = line
+        elif line.isdigit():
+            values["iccid" if len(line) > 16 else "cimi"] = line
+    return values
+
+
+def parse_iccid(result: Optional[str]) -> Optional[str]:
+    # Only the +CCID: (+ICCID:, +QCCID:) line or a bare ICCID line, whatever else the buffer holds
+    if not result or "OK" not in result:
+        return None
+    return split_info_snapshot(result).get("iccid")
+
+
+def parse_cimi(result: Optional[str]) -> Optional[str]:
+    # The IMSI line of an AT+CIMI answer, prefixed (+CIMI:) or bare, like split_info_snapshot
+    if not result or "OK" not in result:
+        return None
+    return split_info_snapshot(result).get("cimi")
+
+
 class ComPort:
-    def __init__(self, port):
+    def __init__(self, port, baudrate: int = 115200):
         self.port = port
+        self.baudrate = baudrate
         self.ser = None
-        
+        # Serialises access to the handle when it is shared through ComPortPool
+        self.lock = threading.RLock()
+        self.last_used = 0.0
+        # urc_handler(comport, line, body) is called on the owning thread for +CMTI / +CMT
+        self.urc_handler = None
+        # Settings the modem has acknowledged on this handle (SESSION_COMMANDS name -> value)
+        self.session: Dict[str, str] = {}
+        self._urc_buffer = b""
+        # None: not known yet, the first sim snapshot tries the compound command
+        self.compound_at: Optional[bool] = None
+
+    def is_open(self) -> bool:
+        return self.ser is not None and self.ser.is_open
+
+    @property
+    def cnmi_enabled(self) -> bool:
+        return "cnmi" in self.session
+
+    def configure(self, name: str, value: str) -> bool:
+        """
+        Apply a SESSION_COMMANDS setting unless the modem already has it.
+        The caller must own the port.
+        """
+        if self.session.get(name) == value:
+            return True
+        command = SESSION_COMMANDS[name].format(value)
+        result, _ = self.write(command)
+        if result is None or "OK" not in result.split():
+            logger.error(f"Error configuring {self.port}, {command}: {result}")
+            self.session.pop(name, None)
+            return False
+        self.session[name] = value
+        return True
+
+    def reset_session(self) -> None:
+        # Reconnect, modem reset or a command failing on the assumed state: configure again
+        self.session = {}
+
     def connect(self, max_wait=10.0, retry_delay=0.5):
         start_time = time.time()
         deadline = start_time + max_wait
         while time.time() < deadline:
             try:
-                self.ser = serial.Serial(self.port, 115200, timeout=1)
+                self.ser = serial.Serial(self.port, self.baudrate, timeout=1)
+                self.last_used = time.monotonic()
+                # The modem may have been reset while the handle was down, configure it again
+                self.reset_session()
+                self._urc_buffer = b""
                 return True
             except serial.SerialException as e:
                 if "PermissionError" in str(e):
@@ -41,6 +173,7 @@ class ComPort:
                     logger.error(f"The system cannot find the file specified, return False")
                     return False
                 logger.error(f"Error connecting to com port 123124523: {self.port}: {e}")
+                time.sleep(retry_delay)
             except Exception as e:
                 print(f"Error connecting to com port {self.port}: {e}")
                 print(traceback.format_exc())
@@ -52,51 +185,136 @@ class ComPort:
         if self.ser is None:
             logger.error(f"Com port {self.port} is not connected")
             return None, None
-        expected = tuple(expected) if expected else ()
         time_start = time.time()
-        result = None
         try:
-            self.ser.reset_input_buffer()
+            if self.urc_handler is not None:
+                # Pending bytes may hold a +CMTI, dispatch it instead of throwing it away
+                self.poll_urcs()
+            else:
+                self.ser.reset_input_buffer()
             self.ser.write((command + "\r").encode())
-            buffer = ""
-            deadline = time.time() + timeout
-
-            while time.time() < deadline:
-                try:
-                    line = self.ser.readline().decode(errors="ignore")
-                except serial.SerialException:
-                    break
-
-                if not line:
-                    continue
-
-                buffer += line
-
-                if expected and any(token in buffer for token in expected):
-                    result = buffer
-                    break
+            reader = AtResponseReader(expected, self._emit_urc if self.urc_handler is not None else None, READER_URC_PREFIXES)
+            result = read_with(reader, self.ser, timeout)
+            if reader.leftover:
+                self._urc_buffer += reader.leftover
             time_taken = time.time() - time_start
             return result, time_taken
+        except (serial.SerialException, OSError) as e:
+            # Handle is dead (unplugged / re-enumerated), the pool reconnects on next use
+            logger.error(f"Error writing to com port {self.port}: {e}")
+            self.disconnect()
+            return None, None
         except Exception as e:
             logger.error(f"Error writing to com port {self.port}: {e}")
             return None, None
         
     
+    def write_prompted(self, command, payload: bytes, timeout: float = 60.0, prompt_timeout: float = 5.0):
+        """
+        Two step commands (AT+CMGS): send the command, wait for the "> " prompt, send payload + Ctrl-Z,
+        then read the final result code. Same return as write().
+        """
+        if self.ser is None:
+            logger.error(f"Com port {self.port} is not connected")
+            return None, None
+        time_start = time.time()
+        try:
+            if self.urc_handler is not None:
+                self.poll_urcs()
+            else:
+                self.ser.reset_input_buffer()
+            self.ser.write((command + "\r").encode())
+            # The prompt has no line end, the line reader cannot see it
+            buffer = b""
+            deadline = time.monotonic() + prompt_timeout
+            while b">" not in buffer:
+                if b"ERROR" in buffer or time.monotonic() >= deadline:
+                    # ESC leaves the prompt without sending, in case it shows up late
+                    self.ser.write(b"\x1b")
+                    logger.error(f"No prompt for {command} on {self.port}: {buffer!r}")
+                    return (buffer.decode(errors="ignore") or None), time.time() - time_start
+                buffer += self.ser.read(self.ser.in_waiting or 1)
+            self.ser.write(payload + b"\x1a")
+            reader = AtResponseReader(("OK", "ERROR"), self._emit_urc if self.urc_handler is not None else None, READER_URC_PREFIXES)
+            result = read_with(reader, self.ser, timeout)
+            if reader.leftover:
+                self._urc_buffer += reader.leftover
+            return result, time.time() - time_start
+        except (serial.SerialException, OSError) as e:
+            logger.error(f"Error writing to com port {self.port}: {e}")
+            self.disconnect()
+            return None, None
+        except Exception as e:
+            logger.error(f"Error writing to com port {self.port}: {e}")
+            return None, None
+
+    def poll_urcs(self) -> None:
+        """
+        Read whatever is waiting on the port and dispatch complete URC lines.
+        The caller must own the port. Costs one ioctl when nothing is waiting.
+        """
+        if self.ser is None:
+            return
+        try:
+            waiting = self.ser.in_waiting
+            if waiting:
+                self._urc_buffer += self.ser.read(waiting)
+            elif b"\n" not in self._urc_buffer:
+                # Nothing new, and no complete line left over from the last command
+                return
+        except (serial.SerialException, OSError) as e:
+            logger.error(f"Error reading URC on com port {self.port}: {e}")
+            self.disconnect()
+            return
+        lines = self._urc_buffer.split(b"\n")
+        # Keep the incomplete tail for the next read
+        self._urc_buffer = lines.pop()
+        i = 0
+        while i < len(lines):
+            line = lines[i].decode(errors="ignore").strip()
+            i += 1
+            if line.startswith("+CMT:"):
+                # Text mode +CMT is followed by the message body on the next line
+                if i >= len(lines):
+                    self._urc_buffer = lines[i - 1] + b"\n" + self._urc_buffer
+                    break
+                body = lines[i].decode(errors="ignore").strip()
+                i += 1
+                self._emit_urc(line, body)
+            elif line.startswith(URC_PREFIXES):
+                self._emit_urc(line)
+            elif line in RESET_URCS:
+                logger.info(f"Modem on {self.port} restarted ({line}), configuration is reapplied")
+                self.reset_session()
+
+    def _emit_urc(self, line: str, body: Optional[str] = None) -> None:
+        if self.urc_handler is None:
+            return
+        try:
+            self.urc_handler(self, line, body)
+        except Exception as e:
+            logger.error(f"Error handling URC {line} on {self.port}: {e}")
+
     def disconnect(self):
         if self.ser is not None:
-            self.ser.close()
+            try:
+                self.ser.close()
+            except Exception as e:
+                logger.error(f"Error closing com port {self.port}: {e}")
             self.ser = None
         return True
     
     def check_iccid(self, iccid: str):
         try:
-            sim = mongo_lite.sim_collection.find_one({"iccid": iccid})
+            sim = sim_registry.get(iccid)
             if not sim:
                 logger.error(f"Sim not found for iccid: {iccid}")
                 return False
             db_com_port = sim["com_port"]
             db_iccid = sim["iccid"]
-            now_iccid = at_command.get_iccid(self.ser)
+            # Through write(): URCs (+CMTI) are dispatched, not read as part of the ICCID
+            result, _ = self.write("AT+CCID")
+            now_iccid = parse_iccid(result)
             logger.info(f"Now iccid: {now_iccid}, db iccid: {db_iccid}")
             if now_iccid != db_iccid:
                 logger.info(f"Now iccid: {now_iccid}, db iccid: {db_iccid}, delete com port from database")
@@ -108,123 +326,547 @@ class ComPort:
             return False
     
 
+class ComPortPool:
+    """
+    Long-lived ComPort handles keyed by device:
+      - Lazy connect on first use, the tty stays open between commands
+      - Health check (AT) before reusing a handle idle longer than health_interval
+      - Reconnect on next use after a serial error closed the handle
+      - Idle eviction of handles unused for idle_timeout
+    """
+
+    def __init__(self, idle_timeout: float = 300.0, health_interval: float = 30.0):
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self._ports: Dict[str, ComPort] = {}
+        self._lock = threading.Lock()
+
+    def get(self, device: str, baudrate: int = 115200) -> ComPort:
+        with self._lock:
+            comport = self._ports.get(device)
+            if comport is None:
+                comport = ComPort(device, baudrate)
+                self._ports[device] = comport
+            return comport
+
+    def _ensure_ready(self, comport: ComPort, max_wait: float) -> bool:
+        if comport.is_open() and time.monotonic() - comport.last_used > self.health_interval:
+            result, _ = comport.write("AT")
+            if result is None or "OK" not in result:
+                logger.warning(f"Health check failed on {comport.port}, reconnecting")
+                comport.disconnect()
+        if comport.is_open():
+            return True
+        return comport.connect(max_wait=max_wait)
+
+    @contextmanager
+    def session(self, device: str, max_wait: float = 10.0, baudrate: int = 115200):
+        """
+        Exclusive use of the pooled handle for `device`.
+        Yields None when the port cannot be opened.
+        """
+        comport = self.get(device, baudrate)
+        with comport.lock:
+            if not self._ensure_ready(comport, max_wait):
+                yield None
+                return
+            try:
+                yield comport
+            except (serial.SerialException, OSError):
+                comport.disconnect()
+                raise
+            finally:
+                comport.last_used = time.monotonic()
+
+    def peek(self, device: str) -> Optional[ComPort]:
+        with self._lock:
+            return self._ports.get(device)
+
+    def evict(self, device: str) -> None:
+        with self._lock:
+            comport = self._ports.pop(device, None)
+        if comport is not None:
+            with comport.lock:
+                comport.disconnect()
+
+    def evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                device for device, comport in self._ports.items()
+                if now - comport.last_used > self.idle_timeout
+            ]
+        for device in idle:
+            if print_log: logger.info(f"Evict idle com port: {device}")
+            self.evict(device)
+
+    def close_all(self) -> None:
+        with self._lock:
+            devices = list(self._ports)
+        for device in devices:
+            self.evict(device)
+
 
 class ComManager:
     def __init__(self) -> None:
         self.com_ports = {}
-    
+        self.pool = ComPortPool(
+            idle_timeout=float(os.getenv("COM_POOL_IDLE_TIMEOUT", "300")),
+            health_interval=float(os.getenv("COM_POOL_HEALTH_INTERVAL", "30")),
+        )
+        # One PortWorker per device: the only thread allowed to talk to that port
+        self.workers: Dict[str, PortWorker] = {}
+        self._workers_lock = threading.Lock()
+        self.info_poll_concurrency = int(os.getenv("INFO_POLL_CONCURRENCY", "32"))
+        self.info_poll_interval = float(os.getenv("INFO_POLL_INTERVAL", "5"))
+        self.info_cycle_stats: dict = {}
+        # Idle ports sleep until their handle is readable; URC_POLL_INTERVAL only where handles are not selectable
+        self.urc_watcher = UrcWatcher() if UrcWatcher.supported() else None
+        self.urc_poll_interval = float(os.getenv("URC_POLL_INTERVAL", "0.2"))
+        # Ports with +CMTI enabled only need a slow catch-up sweep
+        self.sms_sweep_interval = float(os.getenv("SMS_SWEEP_INTERVAL", "60"))
+        self._sms_last_sweep: Dict[str, float] = {}
+        self._sms_manager = None
+        self._sms_outbox = None
+        # iccid -> {"doc": last written info fields, "time": monotonic time of the last write}
+        self._last_written: Dict[str, dict] = {}
+        self._last_written_lock = threading.Lock()
+        self.info_heartbeat_interval = float(os.getenv("INFO_HEARTBEAT_INTERVAL", "60"))
+        self.info_write_stats = {"full": 0, "changed": 0, "heartbeat": 0, "skipped": 0}
+        self.hotplug = HotplugWatcher(
+            self.on_port_added,
+            self.on_port_removed,
+            poll_interval=float(os.getenv("HOTPLUG_POLL_INTERVAL", "1")),
+            # Comma separated paths / glob patterns, e.g. /tmp/gsm-emulator/* for tools/modem_emulator.py
+            extra_ports=[path.strip() for path in os.getenv("EXTRA_SERIAL_PORTS", "").split(",") if path.strip()],
+        )
+        self._probing = set()
+        self.probe_cache = ProbeCache(
+            base_delay=float(os.getenv("PROBE_BACKOFF_BASE", "5")),
+            max_delay=float(os.getenv("PROBE_BACKOFF_MAX", "600")),
+            not_ready_max_delay=float(os.getenv("PROBE_BACKOFF_NOT_READY_MAX", "60")),
+        )
+        self.balance_scheduler = BalanceScheduler(
+            self,
+            concurrency=int(os.getenv("BALANCE_CONCURRENCY", "16")),
+            operator_interval=float(os.getenv("BALANCE_OPERATOR_INTERVAL", "2")),
+            refresh_interval=float(os.getenv("BALANCE_REFRESH_INTERVAL", "3600")),
+            retry_delay=float(os.getenv("BALANCE_RETRY_DELAY", "300")),
+            jitter=float(os.getenv("BALANCE_JITTER", "0.2")),
+        )
+        sim_db.change_listeners.append(self.forget_sim)
+
+    def worker(self, device: str) -> PortWorker:
+        with self._workers_lock:
+            worker = self.workers.get(device)
+            if worker is None:
+                worker = PortWorker(device, self.pool, self.urc_poll_interval, self.urc_watcher).start()
+                self.workers[device] = worker
+            return worker
+
+    def submit(self, device: str, fn, priority: int = PRIORITY_INFO) -> Future:
+        """
+        Queue an AT job on the worker owning `device`.
+        fn(comport) runs on the worker thread, comport is None if the port cannot be opened.
+        """
+        return self.worker(device).submit(fn, priority)
+
+    def queue_depth(self) -> Dict[str, int]:
+        # Jobs waiting per port worker
+        with self._workers_lock:
+            workers = list(self.workers.items())
+        return {device: worker.qsize() for device, worker in workers}
+
+    @property
+    def sms_manager(self):
+        if self._sms_manager is None:
+            from controllers import sms_manager
+            self._sms_manager = sms_manager.SMSManager(self)
+        return self._sms_manager
+
+    @property
+    def sms_outbox(self):
+        if self._sms_outbox is None:
+            from controllers import sms_outbox
+            self._sms_outbox = sms_outbox.SmsOutbox(
+                self,
+                min_interval=float(os.getenv("SMS_SEND_MIN_INTERVAL", "2")),
+                per_minute=int(os.getenv("SMS_SEND_PER_MINUTE", "20")),
+                max_attempts=int(os.getenv("SMS_SEND_MAX_ATTEMPTS", "3")),
+                retry_delay=float(os.getenv("SMS_SEND_RETRY_DELAY", "30")),
+                idle_interval=float(os.getenv("SMS_SEND_IDLE_INTERVAL", "2")),
+                max_age=float(os.getenv("SMS_SEND_MAX_AGE", "3600")),
+            )
+        return self._sms_outbox
+
+    def configure_sms_urc(self, comport: ComPort) -> bool:
+        """
+        Runs on the port worker. Text mode, new messages stored on the SIM and
+        indicated with +CMTI so they are read as soon as they arrive. Status reports
+        are stored and indicated with +CDSI, on modems that do not take that only +CMTI.
+        Settings the port already has (ComPort.session) are not sent again.
+        """
+        for name, value in (("cmgf", "1"), ("cpms", SMS_STORAGE)):
+            if not comport.configure(name, value):
+                logger.error(f"Error enabling SMS URC on {comport.port}")
+                return False
+        if not comport.configure("cnmi", "2,1,0,2,0") and not comport.configure("cnmi", "2,1,0,0,0"):
+            logger.error(f"Error enabling SMS URC on {comport.port}")
+            return False
+        comport.urc_handler = self.on_urc
+        return True
+
+    def on_urc(self, comport: ComPort, line: str, body: Optional[str] = None) -> None:
+        # Called on the port worker, must not block on the port: queue the read as an SMS job
+        if line.startswith("+CMTI:"):
+            match = re.match(r'\+CMTI:\s*"(\w+)",\s*(\d+)', line)
+            if not match:
+                logger.error(f"Unknown +CMTI on {comport.port}: {line}")
+                return
+            storage, index = match.group(1), int(match.group(2))
+            self.submit(
+                comport.port,
+                lambda c: self.sms_manager.on_new_sms(c, storage, index),
+                PRIORITY_SMS,
+            )
+        elif line.startswith("+CDSI:"):
+            match = re.match(r'\+CDSI:\s*"(\w+)",\s*(\d+)', line)
+            if not match:
+                logger.error(f"Unknown +CDSI on {comport.port}: {line}")
+                return
+            storage, index = match.group(1), int(match.group(2))
+            self.submit(
+                comport.port,
+                lambda c: self.sms_outbox.on_status_report_indication(c, storage, index),
+                PRIORITY_SMS,
+            )
+        elif line.startswith("+CMT:") and body is not None:
+            self.sms_manager.on_direct_sms(comport.port, line, body)
+
+    def remove_port(self, device: str) -> None:
+        self.com_ports.pop(device, None)
+        self._sms_last_sweep.pop(device, None)
+        iccid = sim_registry.invalidate_port(device)
+        if iccid is not None:
+            # The sim may come back after another bridge rewrote unique_id / com_port: next snapshot is written in full
+            self.forget_sim(iccid)
+        with self._workers_lock:
+            worker = self.workers.pop(device, None)
+        if worker is not None:
+            worker.stop()
+        self.pool.evict(device)
+
+    def on_port_added(self, port) -> None:
+        # Hot-plug event: whatever was learnt about this path no longer holds
+        self.probe_cache.reset(port.device)
+        self._maybe_probe(port)
+
+    def on_port_removed(self, device: str) -> None:
+        if print_log: logger.info(f"Remove com port: {device}")
+        self.probe_cache.reset(device)
+        self.remove_port(device)
+
+    def _maybe_probe(self, port) -> None:
+        # Only the AT interface of a known modem, and never a second port of a modem already tracked
+        if not modem_profile.is_at_candidate(port):
+            return
+        if port.device in self.com_ports:
+            return
+        key = modem_profile.physical_key(port)
+        for device, sibling in list(self.hotplug.known.items()):
+            if device in self.com_ports and modem_profile.physical_key(sibling) == key:
+                return
+        if not self.probe_cache.should_probe(port):
+            return
+        self.probe_port(port.device)
+
+    def modem_groups(self) -> list:
+        """
+        Known USB ttys grouped per physical modem, with the AT port in use.
+        """
+        groups = modem_profile.group_ports(list(self.hotplug.known.values()))
+        result = []
+        for key, ports in groups.items():
+            if all(port.vid is None for port in ports):
+                continue
+            profile = modem_profile.profile_for(ports[0])
+            result.append({
+                "modem": key,
+                "profile": profile.name if profile else None,
+                "vid": ports[0].vid,
+                "pid": ports[0].pid,
+                "serial_number": ports[0].serial_number,
+                "at_port": next((port.device for port in ports if port.device in self.com_ports), None),
+                "ports": [{
+                    "device": port.device,
+                    "interface": modem_profile.usb_interface(port),
+                    "description": port.description,
+                    "at_candidate": modem_profile.is_at_candidate(port),
+                } for port in ports],
+            })
+        return result
+
+    def probe_port(self, device: str) -> Optional[Future]:
+        """
+        Queue an AT+CPIN? probe on the port worker, the port is tracked once its sim is ready.
+        """
+        with self._workers_lock:
+            if device in self._probing:
+                return None
+            self._probing.add(device)
+
+        def job(comport):
+            if comport is None:
+                return None
+            result, _ = comport.write("AT+CPIN?")
+            return result
+
+        future = self.submit(device, job, PRIORITY_INFO)
+        future.add_done_callback(lambda f: self._on_probed(device, f))
+        return future
+
+    def _on_probed(self, device: str, future: Future) -> None:
+        with self._workers_lock:
+            self._probing.discard(device)
+        result = None if future.cancelled() or future.exception() else future.result()
+        port = self.hotplug.known.get(device)
+        if port is None:
+            # Unplugged while probing
+            self.remove_port(device)
+            return
+        if result is None or "READY" not in result:
+            # Not a ready sim: release the port, reprobe_untracked tries again after the backoff
+            reason = PROBE_NO_ANSWER if result is None else PROBE_NOT_READY
+            delay = self.probe_cache.record_failure(port, reason)
+            if print_log: logger.info(f"Probe {device}: {reason}, next probe in {delay:.0f}s")
+            self.remove_port(device)
+            return
+        self.probe_cache.record_success(port)
+        if print_log: logger.info(f"Add com port: {device}, cpin: ready")
+        comport = self.pool.get(device)
+        profile = modem_profile.profile_for(port)
+        if profile is not None and not profile.compound_at:
+            comport.compound_at = False
+        self.com_ports[device] = comport
+
+    def reprobe_untracked(self) -> None:
+        # A sim can be inserted into a modem that is already plugged in, no hot-plug event for that
+        for device, port in list(self.hotplug.known.items()):
+            self._maybe_probe(port)
+
     def get_com_have_sim(self):
-        while True:
+        # Blocks on hot-plug events (udev) or polls list_ports as a fallback
+        self.hotplug.run()
+
+    def read_info_sim(self, com, comport):
+        """
+        Runs on the port worker. Returns the sim document to save, or None if the port has no ready sim.
+        One compound command line when the modem takes it, one command per round trip otherwise.
+        """
+        if comport is None:
+            return None
+        values = None
+        compound_failed = False
+        if comport.compound_at is not False:
+            values, time_save = self._read_info_compound(com, comport)
+            compound_failed = values is None
+        if values is None:
+            values, time_save = self._read_info_sequential(com, comport)
+            if values is None:
+                return None
+            if compound_failed:
+                # Sequential works where compound did not: remember it for this port
+                logger.info(f"{com} does not answer compound AT commands, using one command per round trip")
+                comport.compound_at = False
+        if not comport.cnmi_enabled:
+            self.configure_sms_urc(comport)
+        return {
+            **values,
+            **at_parser.snapshot_fields(values),
+            "com_port": com,
+            "time_update_info_sim": datetime.now(tz=timezone.utc),
+            "time_save": time_save,
+            "unique_id": unique_id
+        }
+
+    def _read_info_compound(self, com, comport):
+        result, time_taken = comport.write(INFO_COMPOUND_COMMAND, timeout=5)
+        if result is None:
+            return None, None
+        values = split_info_snapshot(result)
+        if "READY" not in values.get("cpin", ""):
+            # Sim not ready or the line was rejected: the sequential path tells which
+            return None, None
+        if any(key not in values for key in INFO_COMPOUND_REQUIRED):
+            if print_log: logger.info(f"{com} compound snapshot incomplete: {sorted(values)}")
+            return None, None
+        # Firmwares without +QNWINFO end the line with ERROR, same value as the sequential path
+        values.setdefault("cpsi", "ERROR")
+        comport.compound_at = True
+        return values, {"compound": time_taken}
+
+    def _read_info_sequential(self, com, comport):
+        time_save = {}
+        result, time_taken = comport.write("AT+CPIN?")
+        if result is None or "READY" not in result:
+            if result: result = "".join(result.splitlines()).strip()
+            logger.error(f"{com} is not ready [7395], it is: {result}, remove from com ports")
+            return None, None
+        cpin = replace_data(result)
+        time_save["cpin"] = time_taken
+        result, time_taken = comport.write("AT+CREG?")
+        creg = replace_data(result)
+        time_save["creg"] = time_taken
+        result, time_taken = comport.write("AT+COPS?")
+        cops = replace_data(result)
+        time_save["cops"] = time_taken
+        result, time_taken = comport.write("AT+CCID")
+        # Same parsing as the compound path: one sim, one iccid whatever the prefix
+        iccid = parse_iccid(result)
+        if not iccid:
+            logger.error(f"{com} has no iccid: {result}")
+            return None, None
+        time_save["iccid"] = time_taken
+        result, time_taken = comport.write("AT+CSQ")
+        csq = replace_data(result)
+        time_save["csq"] = time_taken
+        result, time_taken = comport.write("AT+QNWINFO")
+        cpsi = replace_data(result)
+        time_save["cpsi"] = time_taken
+        result, time_taken = comport.write("AT+CIMI")
+        cimi = parse_cimi(result)
+        time_save["cimi"] = time_taken
+        return {
+            "cpin": cpin,
+            "creg": creg,
+            "cops": cops,
+            "iccid": iccid,
+            "cimi": cimi,
+            "csq": csq,
+            "cpsi": cpsi,
+        }, time_save
+
+    def forget_sim(self, iccid: str) -> None:
+        # The document changed outside the polling loop, next cycle writes it in full
+        with self._last_written_lock:
+            self._last_written.pop(iccid, None)
+
+    def _info_update(self, data_save: dict) -> Optional[dict]:
+        """
+        Fields to $set for this snapshot: everything the first time, then only what changed,
+        or just the timestamp and owner fields once per info_heartbeat_interval. None when nothing needs writing.
+        """
+        iccid = data_save["iccid"]
+        now = time.monotonic()
+        fields = {k: v for k, v in data_save.items() if k not in INFO_VOLATILE_FIELDS}
+        with self._last_written_lock:
+            last = self._last_written.get(iccid)
+            if last is None:
+                update = dict(data_save)
+                self.info_write_stats["full"] += 1
+            else:
+                changed = {k: v for k, v in fields.items() if last["doc"].get(k) != v}
+                if changed:
+                    update = dict(changed, **{k: data_save[k] for k in INFO_VOLATILE_FIELDS if k in data_save})
+                    self.info_write_stats["changed"] += 1
+                elif now - last["time"] >= self.info_heartbeat_interval:
+                    update = {k: data_save[k] for k in ("time_update_info_sim",) + INFO_OWNER_FIELDS}
+                    self.info_write_stats["heartbeat"] += 1
+                else:
+                    self.info_write_stats["skipped"] += 1
+                    return None
+            self._last_written[iccid] = {"doc": fields, "time": now}
+        return update
+
+    def _save_info(self, data_save: dict) -> None:
+        update = self._info_update(data_save)
+        if update is not None:
+            future = sim_writer.submit(UpdateOne({"iccid": data_save["iccid"]}, {"$set": update}, upsert=True))
+
+            def on_written(f, iccid=data_save["iccid"]):
+                if f.exception() is not None:
+                    self.forget_sim(iccid)
+
+            future.add_done_callback(on_written)
+        # The port holds this sim now, whatever Mongo still says about the previous one
+        previous = sim_registry.bind_port(data_save["com_port"], data_save["iccid"])
+        if previous is not None:
+            self.forget_sim(previous)
+        sim_registry.update(data_save["iccid"], data_save)
+
+    def refresh_info(self, com: str, priority: int = PRIORITY_INTERACTIVE) -> Optional[dict]:
+        # One snapshot outside the polling cycle (on request), saved the same way
+        data_save = self.submit(com, lambda comport: self.read_info_sim(com, comport), priority).result()
+        if data_save is None:
+            self.remove_port(com)
+            return None
+        self._save_info(data_save)
+        return data_save
+
+    def poll_info_cycle(self) -> dict:
+        """
+        One refresh of every tracked port, fanned out over the port workers.
+        At most info_poll_concurrency snapshots are in flight at once.
+        """
+        time_start = time.time()
+        semaphore = threading.BoundedSemaphore(self.info_poll_concurrency)
+        futures = {}
+        for com in list(self.com_ports):
+            semaphore.acquire()
+            future = self.submit(com, lambda comport, com=com: self.read_info_sim(com, comport), PRIORITY_INFO)
+            future.add_done_callback(lambda _: semaphore.release())
+            futures[future] = com
+        ok, failed = 0, 0
+        for future in as_completed(futures):
+            com = futures[future]
             try:
-                ports = serial.tools.list_ports.comports()
-                for com in list(self.com_ports):
-                    if com not in [port.device for port in ports]:
-                        del self.com_ports[com]
-                for port in ports:
-                    if "USB" not in port.description:
-                        continue
-                    if port.device in list(self.com_ports):
-                        continue
-                    cpin = at_command.get_cpin(port.device)
-                    if cpin != "ready":
-                        continue
-                    else:
-                        if port.device not in list(self.com_ports):
-                            if print_log: logger.info(f"Add com port: {port.device}, cpin: {cpin}")
-                            self.com_ports[port.device] = ComPort(port.device)
-                time.sleep(1)
+                data_save = future.result()
             except Exception as e:
-                logger.error(f"Error getting com ports: {e}")
-                print(traceback.format_exc())
-                time.sleep(5)
-                
-                
+                logger.error(f"Error getting info sim on {com}: {e}")
+                failed += 1
+                continue
+            if data_save is None:
+                self.remove_port(com)
+                failed += 1
+                continue
+            self._save_info(data_save)
+            ok += 1
+        self.info_cycle_stats = {
+            "ports": len(futures),
+            "ok": ok,
+            "failed": failed,
+            "cycle_time": time.time() - time_start,
+            "time": datetime.now(tz=timezone.utc),
+        }
+        return self.info_cycle_stats
+
     def get_info_sim(self):
         while True:
             try:
-                if print_log: logger.info(f"Getting info sim, with {len(list(self.com_ports))} com ports")
-                for com in list(self.com_ports):
-                    comport = ComPort(com)
-                    _ = comport.connect()
-                    if _ is None:
-                        continue
-                    time_save = {}
-                    result, time_taken = comport.write("AT+CPIN?")
-                    if result is None or "READY" not in result:
-                        if result: result = "".join(result.splitlines()).strip()
-                        logger.error(f"{com} is not ready [7395], it is: {result}, remove from com ports")
-                        self.com_ports.pop(com, None)
-                        continue
-                    cpin = replace_data(result)
-                    time_save["cpin"] = time_taken
-                    result, time_taken = comport.write("AT+CREG?")
-                    creg = replace_data(result)
-                    time_save["creg"] = time_taken
-                    result, time_taken = comport.write("AT+COPS?")
-                    cops = replace_data(result)
-                    time_save["cops"] = time_taken
-                    result, time_taken = comport.write("AT+CCID")
-                    iccid = result.replace("+CCID: ", "").replace('OK', '').strip()
-                    time_save["iccid"] = time_taken
-                    result, time_taken = comport.write("AT+CSQ")
-                    csq = replace_data(result)
-                    time_save["csq"] = time_taken
-                    result, time_taken = comport.write("AT+QNWINFO")
-                    cpsi = replace_data(result)
-                    time_save["cpsi"] = time_taken
-                    result, time_taken = comport.write("AT+CIMI")
-                    cimi = result.replace("+CIMI: ", "").replace('OK', '').strip()
-                    time_save["cimi"] = time_taken
-                    comport.disconnect()
-                    data_save = {
-                        "cpin": cpin,
-                        "creg": creg,
-                        "cops": cops,
-                        "iccid": iccid,
-                        "cimi": cimi,
-                        "csq": csq,
-                        "cpsi": cpsi,
-                        "com_port": com,
-                        "time_update_info_sim": datetime.now(tz=timezone.utc),
-                        "time_save": time_save,
-                        "unique_id": unique_id
-                    }
-                    mongo_lite.sim_collection.update_one({"iccid": iccid}, {"$set": data_save}, upsert=True)
-                    time.sleep(1)
-                time.sleep(5)
+                stats = self.poll_info_cycle()
+                if print_log or stats["failed"]:
+                    logger.info(f"Info cycle: {stats['ports']} ports, ok: {stats['ok']}, failed: {stats['failed']}, cycle time: {stats['cycle_time']:.2f}s")
+                self.reprobe_untracked()
+                self.pool.evict_idle()
             except Exception as e:
                 logger.error(f"Error getting info sim: {e}")
                 print(traceback.format_exc())
-            time.sleep(5)
+            time.sleep(self.info_poll_interval)
             
     def get_balance_background(self):
-        while True:
-            try:
-                lt_time = datetime.now(tz=timezone.utc) - timedelta(minutes=60)
-                query = {
-                    "$or": [
-                        {"balance": None},
-                        {"balance_update_time": {"$lt": lt_time}},
-                        {"balance_update_time": None}
-                    ],
-                    "com_port": {"$ne": None}
-                }
-                sims_cursor = mongo_lite.sim_collection.find(query).limit(5)
-                list_sims = list(sims_cursor)
-                len_list_sims = len(list_sims)
-                if len_list_sims > 0:
-                    logger.info(f"Found {len_list_sims} sims to get balance")
-                    for sim in list_sims:
-                        at_command.get_balance(sim["iccid"])
-            except Exception as e:
-                logger.error(f"Error getting balance: {e}")
-                logger.error(traceback.format_exc())
-            time.sleep(5)
+        # Concurrent across modems, paced per operator, see BalanceScheduler
+        self.balance_scheduler.run()
             
+    def _sms_sweep_due(self, device: str) -> bool:
+        # +CMTI delivers new messages as they arrive, full CMGL is only a catch-up for missed URCs
+        comport = self.pool.peek(device)
+        if comport is None or not comport.cnmi_enabled:
+            return True
+        return time.monotonic() - self._sms_last_sweep.get(device, 0.0) > self.sms_sweep_interval
+
     def get_sms_background(self):
         logger.info(f"Starting get SMS background, unique_id: {unique_id}")
-        from controllers import sms_manager
-        sms_class = sms_manager.SMSManager()
+        sms_class = self.sms_manager
         while True:
             try:
                 lt_time = datetime.now(tz=timezone.utc) - timedelta(minutes=15)
@@ -240,19 +882,37 @@ class ComManager:
                 if len_list_sims > 0:
                     logger.info(f"Found {len_list_sims} sims to get sms")
                     for sim in list_sims:
-                        _ = sms_class.get_sms_all(sim["iccid"])
+                        if not self._sms_sweep_due(sim["com_port"]):
+                            continue
+                        if not leases.claim("sms", sim["iccid"]):
+                            continue
+                        try:
+                            _ = sms_class.get_sms_all(sim["iccid"])
+                        finally:
+                            leases.release("sms", sim["iccid"])
+                        self._sms_last_sweep[sim["com_port"]] = time.monotonic()
                         logger.info(f"Get SMS for sim: {sim['iccid']}, result: {_}")
-                        time.sleep(1)
             except Exception as e:
                 logger.error(f"Error getting sms: {e}")
                 logger.error(traceback.format_exc())
             time.sleep(5)
             
 
+_com_manager: Optional[ComManager] = None
+
+
+def get_com_manager() -> ComManager:
+    global _com_manager
+    if _com_manager is None:
+        _com_manager = ComManager()
+    return _com_manager
+
+
 def start_com_manager():
     logger.info("Starting com manager...")
-    com_manager = ComManager()
+    com_manager = get_com_manager()
     threading.Thread(target=com_manager.get_com_have_sim, daemon=True).start()
     threading.Thread(target=com_manager.get_info_sim, daemon=True).start()
     threading.Thread(target=com_manager.get_balance_background, daemon=True).start()
-    threading.Thread(target=com_manager.get_sms_background, daemon=True).start()
\ No newline at end of file
+    threading.Thread(target=com_manager.get_sms_background, daemon=True).start()
+    threading.Thread(target=com_manager.sms_outbox.run, daemon=True).start()
\ No newline at end of file
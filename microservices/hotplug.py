@@ -0,0 +1,111 @@
+import glob
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import serial.tools.list_ports
+from serial.tools.list_ports_common import ListPortInfo
+
+from helpers.modem_profile import EXTRA_PORT_HWID
+
+try:
+    import pyudev
+except ImportError:  # optional: only on Linux, polling is used without it
+    pyudev = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class HotplugWatcher:
+    """
+    Serial port add/remove events:
+      - Linux with pyudev: blocks on the udev netlink socket, no work while nothing changes
+      - Otherwise: list_ports polling every poll_interval, diffed against the previous scan
+      - on_add(port_info) gets a list_ports ListPortInfo, on_remove(device) the device path
+      - extra_ports: paths or glob patterns of ports list_ports does not report (PTYs of tools/modem_emulator.py),
+        matched again on every scan; they are not udev devices, so polling is used when there are any
+    """
+
+    def __init__(self, on_add: Callable, on_remove: Callable, poll_interval: float = 1.0, extra_ports: Optional[List[str]] = None):
+        self.on_add = on_add
+        self.on_remove = on_remove
+        self.poll_interval = poll_interval
+        self.extra_ports = extra_ports or []
+        self.known: Dict[str, object] = {}
+        self.mode = "udev" if pyudev is not None and sys.platform.startswith("linux") and not self.extra_ports else "polling"
+
+    def run(self) -> None:
+        logger.info(f"Hot-plug watcher started, mode: {self.mode}")
+        if self.mode == "udev":
+            try:
+                self._run_udev()
+                return
+            except Exception as e:
+                logger.error(f"udev monitor failed, falling back to polling: {e}")
+                self.mode = "polling"
+        self._run_polling()
+
+    def scan(self) -> None:
+        # Full list_ports scan, emits the difference with what is known
+        ports = {port.device: port for port in serial.tools.list_ports.comports()}
+        ports.update(self.scan_extra_ports())
+        for device in set(self.known) - set(ports):
+            self._removed(device)
+        for device in set(ports) - set(self.known):
+            self._added(ports[device])
+
+    def scan_extra_ports(self) -> Dict[str, ListPortInfo]:
+        ports = {}
+        for pattern in self.extra_ports:
+            for device in sorted(glob.glob(pattern)):
+                if device in self.known:
+                    ports[device] = self.known[device]
+                    continue
+                port = ListPortInfo(device, skip_link_detection=True)
+                port.description = f"extra serial port {os.path.basename(device)}"
+                port.hwid = EXTRA_PORT_HWID
+                ports[device] = port
+        return ports
+
+    def _added(self, port) -> None:
+        self.known[port.device] = port
+        try:
+            self.on_add(port)
+        except Exception as e:
+            logger.error(f"Error handling added port {port.device}: {e}")
+
+    def _removed(self, device: str) -> None:
+        self.known.pop(device, None)
+        try:
+            self.on_remove(device)
+        except Exception as e:
+            logger.error(f"Error handling removed port {device}: {e}")
+
+    def _run_udev(self) -> None:
+        from serial.tools.list_ports_linux import SysFS
+
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by(subsystem="tty")
+        monitor.start()
+        # Ports present before the monitor started
+        self.scan()
+        for device in iter(monitor.poll, None):
+            node = device.device_node
+            if not node:
+                continue
+            if device.action == "add" and node not in self.known:
+                self._added(SysFS(node))
+            elif device.action == "remove" and node in self.known:
+                self._removed(node)
+
+    def _run_polling(self) -> None:
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error(f"Error scanning com ports: {e}")
+            time.sleep(self.poll_interval)
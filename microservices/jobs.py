@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from microservices import com_manager
+from microservices.port_worker import PRIORITY_INTERACTIVE
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, kind: str, key: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Requests served by this job, 1 + the identical ones coalesced into it
+        self.requests = 1
+        self.future: Future = Future()
+
+    def to_dict(self, with_result: bool = True) -> dict:
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "requests": self.requests,
+        }
+        if with_result and self.future.done():
+            error = self.future.exception()
+            data["result"] = None if error else self.future.result()
+            data["error"] = str(error) if error else None
+        return data
+
+
+class JobManager:
+    """
+    Modem operations requested by clients (HTTP routes, Ably commands):
+      - submit(kind, key, fn) runs fn() on a small thread pool and returns a Job right away
+      - Single flight: while a (kind, key) job is queued or running, identical submits get that same job
+      - Finished jobs stay readable for result_ttl seconds, for long-poll / SSE clients coming back
+      - wait() is for the event loop, no thread is held while the modem works
+    """
+
+    def __init__(self, concurrency: int = 32, result_ttl: float = 300.0):
+        self.concurrency = concurrency
+        self.result_ttl = result_ttl
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job")
+        self._jobs: Dict[str, Job] = {}
+        self._in_flight: Dict[Tuple[str, str], Job] = {}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "coalesced": 0, "done": 0, "error": 0}
+
+    def submit(self, kind: str, key: str, fn: Callable[[], Any]) -> Job:
+        with self._lock:
+            self._prune()
+            job = self._in_flight.get((kind, key))
+            if job is not None:
+                job.requests += 1
+                self._stats["coalesced"] += 1
+                return job
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            self._in_flight[(kind, key)] = job
+            self._stats["submitted"] += 1
+        self.executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> bool:
+        # True once the job finished, False if it is still running after timeout
+        if job.future.done():
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout)
+        except asyncio.TimeoutError:
+            return False
+        except Exception:
+            # The job failed, the error is in job.to_dict()
+            pass
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses: Dict[str, int] = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {**self._stats, "jobs": statuses, "in_flight": len(self._in_flight), "concurrency": self.concurrency}
+
+    def _run(self, job: Job, fn: Callable[[], Any]) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            result = fn()
+        except Exception as e:
+            logger.error(f"Job {job.kind} {job.key} failed: {e}")
+            self._finish(job, "error")
+            job.future.set_exception(e)
+            return
+        self._finish(job, "done")
+        job.future.set_result(result)
+
+    def _finish(self, job: Job, status: str) -> None:
+        with self._lock:
+            # A new request for the same key starts a fresh job from here on
+            if self._in_flight.get((job.kind, job.key)) is job:
+                del self._in_flight[(job.kind, job.key)]
+            job.status = status
+            job.finished_at = time.time()
+            self._stats[status] += 1
+
+    def _prune(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager(
+    concurrency=int(os.getenv("JOB_CONCURRENCY", "32")),
+    result_ttl=float(os.getenv("JOB_RESULT_TTL", "300")),
+)
+
+
+def fetch_sms(iccid: str, after: Optional[str] = None, limit: int = 100) -> dict:
+    # Shared instance: it remembers which SIMs are already synced
+    manager = com_manager.get_com_manager().sms_manager
+    sms = manager.get_sms_all(iccid, PRIORITY_INTERACTIVE)
+    if sms is None:
+        raise LookupError("SMS not found")
+    # get_sms_all only returns what was new on the SIM: answer from the stored messages, one bounded page
+    # (jobs keep their result for result_ttl). `next` passed back as `after` gets only what came since
+    sms["sms"] = manager.stored_sms(sms["cimi"], after, limit)
+    sms["next"] = sms["sms"][-1]["id"] if sms["sms"] else after
+    return sms
+
+
+def submit_sms_job(iccid: str, after: Optional[str] = None, limit: int = 100) -> Job:
+    # Identical requests (same sim and page) while one is in flight share it and its CMGL
+    return job_manager.submit("sms", f"{iccid}:{after or ''}:{limit}", lambda: fetch_sms(iccid, after, limit))
@@ -0,0 +1,136 @@
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SMS = 1
+PRIORITY_BALANCE = 2
+PRIORITY_INFO = 3
+_PRIORITY_STOP = -1
+# Queued by the URC watcher when the idle port has bytes waiting
+_URC_READY = object()
+
+
+class PortWorker:
+    """
+    Single owner of one COM port:
+      - AT jobs are taken from a priority queue and run one at a time
+      - A job is a callable receiving the pooled ComPort (None if the port cannot be opened)
+      - Callers get a concurrent.futures.Future with the job result
+      - While idle, URCs on the open handle are dispatched: with a watcher (UrcWatcher) the worker sleeps until
+        the handle is readable, otherwise (no selectable fd, Windows) it polls every idle_interval
+    """
+
+    def __init__(self, device: str, pool, idle_interval: float = 0.2, watcher=None):
+        self.device = device
+        self.pool = pool
+        self.idle_interval = idle_interval
+        self.watcher = watcher
+        self._watched_fd: Optional[int] = None
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"port-worker-{device}", daemon=True)
+
+    def start(self) -> "PortWorker":
+        self._thread.start()
+        return self
+
+    def submit(self, fn: Callable[[Any], Any], priority: int = PRIORITY_INFO) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._stopped:
+                future.set_exception(RuntimeError(f"Port worker {self.device} is stopped"))
+                return future
+            self._queue.put((priority, next(self._seq), fn, future))
+        return future
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put((_PRIORITY_STOP, next(self._seq), None, None))
+
+    def _urc_ready(self) -> None:
+        # Watcher thread: hand the read to the owner
+        with self._lock:
+            if not self._stopped:
+                self._queue.put((PRIORITY_SMS, next(self._seq), _URC_READY, None))
+
+    def _run(self) -> None:
+        block = self._idle()
+        while True:
+            try:
+                _, _, fn, future = self._queue.get(timeout=None if block else self.idle_interval)
+            except queue.Empty:
+                block = self._idle()
+                continue
+            if fn is None:
+                break
+            if fn is _URC_READY:
+                block = self._idle()
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.pool.session(self.device) as comport:
+                    result = fn(comport)
+                future.set_result(result)
+            except Exception as e:
+                logger.error(f"Error running job on {self.device}: {e}")
+                future.set_exception(e)
+            if self._queue.empty():
+                block = self._idle()
+        if self._watched_fd is not None:
+            self.watcher.unwatch(self._watched_fd, self._urc_ready)
+        # Fail whatever was still queued when the port went away
+        while True:
+            try:
+                _, _, fn, future = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None and fn is not _URC_READY and future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError(f"Port worker {self.device} is stopped"))
+
+    def _idle(self) -> bool:
+        """
+        Dispatch waiting URCs, then have the watcher wake the worker on the next bytes.
+        Returns True when the worker can block until a job or that wake-up, False to poll again after idle_interval.
+        """
+        comport = self._poll_idle()
+        if self.watcher is None:
+            return False
+        if comport is None:
+            # Nothing to listen to until a job opens the port
+            return True
+        try:
+            fd = comport.ser.fileno()
+        except Exception:
+            return False
+        self._watched_fd = fd
+        self.watcher.watch(fd, self._urc_ready)
+        return True
+
+    def _poll_idle(self):
+        # Only watch a handle that is already open, never open the port just to listen. Returns the polled ComPort
+        comport = self.pool.peek(self.device)
+        if comport is None or comport.urc_handler is None or not comport.is_open():
+            return None
+        try:
+            with comport.lock:
+                comport.poll_urcs()
+        except Exception as e:
+            logger.error(f"Error polling URC on {self.device}: {e}")
+        return comport if comport.is_open() else None
@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Dict
+
+
+PROBE_NO_ANSWER = "no_answer"
+PROBE_NOT_READY = "not_ready"
+
+
+class ProbeCache:
+    """
+    Negative AT+CPIN? probe results per port:
+      - Keyed by device + USB serial number + hwid, a different modem on the same path starts fresh
+      - Exponential backoff after a port that does not answer AT (DIAG, NMEA, GPS) or has no ready sim
+      - Not-ready ports back off to a lower cap: a sim can be inserted without a hot-plug event
+      - reset() on hot-plug add/remove
+    """
+
+    def __init__(self, base_delay: float = 5.0, max_delay: float = 600.0, not_ready_max_delay: float = 60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.not_ready_max_delay = not_ready_max_delay
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(port) -> tuple:
+        return (port.device, getattr(port, "serial_number", None), getattr(port, "hwid", None))
+
+    def should_probe(self, port) -> bool:
+        with self._lock:
+            entry = self._entries.get(port.device)
+            if entry is None:
+                return True
+            if entry["key"] != self.key(port):
+                del self._entries[port.device]
+                return True
+            return time.monotonic() >= entry["next_probe"]
+
+    def record_failure(self, port, reason: str) -> float:
+        with self._lock:
+            entry = self._entries.get(port.device)
+            if entry is None or entry["key"] != self.key(port):
+                entry = {"key": self.key(port), "failures": 0}
+                self._entries[port.device] = entry
+            entry["failures"] += 1
+            entry["reason"] = reason
+            cap = self.not_ready_max_delay if reason == PROBE_NOT_READY else self.max_delay
+            delay = min(cap, self.base_delay * (2 ** (entry["failures"] - 1)))
+            entry["next_probe"] = time.monotonic() + delay
+            return delay
+
+    def record_success(self, port) -> None:
+        self.reset(port.device)
+
+    def reset(self, device: str) -> None:
+        with self._lock:
+            self._entries.pop(device, None)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                device: {
+                    "failures": entry["failures"],
+                    "reason": entry["reason"],
+                    "next_probe_in": max(0.0, entry["next_probe"] - now),
+                }
+                for device, entry in self._entries.items()
+            }
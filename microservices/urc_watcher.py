@@ -0,0 +1,113 @@
+import logging
+import os
+import queue
+import selectors
+import threading
+from typing import Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class UrcWatcher:
+    """
+    One thread waiting for bytes on the open handles of every idle port (epoll / kqueue via selectors):
+      - watch(fd, on_ready) is one-shot: on_ready() is called once when fd becomes readable, then fd is dropped
+      - The port worker does the read (on_ready queues it), the watcher never touches the port
+      - watch / unwatch from any thread are applied by the watcher thread, woken through a pipe;
+        unwatch only drops the fd while it is still watched for the same on_ready (fd numbers are reused)
+      - POSIX only (supported()): Windows serial handles have no selectable fd
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._ops: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._watched: Dict[int, Callable[[], None]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"watched": 0, "ready": 0}
+
+    @staticmethod
+    def supported() -> bool:
+        return os.name == "posix"
+
+    def watch(self, fd: int, on_ready: Callable[[], None]) -> None:
+        self._ensure_started()
+        self._ops.put((fd, on_ready, True))
+        self._wake()
+
+    def unwatch(self, fd: int, on_ready: Callable[[], None]) -> None:
+        self._ops.put((fd, on_ready, False))
+        self._wake()
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="urc-watcher", daemon=True)
+                self._thread.start()
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            # The pipe is full: the watcher is already due to wake up
+            pass
+
+    def _apply_ops(self) -> None:
+        while True:
+            try:
+                fd, on_ready, add = self._ops.get_nowait()
+            except queue.Empty:
+                break
+            if not add:
+                if self._watched.get(fd) == on_ready:
+                    self._drop(fd)
+                continue
+            self._drop(fd)
+            try:
+                self._selector.register(fd, selectors.EVENT_READ, on_ready)
+                self._watched[fd] = on_ready
+            except (OSError, ValueError) as e:
+                # Closed before the watcher got to it: the worker opens and watches it again on its next job
+                logger.error(f"Error watching fd {fd} for URC: {e}")
+        self.stats["watched"] = len(self._watched)
+
+    def _drop(self, fd: int) -> None:
+        if self._watched.pop(fd, None) is not None:
+            try:
+                self._selector.unregister(fd)
+            except (KeyError, ValueError, OSError):
+                pass
+
+    def _run(self) -> None:
+        while True:
+            self._apply_ops()
+            try:
+                events = self._selector.select()
+            except OSError as e:
+                # A watched handle was closed under the selector: drop them all, idle workers watch again
+                logger.error(f"Error waiting for URC: {e}")
+                for fd in list(self._watched):
+                    self._drop(fd)
+                continue
+            for key, _ in events:
+                if key.data is None:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                on_ready = self._watched.get(key.fd)
+                self._drop(key.fd)
+                if on_ready is None:
+                    continue
+                self.stats["ready"] += 1
+                try:
+                    on_ready()
+                except Exception as e:
+                    logger.error(f"Error handling URC readiness on fd {key.fd}: {e}")
@@ -1,11 +1,17 @@
 from fastapi import FastAPI
 
 from .health import router as health_router
+from .jobs import router as jobs_router
+from .modem import router as modem_router
 from .root import router as root_router
 from .sim import router as sim_router
+from .sms import router as sms_router
 
 
 def register_routes(app: FastAPI) -> None:
     app.include_router(root_router)
     app.include_router(health_router)
     app.include_router(sim_router)
+    app.include_router(modem_router)
+    app.include_router(jobs_router)
+    app.include_router(sms_router)
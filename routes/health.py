@@ -1,8 +1,32 @@
 from fastapi import APIRouter
 
+from database import write_batcher
+from database.lease import leases
+from database.sim_registry import sim_registry
+from microservices import com_manager
+from services import ably_listen
+
 router = APIRouter()
 
 
 @router.get("/health")
 def health_check() -> dict:
     return {"status": "ok"}
+
+
+@router.get("/health/poll")
+def poll_stats() -> dict:
+    manager = com_manager.get_com_manager()
+    return {
+        "com_ports": len(manager.com_ports),
+        "info_cycle": manager.info_cycle_stats,
+        "info_writes": manager.info_write_stats,
+        "writers": write_batcher.writer_stats(),
+        "sim_registry": sim_registry.stats,
+        "urc_watcher": manager.urc_watcher.stats if manager.urc_watcher is not None else None,
+        "probe_backoff": manager.probe_cache.snapshot(),
+        "balance": manager.balance_scheduler.stats(),
+        "leases": leases.snapshot(),
+        "ably": ably_listen.get_ably_service().stats(),
+        "sms_outbox": manager.sms_outbox.stats(),
+    }
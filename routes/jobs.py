@@ -0,0 +1,58 @@
+import json
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from microservices import com_manager
+from microservices.jobs import Job, job_manager, submit_sms_job
+
+router = APIRouter(tags=["jobs"])
+
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs/sms/{iccid}", status_code=202)
+def create_sms_job(iccid: str) -> dict:
+    return submit_sms_job(iccid).to_dict(with_result=False)
+
+
+@router.get("/jobs")
+def job_stats() -> dict:
+    return {
+        "jobs": job_manager.stats(),
+        "queue_depth": com_manager.get_com_manager().queue_depth(),
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=60)) -> dict:
+    # Long poll: answers as soon as the job finishes, or after `wait` seconds with its current status
+    job = _get_job(job_id)
+    if wait:
+        await job_manager.wait(job, wait)
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, timeout: float = Query(60, ge=1, le=600)) -> StreamingResponse:
+    # Server-sent events: the current status, a heartbeat every 15 s, then the result
+    job = _get_job(job_id)
+
+    async def stream():
+        yield f"event: status\ndata: {json.dumps(job.to_dict(with_result=False))}\n\n"
+        waited = 0.0
+        while waited < timeout:
+            step = min(15.0, timeout - waited)
+            if await job_manager.wait(job, step):
+                yield f"event: result\ndata: {json.dumps(job.to_dict(), default=str)}\n\n"
+                return
+            waited += step
+            yield ": heartbeat\n\n"
+        yield f"event: timeout\ndata: {json.dumps(job.to_dict(with_result=False))}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
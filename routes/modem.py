@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+
+from microservices import com_manager
+
+router = APIRouter(tags=["modem"])
+
+
+@router.get("/modems")
+def list_modems() -> dict:
+    items = com_manager.get_com_manager().modem_groups()
+    return {"items": items, "count": len(items)}
@@ -1,45 +1,162 @@
+import json
+from datetime import datetime
 from typing import Optional
 
+from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # optional: faster encoding, stdlib json is used without it
+    orjson = None
 
 from config import mongo_lite
-from controllers import sms_manager
+from database.sim_registry import sim_registry
+from helpers import at_parser
+from microservices.jobs import job_manager, submit_sms_job
 
 router = APIRouter(tags=["sim"])
 
 
+# Left out of listings unless asked for with ?fields=
+SIM_HEAVY_FIELDS = ("balance_raw", "time_save", "old_com_port")
+
+
 def _serialize_sim(sim: dict) -> dict:
-    sim = dict(sim)
+    # Cursor documents are not shared, convert in place
     sim_id = sim.get("_id")
     if sim_id is not None:
         sim["_id"] = str(sim_id)
     return sim
 
 
-@router.get("/sims")
-def list_sims(
-    limit: int = Query(100, ge=1, le=1000),
-    skip: int = Query(0, ge=0),
-    com_port: Optional[str] = None,
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default)
+    return json.dumps(data, default=_json_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _sims_query(
+    com_port: Optional[str],
+    registered: Optional[bool],
+    creg_stat: Optional[int],
+    min_rssi_dbm: Optional[int],
+    operator: Optional[str],
 ) -> dict:
     query = {}
     if com_port:
         query["com_port"] = com_port
-    cursor = mongo_lite.sim_collection.find(query).skip(skip).limit(limit)
+    registered_stats = [int(stat) for stat in at_parser.REGISTERED_STATS]
+    if registered is True:
+        query["creg_stat"] = {"$in": registered_stats}
+    elif registered is False:
+        query["creg_stat"] = {"$nin": registered_stats}
+    if creg_stat is not None:
+        query.setdefault("creg_stat", {})["$eq"] = creg_stat
+    if min_rssi_dbm is not None:
+        query["rssi_dbm"] = {"$gte": min_rssi_dbm}
+    if operator:
+        query["operator"] = operator
+    return query
+
+
+def _projection(fields: Optional[str]) -> dict:
+    # Only the requested fields (+ _id for the cursor), or everything but the heavy history / debug fields
+    if not fields:
+        return {field: 0 for field in SIM_HEAVY_FIELDS}
+    projection = {field.strip(): 1 for field in fields.split(",") if field.strip() and not field.strip().startswith("$")}
+    projection["_id"] = 1
+    return projection
+
+
+def _object_id(value: str) -> ObjectId:
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/sims")
+def list_sims(
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = Query(None, description="next from the previous page"),
+    skip: int = Query(0, ge=0, description="deprecated, use after"),
+    fields: Optional[str] = Query(None, description="comma separated, e.g. iccid,com_port,rssi_dbm"),
+    com_port: Optional[str] = None,
+    registered: Optional[bool] = None,
+    creg_stat: Optional[int] = Query(None, ge=0, le=10),
+    min_rssi_dbm: Optional[int] = Query(None, ge=-113, le=-51),
+    operator: Optional[str] = None,
+) -> Response:
+    """
+    Keyset pagination on _id: pass `next` back as `after`, every page costs the same.
+    """
+    query = _sims_query(com_port, registered, creg_stat, min_rssi_dbm, operator)
+    if after:
+        query["_id"] = {"$gt": _object_id(after)}
+    cursor = mongo_lite.sim_collection.find(query, _projection(fields)).sort("_id", 1).limit(limit)
+    if skip and not after:
+        cursor = cursor.skip(skip)
     items = [_serialize_sim(sim) for sim in cursor]
-    return {"items": items, "count": len(items)}
+    next_cursor = items[-1]["_id"] if len(items) == limit else None
+    return Response(
+        content=dumps({"items": items, "count": len(items), "next": next_cursor}),
+        media_type="application/json",
+    )
+
+
+@router.get("/sims/export")
+def export_sims(
+    fields: Optional[str] = Query(None, description="comma separated, e.g. iccid,com_port,rssi_dbm"),
+    com_port: Optional[str] = None,
+    registered: Optional[bool] = None,
+    creg_stat: Optional[int] = Query(None, ge=0, le=10),
+    min_rssi_dbm: Optional[int] = Query(None, ge=-113, le=-51),
+    operator: Optional[str] = None,
+) -> StreamingResponse:
+    # Whole fleet as NDJSON, one sim per line, streamed from the cursor without building a list
+    query = _sims_query(com_port, registered, creg_stat, min_rssi_dbm, operator)
+    cursor = mongo_lite.sim_collection.find(query, _projection(fields)).sort("_id", 1).batch_size(1000)
+
+    def lines():
+        for sim in cursor:
+            yield dumps(_serialize_sim(sim)) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @router.get("/sims/{iccid}")
 def get_sim(iccid: str) -> dict:
-    sim = mongo_lite.sim_collection.find_one({"iccid": iccid})
+    sim = sim_registry.get(iccid)
     if not sim:
         raise HTTPException(status_code=404, detail="Sim not found")
     return _serialize_sim(sim)
 
 @router.get("/sims/sms/{iccid}")
-def get_sms(iccid: str) -> dict:
-    sms = sms_manager.SMSManager().get_sms_all(iccid)
-    if sms is None:
+async def get_sms(
+    iccid: str,
+    wait: float = Query(30, ge=0, le=120),
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = Query(None, description="next from the previous answer"),
+):
+    # Runs as a job: concurrent requests for one sim share a single modem read
+    if after:
+        _object_id(after)
+    job = submit_sms_job(iccid, after, limit)
+    if not await job_manager.wait(job, wait):
+        # Still on the modem: the client follows up on /jobs/{id}
+        return JSONResponse(status_code=202, content=job.to_dict(with_result=False))
+    error = job.future.exception()
+    if isinstance(error, LookupError):
         raise HTTPException(status_code=404, detail="SMS not found")
-    return {"sms": sms}
\ No newline at end of file
+    if error is not None:
+        raise HTTPException(status_code=500, detail=str(error))
+    return {"sms": job.future.result()}
@@ -0,0 +1,42 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from helpers.sms_pdu import is_phone_number
+from microservices import com_manager
+
+router = APIRouter(tags=["sms"])
+
+
+class SendSmsRequest(BaseModel):
+    to: str
+    text: str
+    # Optional preferences: send from this sim, or from any sim on this operator
+    iccid: Optional[str] = None
+    operator: Optional[str] = None
+
+
+@router.post("/sms/send", status_code=202)
+def send_sms(request: SendSmsRequest) -> dict:
+    to = request.to.strip()
+    if not request.text:
+        raise HTTPException(status_code=400, detail="text is required")
+    if not is_phone_number(to):
+        raise HTTPException(status_code=400, detail="to is not a phone number")
+    outbox = com_manager.get_com_manager().sms_outbox
+    message_id = outbox.enqueue(to, request.text, iccid=request.iccid, operator=request.operator)
+    return {"id": message_id, "status": "queued"}
+
+
+@router.get("/sms/outbox/stats")
+def outbox_stats() -> dict:
+    return com_manager.get_com_manager().sms_outbox.stats()
+
+
+@router.get("/sms/outbox/{message_id}")
+def get_outbox_message(message_id: str) -> dict:
+    message = com_manager.get_com_manager().sms_outbox.get(message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
@@ -0,0 +1,51 @@
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+from helpers.sms_pdu import is_phone_number
+
+
+FETCH_SMS = "fetch_sms"
+REFRESH_BALANCE = "refresh_balance"
+REFRESH_INFO = "refresh_info"
+SEND_SMS = "send_sms"
+COMMAND_TYPES = (FETCH_SMS, REFRESH_BALANCE, REFRESH_INFO, SEND_SMS)
+
+
+@dataclass(frozen=True)
+class Command:
+    id: str
+    type: str
+    iccid: str
+    # send_sms only
+    to: Optional[str] = None
+    text: Optional[str] = None
+
+
+def parse_command(name: Optional[str], data) -> Command:
+    """
+    Ably message -> Command. The type is the message name (or data["type"]), data is a dict
+    or its JSON text: {"id": ..., "iccid": ..., "to": ..., "text": ...}. ValueError when invalid.
+    """
+    if isinstance(data, (str, bytes)):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise ValueError("data is not JSON")
+    if not isinstance(data, dict):
+        raise ValueError("data must be an object")
+    command_type = data.get("type") or name
+    if command_type not in COMMAND_TYPES:
+        raise ValueError(f"unknown command: {command_type}")
+    command_id = data.get("id")
+    if not command_id:
+        raise ValueError("id is required")
+    iccid = data.get("iccid")
+    if not iccid:
+        raise ValueError("iccid is required")
+    to, text = data.get("to"), data.get("text")
+    if command_type == SEND_SMS and (not to or not text):
+        raise ValueError("send_sms needs to and text")
+    if command_type == SEND_SMS and not is_phone_number(to):
+        raise ValueError("to is not a phone number")
+    return Command(id=str(command_id), type=command_type, iccid=str(iccid), to=to, text=text)
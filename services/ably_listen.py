@@ -1,29 +1,249 @@
-import asyncio, os
-from ably import AblyRealtime
+import asyncio, json, os
 import logging
+from typing import Optional
+
+from database.sim_registry import sim_registry
+from helpers import at_command
+from microservices import com_manager
+from microservices.jobs import Job, job_manager, submit_sms_job
+from services.ably_commands import Command, FETCH_SMS, REFRESH_BALANCE, REFRESH_INFO, SEND_SMS, parse_command
+
 logger = logging.getLogger(__name__)
 
-async def get_started():
-    # Initialize the Ably Realtime client
-    ably_realtime = AblyRealtime(os.getenv("ABLY_API_KEY"), client_id="client_sim_bridge")
+# Returned for refresh_info, the typed snapshot fields
+INFO_REPLY_FIELDS = (
+    "iccid", "cimi", "com_port", "operator", "creg_stat", "rssi", "rssi_dbm", "ber", "network_act", "band",
+)
+
+
+class AblyCommandService:
+    """
+    Commands from channel_sim_bridge into the modem job pipeline:
+      - Messages parse into Command (fetch_sms, refresh_balance, refresh_info, send_sms), invalid ones get an error reply
+      - Every bridge gets every command, only the one whose unique_id holds the sim runs it
+      - A bounded queue feeds `concurrency` worker tasks; when it is full the command is answered "rejected" (backpressure)
+      - Commands run as JobManager jobs: identical in-flight fetch / refresh commands share one modem operation
+      - send_sms goes into the SMS outbox (controllers.sms_outbox), the reply carries the outbox id
+      - Replies are buffered and published on the reply channel in batches (reply_batch messages or reply_delay seconds)
+      - client is anything shaped like AblyRealtime (services.ably_local.LocalAblyRealtime locally)
+    """
+
+    def __init__(
+        self,
+        client=None,
+        command_channel: str = "channel_sim_bridge",
+        reply_channel: str = "channel_sim_bridge_reply",
+        concurrency: int = 16,
+        queue_size: int = 256,
+        reply_batch: int = 50,
+        reply_delay: float = 0.2,
+        command_timeout: float = 120.0,
+    ):
+        self.client = client
+        self.command_channel_name = command_channel
+        self.reply_channel_name = reply_channel
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.reply_batch = reply_batch
+        self.reply_delay = reply_delay
+        self.command_timeout = command_timeout
+        self.unique_id = os.getenv("UNIQUE_ID")
+        self.reply_channel = None
+        self._commands: Optional[asyncio.Queue] = None
+        self._replies: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._stats = {
+            "received": 0, "invalid": 0, "rejected": 0, "not_mine": 0,
+            "ok": 0, "error": 0, "timeout": 0, "publishes": 0, "replies": 0, "publish_errors": 0,
+        }
+
+    async def start(self) -> None:
+        if self.client is None:
+            self.client = _create_client()
+        self._commands = asyncio.Queue(maxsize=self.queue_size)
+        self._replies = asyncio.Queue()
+        await self.client.connection.once_async("connected")
+        channel = self.client.channels.get(self.command_channel_name)
+        self.reply_channel = self.client.channels.get(self.reply_channel_name)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._publisher()))
+        await channel.subscribe(self.on_message)
+        logger.info(f"Subscribed to {self.command_channel_name}, replies on {self.reply_channel_name}")
+
+    def on_message(self, message) -> None:
+        # Called on the event loop for every message, must not block
+        self._stats["received"] += 1
+        try:
+            command = parse_command(message.name, message.data)
+        except ValueError as e:
+            self._stats["invalid"] += 1
+            data = message.data if isinstance(message.data, dict) else {}
+            logger.error(f"Invalid command {message.name}: {e}")
+            self._reply({"id": data.get("id"), "type": message.name, "status": "error", "error": str(e)})
+            return
+        try:
+            self._commands.put_nowait(command)
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            self._reply(self._reply_for(command, "rejected", error="busy"))
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "queue_depth": self._commands.qsize() if self._commands else 0,
+            "replies_pending": self._replies.qsize() if self._replies else 0,
+            "concurrency": self.concurrency,
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            command = await self._commands.get()
+            try:
+                await self._execute(command)
+            except Exception as e:
+                logger.error(f"Error executing command {command.type} {command.id}: {e}")
+                self._stats["error"] += 1
+                self._reply(self._reply_for(command, "error", error=str(e)))
+            finally:
+                self._commands.task_done()
+
+    async def _execute(self, command: Command) -> None:
+        sim = await asyncio.to_thread(sim_registry.get, command.iccid)
+        if not sim or sim.get("unique_id") != self.unique_id or not sim.get("com_port"):
+            # Another bridge holds the sim (or nobody does): that one answers
+            self._stats["not_mine"] += 1
+            return
+        job = self._submit(command)
+        if not await job_manager.wait(job, self.command_timeout):
+            self._stats["timeout"] += 1
+            self._reply(self._reply_for(command, "timeout", job=job))
+            return
+        error = job.future.exception()
+        if error is not None:
+            self._stats["error"] += 1
+            self._reply(self._reply_for(command, "error", error=str(error), job=job))
+            return
+        self._stats["ok"] += 1
+        self._reply(self._reply_for(command, "ok", result=job.future.result(), job=job))
+
+    def _submit(self, command: Command) -> Job:
+        manager = com_manager.get_com_manager()
+        iccid = command.iccid
+        if command.type == FETCH_SMS:
+            return submit_sms_job(iccid)
+        if command.type == REFRESH_BALANCE:
+            return job_manager.submit("balance", iccid, lambda: _refresh_balance(manager, iccid))
+        if command.type == REFRESH_INFO:
+            return job_manager.submit("info", iccid, lambda: _refresh_info(manager, iccid))
+        if command.type == SEND_SMS:
+            # Never coalesced: every send is its own outbox message
+            return job_manager.submit("send_sms", command.id, lambda: _send_sms(manager, command))
+        raise ValueError(f"unknown command: {command.type}")
+
+    def _reply_for(self, command: Command, status: str, result=None, error=None, job: Job = None) -> dict:
+        return {
+            "id": command.id,
+            "type": command.type,
+            "iccid": command.iccid,
+            "status": status,
+            "result": result,
+            "error": error,
+            "job_id": job.id if job else None,
+            "bridge": self.unique_id,
+        }
+
+    def _reply(self, reply: dict) -> None:
+        # datetimes / ObjectIds -> strings, Ably encodes the rest as JSON
+        self._replies.put_nowait(json.loads(json.dumps(reply, default=str)))
+
+    async def _publisher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._replies.get()]
+            deadline = loop.time() + self.reply_delay
+            while len(batch) < self.reply_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._replies.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.reply_channel.publish([{"name": "result", "data": reply} for reply in batch])
+                self._stats["publishes"] += 1
+                self._stats["replies"] += len(batch)
+            except Exception as e:
+                self._stats["publish_errors"] += 1
+                logger.error(f"Error publishing {len(batch)} replies: {e}")
+
+
+def _refresh_balance(manager, iccid: str) -> dict:
+    result = at_command.get_balance(iccid, manager)
+    if result != "ok":
+        raise RuntimeError(result or "balance_error")
+    sim = sim_registry.get(iccid) or {}
+    return {"balance": sim.get("balance"), "phone": sim.get("phone"), "balance_update_time": sim.get("balance_update_time")}
+
+
+def _refresh_info(manager, iccid: str) -> dict:
+    sim = sim_registry.get(iccid)
+    if not sim or not sim.get("com_port"):
+        raise LookupError("sim_not_found")
+    data_save = manager.refresh_info(sim["com_port"])
+    if data_save is None:
+        raise RuntimeError("not_ready")
+    return {field: data_save.get(field) for field in INFO_REPLY_FIELDS}
+
+
+def _send_sms(manager, command: Command) -> dict:
+    # Queued for this sim, sent by the outbox dispatcher (PDU mode, long messages split); poll GET /sms/outbox/{id}
+    message_id = manager.sms_outbox.enqueue(command.to, command.text, iccid=command.iccid)
+    return {"id": message_id, "status": "queued"}
+
+
+def _create_client():
+    api_key = os.getenv("ABLY_API_KEY")
+    if not api_key:
+        from services.ably_local import LocalAblyRealtime
+        logger.warning("ABLY_API_KEY is not set, Ably commands use a local in-process channel")
+        return LocalAblyRealtime()
+    from ably import AblyRealtime
+    ably_realtime = AblyRealtime(api_key, client_id="client_sim_bridge")
+
     def on_state_change(state_change):
         if state_change.current.value == "connected":
             logger.info("Made my first connection!")
     ably_realtime.connection.on(on_state_change)
-    await ably_realtime.connection.once_async("connected")
-    channel = ably_realtime.channels.get("channel_sim_bridge")
+    return ably_realtime
+
+
+_service: Optional[AblyCommandService] = None
+
 
-    # Subscribe to messages on the channel
-    def on_message(message):
-        logger.info(f"Received message: {message.data}")
-        logger.info(f"Event: {message.name}")
+def get_ably_service() -> AblyCommandService:
+    global _service
+    if _service is None:
+        _service = AblyCommandService(
+            command_channel=os.getenv("ABLY_COMMAND_CHANNEL", "channel_sim_bridge"),
+            reply_channel=os.getenv("ABLY_REPLY_CHANNEL", "channel_sim_bridge_reply"),
+            concurrency=int(os.getenv("ABLY_COMMAND_CONCURRENCY", "16")),
+            queue_size=int(os.getenv("ABLY_COMMAND_QUEUE", "256")),
+            reply_batch=int(os.getenv("ABLY_REPLY_BATCH", "50")),
+            reply_delay=float(os.getenv("ABLY_REPLY_DELAY", "0.2")),
+        )
+    return _service
 
-    await channel.subscribe(on_message)
-    logger.info("Subscribed to messages on the channel")
+
+async def get_started():
+    try:
+        await get_ably_service().start()
+    except Exception as e:
+        logger.error(f"Error starting Ably command service: {e}")
+        return
     await asyncio.Event().wait()
-    
 
-    
+
 def start_ably_listen():
     logger.info("Starting ably listen...")
-    asyncio.create_task(get_started())
\ No newline at end of file
+    asyncio.create_task(get_started())
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalMessage:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+
+class LocalChannel:
+    """
+    In-process stand-in for an Ably realtime channel:
+      - subscribe(listener) / publish(...) with the same call forms as ably.realtime
+      - Every publish is kept in `published`, one entry per publish call
+      - deliver(name, data) feeds a message to the subscribers, as if it came from Ably
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.listeners: List[Callable] = []
+        self.published: List[List[dict]] = []
+
+    async def subscribe(self, listener: Callable) -> None:
+        self.listeners.append(listener)
+
+    async def publish(self, *args) -> None:
+        if len(args) == 2:
+            messages = [{"name": args[0], "data": args[1]}]
+        elif isinstance(args[0], list):
+            messages = list(args[0])
+        else:
+            messages = [args[0]]
+        self.published.append(messages)
+        for message in messages:
+            self.deliver(message.get("name"), message.get("data"))
+
+    def deliver(self, name, data) -> None:
+        message = LocalMessage(name, data)
+        for listener in list(self.listeners):
+            result = listener(message)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+
+
+class LocalConnection:
+    async def once_async(self, state: str = None) -> None:
+        return None
+
+    def on(self, *args) -> None:
+        return None
+
+
+class LocalChannels:
+    def __init__(self):
+        self._channels: Dict[str, LocalChannel] = {}
+
+    def get(self, name: str) -> LocalChannel:
+        if name not in self._channels:
+            self._channels[name] = LocalChannel(name)
+        return self._channels[name]
+
+
+class LocalAblyRealtime:
+    # Used without ABLY_API_KEY (development) and to drive the command service locally
+    def __init__(self):
+        self.connection = LocalConnection()
+        self.channels = LocalChannels()
+
+    async def close(self) -> None:
+        return None
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Read at import by config.mongo_lite and the services, no connection is made
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MONGO_DB", "tests")
+os.environ.setdefault("UNIQUE_ID", "TEST-BRIDGE")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
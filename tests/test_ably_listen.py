@@ -0,0 +1,125 @@
+import asyncio
+import os
+
+from services import ably_listen
+from services.ably_listen import AblyCommandService
+from services.ably_local import LocalAblyRealtime
+
+
+class FakeRegistry:
+    def __init__(self, sims):
+        self.sims = sims
+
+    def get(self, iccid):
+        return self.sims.get(iccid)
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.enqueued = []
+
+    def enqueue(self, to, text, iccid=None, operator=None):
+        self.enqueued.append((to, text, iccid))
+        return f"outbox-{len(self.enqueued)}"
+
+
+class FakeManager:
+    def __init__(self):
+        self.sms_outbox = FakeOutbox()
+
+
+def run(scenario, **kwargs):
+    # scenario(service, command_channel) runs on a fresh loop against a local client
+    async def main():
+        client = LocalAblyRealtime()
+        service = AblyCommandService(client=client, reply_delay=kwargs.pop("reply_delay", 0.05), **kwargs)
+        await service.start()
+        try:
+            await scenario(service, client.channels.get(service.command_channel_name))
+        finally:
+            for task in service._tasks:
+                task.cancel()
+        return service, client.channels.get(service.reply_channel_name)
+
+    return asyncio.run(main())
+
+
+def replies(reply_channel):
+    return [message["data"] for batch in reply_channel.published for message in batch]
+
+
+def test_invalid_command_gets_error_reply():
+    async def scenario(service, channel):
+        channel.deliver("reboot_modem", {"id": "c1", "iccid": "8984"})
+        channel.deliver("send_sms", {"id": "c2", "iccid": "8984", "to": '+84";AT+CFUN=0', "text": "x"})
+        await asyncio.sleep(0.2)
+
+    service, reply_channel = run(scenario)
+    got = replies(reply_channel)
+    assert [(reply["id"], reply["status"]) for reply in got] == [("c1", "error"), ("c2", "error")]
+    assert "unknown command" in got[0]["error"]
+    assert "phone number" in got[1]["error"]
+    assert service.stats()["invalid"] == 2
+
+
+def test_full_queue_rejects_commands():
+    async def scenario(service, channel):
+        # No workers: the first command waits in the queue, the next ones find it full
+        for i in range(3):
+            channel.deliver("fetch_sms", {"id": f"c{i}", "iccid": "8984"})
+        await asyncio.sleep(0.2)
+
+    service, reply_channel = run(scenario, concurrency=0, queue_size=1)
+    got = replies(reply_channel)
+    assert [(reply["id"], reply["status"], reply["error"]) for reply in got] == [
+        ("c1", "rejected", "busy"),
+        ("c2", "rejected", "busy"),
+    ]
+    assert service.stats()["rejected"] == 2
+    assert service.stats()["queue_depth"] == 1
+
+
+def test_command_for_sim_on_another_bridge_is_dropped(monkeypatch):
+    monkeypatch.setattr(ably_listen, "sim_registry", FakeRegistry({
+        "8984": {"iccid": "8984", "unique_id": "OTHER-BRIDGE", "com_port": "/dev/ttyUSB2"},
+    }))
+
+    async def scenario(service, channel):
+        channel.deliver("fetch_sms", {"id": "c1", "iccid": "8984"})
+        channel.deliver("fetch_sms", {"id": "c2", "iccid": "unknown"})
+        await asyncio.sleep(0.2)
+
+    service, reply_channel = run(scenario)
+    assert replies(reply_channel) == []
+    assert service.stats()["not_mine"] == 2
+
+
+def test_replies_are_batched_into_one_publish():
+    async def scenario(service, channel):
+        for i in range(5):
+            channel.deliver("bogus", {"id": f"c{i}", "iccid": "8984"})
+        await asyncio.sleep(0.5)
+
+    service, reply_channel = run(scenario, reply_delay=0.2)
+    assert len(reply_channel.published) == 1
+    assert [message["data"]["id"] for message in reply_channel.published[0]] == [f"c{i}" for i in range(5)]
+    assert service.stats()["publishes"] == 1
+    assert service.stats()["replies"] == 5
+
+
+def test_send_sms_is_queued_in_the_outbox(monkeypatch):
+    manager = FakeManager()
+    monkeypatch.setattr(ably_listen, "sim_registry", FakeRegistry({
+        "8984": {"iccid": "8984", "unique_id": os.environ["UNIQUE_ID"], "com_port": "/dev/ttyUSB2"},
+    }))
+    monkeypatch.setattr(ably_listen.com_manager, "get_com_manager", lambda: manager)
+
+    async def scenario(service, channel):
+        channel.deliver("send_sms", {"id": "c1", "iccid": "8984", "to": "+84901234567", "text": "Xin chào"})
+        await asyncio.sleep(0.3)
+
+    service, reply_channel = run(scenario)
+    got = replies(reply_channel)
+    assert [(reply["id"], reply["status"]) for reply in got] == [("c1", "ok")]
+    assert got[0]["result"] == {"id": "outbox-1", "status": "queued"}
+    assert manager.sms_outbox.enqueued == [("+84901234567", "Xin chào", "8984")]
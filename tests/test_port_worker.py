@@ -0,0 +1,67 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from microservices.port_worker import PortWorker
+from microservices.urc_watcher import UrcWatcher
+
+
+class PipeSerial:
+    # The read end of a pipe standing in for the tty
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+
+class FakeComPort:
+    def __init__(self, fd):
+        self.ser = PipeSerial(fd)
+        self.lock = threading.RLock()
+        self.urc_handler = lambda comport, line, body=None: None
+        self.data = b""
+        self.received = threading.Event()
+
+    def is_open(self):
+        return True
+
+    def poll_urcs(self):
+        os.set_blocking(self.ser.fd, False)
+        try:
+            data = os.read(self.ser.fd, 4096)
+        except BlockingIOError:
+            return
+        self.data += data
+        self.received.set()
+
+
+class FakePool:
+    def __init__(self, comport):
+        self.comport = comport
+
+    def peek(self, device):
+        return self.comport
+
+    @contextmanager
+    def session(self, device):
+        yield self.comport
+
+
+def test_idle_worker_is_woken_by_readable_handle():
+    read_fd, write_fd = os.pipe()
+    comport = FakeComPort(read_fd)
+    # An hour between timed polls: only the watcher can deliver the URC in time
+    worker = PortWorker("/dev/pipe", FakePool(comport), idle_interval=3600, watcher=UrcWatcher()).start()
+    try:
+        assert worker.submit(lambda c: "OK").result(timeout=5) == "OK"
+        os.write(write_fd, b'+CMTI: "SM",1\r\n')
+        assert comport.received.wait(timeout=5)
+        assert comport.data == b'+CMTI: "SM",1\r\n'
+        # Watched again after the read
+        comport.received.clear()
+        os.write(write_fd, b'+CMTI: "SM",2\r\n')
+        assert comport.received.wait(timeout=5)
+    finally:
+        worker.stop()
+        os.close(write_fd)
@@ -0,0 +1,20 @@
+from controllers.sms_manager import parse_cmgr, parse_sms_data
+
+# As reported by the modem: concatenated ASCII codes ("TST"), then a plain number
+SENDERS = ["848384", "+84912345678"]
+
+
+def test_cmgl_and_cmgr_decode_the_same_senders():
+    # The CMGL sweep and the +CMTI read must give one message the same sms_key
+    cmgl = (
+        f'\r\n+CMGL: 1,"REC UNREAD","{SENDERS[0]}",,"24/05/01,10:00:00+28"\r\nHello\r\n'
+        f'+CMGL: 2,"REC UNREAD","{SENDERS[1]}",,"24/05/01,10:01:00+28"\r\nCode 1234\r\n'
+        "\r\nOK\r\n"
+    )
+    listed = parse_sms_data(cmgl)
+    assert [sms["sender"] for sms in listed] == ["TST", "+84912345678"]
+
+    for raw_sender, sms in zip(SENDERS, listed):
+        cmgr = f'\r\n+CMGR: "REC READ","{raw_sender}",,"{sms["time"]}"\r\n{sms["content"]}\r\n\r\nOK\r\n'
+        read = parse_cmgr(cmgr, sms["index"])
+        assert (read["sender"], read["time"], read["content"]) == (sms["sender"], sms["time"], sms["content"])
@@ -0,0 +1,72 @@
+from helpers import sms_pdu
+from helpers.sms_pdu import ENCODING_GSM7, ENCODING_UCS2, encode_submit, split_text
+
+
+def test_single_gsm7_matches_reference_pdu():
+    # The published SMS-SUBMIT example: "hellohello" to +46708251358, no status report
+    encoding, parts = split_text("hellohello")
+    assert (encoding, len(parts)) == (ENCODING_GSM7, 1)
+    assert encode_submit("+46708251358", parts[0], encoding, status_report=False) == (
+        "0011000B916407281553F80000AA0AE8329BFD4697D9EC37",
+        23,
+    )
+
+
+def test_concatenated_gsm7_part_has_udh_and_fill_bit():
+    pdu, length = encode_submit(
+        "+84912345678", sms_pdu.gsm7_septets("hellohello"), ENCODING_GSM7, reference=0xCC, total=2, sequence=1
+    )
+    # UDHI + status report, UDL 0x11 = 7 septets of UDH + 10, UDH 050003CC0201, then 1 fill bit before the text
+    assert pdu == "0071000B914819325476F80000AA11050003CC0201D06536FB8D2EB3D96F"
+    assert length == 29
+
+
+def test_ucs2_single():
+    encoding, parts = split_text("Привет")
+    assert encoding == ENCODING_UCS2
+    assert encode_submit("0912345678", parts[0], encoding) == (
+        "0031000A8190214365870008AA0C041F04400438043204350442",
+        25,
+    )
+
+
+def test_extension_character_is_escaped():
+    assert sms_pdu.gsm7_septets("€") == [0x1B, 0x65]
+    assert sms_pdu.pack_septets([0x1B, 0x65]).hex().upper() == "9B32"
+
+
+def test_split_never_separates_escape_from_its_character():
+    text = "a" * 152 + "€" + "b" * 20
+    encoding, parts = split_text(text)
+    assert encoding == ENCODING_GSM7
+    # The escape would be the 153rd septet of part 1: it moves to part 2 with its character
+    assert [len(part) for part in parts] == [152, 22]
+    assert parts[1][:2] == [0x1B, 0x65]
+
+
+def test_split_never_separates_a_surrogate_pair():
+    text = "я" * 66 + "😀" + "я" * 10
+    encoding, parts = split_text(text)
+    assert encoding == ENCODING_UCS2
+    assert [len(part) for part in parts] == [66, 12]
+    assert parts[1][:2] == [0xD83D, 0xDE00]
+
+
+def test_single_part_limits():
+    assert len(split_text("a" * 160)[1]) == 1
+    assert [len(part) for part in split_text("a" * 161)[1]] == [153, 8]
+    assert len(split_text("я" * 70)[1]) == 1
+    assert [len(part) for part in split_text("я" * 71)[1]] == [67, 4]
+
+
+def test_encode_address():
+    assert sms_pdu.encode_address("+84912345678").hex().upper() == "0B914819325476F8"
+    assert sms_pdu.encode_address("0912345678").hex().upper() == "0A819021436587"
+
+
+def test_encode_message_shares_reference_across_parts(monkeypatch):
+    monkeypatch.setattr(sms_pdu, "new_reference", lambda: 0x2A)
+    pdus = sms_pdu.encode_message("+84912345678", "x" * 200)
+    assert len(pdus) == 2
+    for sequence, (pdu, _) in enumerate(pdus, 1):
+        assert f"0500032A02{sequence:02X}" in pdu
@@ -0,0 +1,180 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from tools.modem_emulator import add_emulator_arguments, emulator_from_args
+
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], fraction: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+class CommandTimer:
+    """
+    Wraps ComPort.write / write_prompted and records the round trip of every command, by command name
+    (compound lines as "compound"). install() patches the class, so every port of the bridge is measured.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(command: str) -> str:
+        if ";" in command:
+            return "compound"
+        return re.split(r"[=?]", command, 1)[0].upper()
+
+    def record(self, command: str, seconds: float) -> None:
+        with self._lock:
+            self.latencies.setdefault(self.key(command), []).append(seconds)
+
+    def install(self, comport_class) -> None:
+        timer = self
+
+        def timed(method):
+            def wrapper(self, command, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return method(self, command, *args, **kwargs)
+                finally:
+                    timer.record(command, time.perf_counter() - start)
+            return wrapper
+
+        comport_class.write = timed(comport_class.write)
+        comport_class.write_prompted = timed(comport_class.write_prompted)
+
+    def report(self) -> Dict[str, dict]:
+        with self._lock:
+            return {key: summarize(values) for key, values in sorted(self.latencies.items())}
+
+
+def run_load_test(args) -> dict:
+    """
+    Emulated modems + the real discovery and polling loops of ComManager, for args.duration seconds.
+    Writes go to the Mongo database of MONGO_URI / MONGO_DB: point it at a scratch database.
+    """
+    emulator = emulator_from_args(args).start()
+    # Read by ComManager.__init__, set before the manager exists
+    os.environ["EXTRA_SERIAL_PORTS"] = emulator.pattern
+    os.environ.setdefault("HOTPLUG_POLL_INTERVAL", "1")
+
+    from microservices import com_manager
+
+    timer = CommandTimer()
+    timer.install(com_manager.ComPort)
+    manager = com_manager.get_com_manager()
+
+    loops = [manager.get_com_have_sim, manager.get_info_sim]
+    if args.balance:
+        loops.append(manager.get_balance_background)
+    if args.sms:
+        loops.append(manager.get_sms_background)
+    time_start = time.time()
+    for loop in loops:
+        threading.Thread(target=loop, daemon=True).start()
+
+    discovery_time = None
+    cycles: List[dict] = []
+    last_cycle = None
+    deadline = time_start + args.duration
+    while time.time() < deadline:
+        time.sleep(0.5)
+        if discovery_time is None and len(manager.com_ports) >= args.modems:
+            discovery_time = time.time() - time_start
+        stats = manager.info_cycle_stats
+        if stats and stats.get("time") != last_cycle:
+            last_cycle = stats["time"]
+            cycles.append(dict(stats))
+            if args.verbose:
+                print(f"cycle: {stats['ports']} ports, ok: {stats['ok']}, failed: {stats['failed']}, {stats['cycle_time']:.2f}s")
+    elapsed = time.time() - time_start
+
+    commands = timer.report()
+    total_commands = sum(entry["count"] for entry in commands.values())
+    full_cycles = [cycle for cycle in cycles if cycle["ports"] >= args.modems]
+    from database import write_batcher
+    result = {
+        "modems": args.modems,
+        "duration": elapsed,
+        "tracked_ports": len(manager.com_ports),
+        "discovery_time": discovery_time,
+        "cycles": len(cycles),
+        "full_cycles": len(full_cycles),
+        "cycle_time": summarize([cycle["cycle_time"] for cycle in full_cycles]),
+        "snapshots_per_second": sum(cycle["ok"] for cycle in cycles) / elapsed,
+        "failed_snapshots": sum(cycle["failed"] for cycle in cycles),
+        "commands_per_second": total_commands / elapsed,
+        "commands": commands,
+        "queue_depth": manager.queue_depth(),
+        "info_writes": manager.info_write_stats,
+        "writers": write_batcher.writer_stats(),
+        "emulator": emulator.stats(),
+    }
+    if args.balance:
+        result["balance"] = manager.balance_scheduler.stats()
+    emulator.stop()
+    return result
+
+
+def print_report(result: dict) -> None:
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+    print(f"modems: {result['modems']}, tracked: {result['tracked_ports']}, duration: {result['duration']:.1f}s")
+    discovery = result["discovery_time"]
+    print(f"discovery: {f'{discovery:.1f}s' if discovery is not None else 'incomplete'}")
+    cycle = result["cycle_time"]
+    print(f"refresh cycles: {result['cycles']} ({result['full_cycles']} with every modem), cycle time p50 {ms(cycle['p50'])} ms, p95 {ms(cycle['p95'])} ms, max {ms(cycle['max'])} ms")
+    print(f"throughput: {result['snapshots_per_second']:.1f} snapshots/s, {result['commands_per_second']:.1f} commands/s, failed snapshots: {result['failed_snapshots']}")
+    print(f"{'command':12} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for command, entry in result["commands"].items():
+        print(f"{command:12} {entry['count']:7} {ms(entry['p50'])} {ms(entry['p95'])} {ms(entry['p99'])} {ms(entry['max'])}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the polling loops against emulated modems")
+    add_emulator_arguments(parser)
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--balance", action="store_true", help="also run the balance scheduler")
+    parser.add_argument("--sms", action="store_true", help="also run the SMS background loop")
+    parser.add_argument("--json", help="write the full result to this file")
+    parser.add_argument("--verbose", action="store_true", help="print every refresh cycle")
+    args = parser.parse_args()
+
+    # .env and UNIQUE_ID, like main.py
+    from helpers import startup  # noqa: F401
+    logging.basicConfig(level=logging.WARNING)
+
+    result = run_load_test(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+    return 0 if result["discovery_time"] is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
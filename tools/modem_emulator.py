@@ -0,0 +1,413 @@
+import argparse
+import glob
+import logging
+import os
+import pty
+import random
+import re
+import shutil
+import threading
+import time
+import tty
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+SENDERS = ("+84901234567", "+84987654321", "VIETTEL", "Zalo", "+84356789012")
+BODIES = (
+    "Ma xac thuc cua ban la {code}",
+    "Your OTP is {code}\nValid for 5 minutes.\nDo not share it.",
+    "TKC cua quy khach da duoc cong 10000 VND",
+    "Chuc mung! Ban nhan duoc uu dai {code}.\nSoan TC gui 1234 de tu choi",
+)
+
+
+@dataclass
+class EmulatorConfig:
+    # Response delay: latency + uniform(0, jitter) seconds per command
+    latency: float = 0.02
+    jitter: float = 0.01
+    # Probability a command answers ERROR / is not answered at all
+    error_rate: float = 0.0
+    timeout_rate: float = 0.0
+    # Messages on the SIM at start, and the SIM capacity
+    inbox_size: int = 0
+    inbox_capacity: int = 255
+    # Seconds between new incoming messages (+CMTI when CNMI is set), 0 for none
+    sms_interval: float = 0.0
+    # +CUSD answer delay after the OK
+    cusd_delay: float = 1.0
+    compound_at: bool = True
+    operator: str = "Viettel"
+
+
+def encode_sender(sender: str) -> str:
+    # Concatenated ASCII codes, the way the bridge's modems report the sender in text mode
+    return "".join(str(ord(char)) for char in sender)
+
+
+def scts(when: datetime) -> str:
+    return when.strftime("%y/%m/%d,%H:%M:%S") + "+28"
+
+
+class EmulatedModem:
+    """
+    One modem on a pseudo-terminal, answering the AT set the bridge uses:
+      - CPIN, CREG, COPS, CCID, CSQ, QNWINFO, CIMI, CNUM, compound lines (AT+CPIN?;+CREG?;...)
+      - CSCS / CMGF / CPMS / CNMI session settings, CUSD (balance, answered as a late +CUSD URC)
+      - CMGL / CMGR / CMGD on the SIM inbox, CMGS in text and PDU mode (">" prompt, Ctrl-Z)
+      - deliver_sms() stores a message and sends +CMTI when CNMI asks for it
+      - Latency, jitter, ERROR and no-answer injection from EmulatorConfig
+    The slave side is linked as <directory>/modemNNN, for EXTRA_SERIAL_PORTS.
+    """
+
+    def __init__(self, number: int, config: EmulatorConfig, seed: Optional[int] = None):
+        self.number = number
+        self.config = config
+        self.random = random.Random(seed if seed is not None else number)
+        self.iccid = f"8984049{number:012d}"
+        self.cimi = f"45204{number:010d}"
+        self.phone = f"+8490{number:07d}"
+        self.balance = 10000 + self.random.randint(0, 500) * 100
+        self.rssi = self.random.randint(10, 31)
+        self.inbox: Dict[int, dict] = {}
+        self.session: Dict[str, str] = {"cmgf": "0", "cscs": "IRA", "cnmi": "0,0,0,0,0"}
+        self.message_reference = 0
+        self.stats = {"commands": 0, "errors_injected": 0, "timeouts_injected": 0, "urcs": 0, "sent": 0}
+        self.command_counts: Dict[str, int] = {}
+        self.master: Optional[int] = None
+        self.slave: Optional[int] = None
+        self.device: Optional[str] = None
+        self.link: Optional[str] = None
+        self._write_lock = threading.Lock()
+        self._running = False
+        for _ in range(config.inbox_size):
+            self._store_sms(*self._random_sms(), status="REC READ")
+
+    def start(self, directory: str) -> "EmulatedModem":
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+        self.link = os.path.join(directory, f"modem{self.number:03d}")
+        os.symlink(self.device, self.link)
+        self._running = True
+        threading.Thread(target=self._run, name=f"modem{self.number:03d}", daemon=True).start()
+        if self.config.sms_interval > 0:
+            threading.Thread(target=self._incoming_sms, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+        # The slave stays open while running so the pty survives the bridge closing its handle
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    def deliver_sms(self, sender: Optional[str] = None, text: Optional[str] = None) -> Optional[int]:
+        if sender is None or text is None:
+            sender, text = self._random_sms()
+        index = self._store_sms(sender, text)
+        if index is None:
+            return None
+        mt = self.session["cnmi"].split(",")[1:2]
+        if mt and mt[0] == "1":
+            self.stats["urcs"] += 1
+            self._send(f'\r\n+CMTI: "SM",{index}\r\n')
+        return index
+
+    def _random_sms(self):
+        code = self.random.randint(100000, 999999)
+        return self.random.choice(SENDERS), self.random.choice(BODIES).format(code=code)
+
+    def _store_sms(self, sender: str, text: str, status: str = "REC UNREAD") -> Optional[int]:
+        index = next((i for i in range(self.config.inbox_capacity) if i not in self.inbox), None)
+        if index is None:
+            return None
+        when = datetime.now() - timedelta(seconds=self.random.randint(0, 86400))
+        self.inbox[index] = {"status": status, "sender": sender, "time": scts(when), "text": text}
+        return index
+
+    def _incoming_sms(self) -> None:
+        while self._running:
+            time.sleep(self.random.expovariate(1 / self.config.sms_interval))
+            if self._running:
+                self.deliver_sms()
+
+    def _send(self, text: str) -> None:
+        with self._write_lock:
+            try:
+                os.write(self.master, text.encode())
+            except OSError:
+                pass
+
+    def _run(self) -> None:
+        buffer = b""
+        prompt_command = None
+        while self._running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            buffer += data
+            while self._running:
+                if prompt_command is not None:
+                    # After "> ": the payload ends with Ctrl-Z, ESC cancels
+                    end = min((i for i in (buffer.find(b"\x1a"), buffer.find(b"\x1b")) if i >= 0), default=-1)
+                    if end < 0:
+                        break
+                    payload, terminator, buffer = buffer[:end], buffer[end:end + 1], buffer[end + 1:]
+                    if terminator == b"\x1a":
+                        self._reply(self._send_sms(prompt_command, payload.decode(errors="replace")))
+                    else:
+                        self._send("\r\nOK\r\n")
+                    prompt_command = None
+                    continue
+                if b"\r" not in buffer:
+                    break
+                line, buffer = buffer.split(b"\r", 1)
+                command = line.decode(errors="replace").strip()
+                if not command:
+                    continue
+                self._delay()
+                if command.upper().startswith("AT+CMGS="):
+                    self._count(command)
+                    prompt_command = command
+                    self._send("\r\n> ")
+                    continue
+                self._reply(self.handle(command))
+
+    def _delay(self) -> None:
+        delay = self.config.latency + self.random.uniform(0, self.config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _reply(self, response: Optional[str]) -> None:
+        if response is not None:
+            self._send(f"\r\n{response}\r\n")
+
+    def _count(self, command: str) -> None:
+        self.stats["commands"] += 1
+        key = re.split(r"[=?;]", command, 1)[0].upper()
+        self.command_counts[key] = self.command_counts.get(key, 0) + 1
+
+    def handle(self, command: str) -> Optional[str]:
+        self._count(command)
+        roll = self.random.random()
+        if roll < self.config.timeout_rate:
+            self.stats["timeouts_injected"] += 1
+            return None
+        if roll < self.config.timeout_rate + self.config.error_rate:
+            self.stats["errors_injected"] += 1
+            return "ERROR"
+        if ";" in command:
+            return self._compound(command)
+        response = self._answer(command)
+        return "ERROR" if response is None else response
+
+    def _compound(self, command: str) -> str:
+        if not self.config.compound_at:
+            return "ERROR"
+        lines = []
+        for part in command[2:].split(";"):
+            response = self._answer("AT" + part.strip())
+            if response is None or response.endswith("ERROR"):
+                return "\r\n".join(lines + [response or "ERROR"])
+            body = response[:-len("OK")].strip() if response.endswith("OK") else response
+            if body:
+                lines.append(body)
+        return "\r\n".join(lines + ["OK"])
+
+    def _answer(self, command: str) -> Optional[str]:
+        upper = command.upper()
+        if upper in ("AT", "ATE0", "ATE1", "ATZ"):
+            return "OK"
+        if upper == "AT+CPIN?":
+            return "+CPIN: READY\r\n\r\nOK"
+        if upper == "AT+CREG?":
+            return "+CREG: 0,1\r\n\r\nOK"
+        if upper == "AT+COPS?":
+            return f'+COPS: 0,0,"{self.config.operator}",7\r\n\r\nOK'
+        if upper == "AT+CCID":
+            return f"+CCID: {self.iccid}\r\n\r\nOK"
+        if upper == "AT+CSQ":
+            self.rssi = min(31, max(0, self.rssi + self.random.randint(-1, 1)))
+            return f"+CSQ: {self.rssi},99\r\n\r\nOK"
+        if upper == "AT+QNWINFO":
+            return '+QNWINFO: "FDD LTE","45204","LTE BAND 3",1650\r\n\r\nOK'
+        if upper == "AT+CIMI":
+            return f"{self.cimi}\r\n\r\nOK"
+        if upper == "AT+CNUM":
+            return f'+CNUM: "","{self.phone}",145\r\n\r\nOK'
+        if upper.startswith("AT+CUSD="):
+            threading.Timer(self.config.cusd_delay, self._cusd).start()
+            return "OK"
+        match = re.match(r"AT\+(CSCS|CMGF|CPMS|CNMI)=(.+)$", command, re.IGNORECASE)
+        if match:
+            name, value = match.group(1).lower(), match.group(2)
+            self.session[name] = value
+            if name == "cpms":
+                used = len(self.inbox)
+                capacity = self.config.inbox_capacity
+                return f"+CPMS: {used},{capacity},{used},{capacity},{used},{capacity}\r\n\r\nOK"
+            return "OK"
+        match = re.match(r'AT\+CMGL="?([A-Z ]+)"?$', upper)
+        if match:
+            return self._list(match.group(1))
+        match = re.match(r"AT\+CMGR=(\d+)$", upper)
+        if match:
+            return self._read(int(match.group(1)))
+        match = re.match(r"AT\+CMGD=(\d+)", upper)
+        if match:
+            self.inbox.pop(int(match.group(1)), None)
+            return "OK"
+        return None
+
+    def _cusd(self) -> None:
+        if not self._running:
+            return
+        self.stats["urcs"] += 1
+        text = f"TKC {self.balance} VND, han su dung den 01/01/2027. So thue bao {self.phone}"
+        self._send(f'\r\n+CUSD: 0,"{text}",15\r\n')
+
+    def _entry(self, index: int, message: dict, with_index: bool) -> str:
+        head = f"+CMGL: {index}," if with_index else "+CMGR: "
+        return f'{head}"{message["status"]}","{encode_sender(message["sender"])}",,"{message["time"]}"\r\n{message["text"]}'
+
+    def _list(self, status: str) -> str:
+        if self.session.get("cmgf") != "1":
+            return "+CMS ERROR: 302"
+        entries = []
+        for index in sorted(self.inbox):
+            message = self.inbox[index]
+            if status != "ALL" and message["status"] != status:
+                continue
+            entries.append(self._entry(index, message, with_index=True))
+            if message["status"] == "REC UNREAD":
+                message["status"] = "REC READ"
+        return "\r\n".join(entries + ["", "OK"]) if entries else "OK"
+
+    def _read(self, index: int) -> str:
+        message = self.inbox.get(index)
+        if message is None:
+            return "+CMS ERROR: 321"
+        response = self._entry(index, message, with_index=False) + "\r\n\r\nOK"
+        if message["status"] == "REC UNREAD":
+            message["status"] = "REC READ"
+        return response
+
+    def _send_sms(self, command: str, payload: str) -> str:
+        if self.random.random() < self.config.error_rate:
+            self.stats["errors_injected"] += 1
+            return "+CMS ERROR: 500"
+        pdu_mode = self.session.get("cmgf") == "0"
+        if pdu_mode and not re.fullmatch(r"[0-9A-Fa-f]+", payload):
+            return "+CMS ERROR: 304"
+        self.message_reference = (self.message_reference + 1) % 256
+        self.stats["sent"] += 1
+        return f"+CMGS: {self.message_reference}\r\n\r\nOK"
+
+
+class ModemEmulator:
+    """
+    A pool of EmulatedModem, all linked in one directory:
+      - start() creates the ptys and links, the bridge finds them with EXTRA_SERIAL_PORTS=<directory>/*
+      - stop() removes the links and closes the ptys
+      - stats() sums the per-modem counters
+    """
+
+    def __init__(self, count: int, config: Optional[EmulatorConfig] = None, directory: str = "/tmp/gsm-emulator", seed: int = 0):
+        self.count = count
+        self.config = config or EmulatorConfig()
+        self.directory = directory
+        self.seed = seed
+        self.modems: List[EmulatedModem] = []
+
+    @property
+    def pattern(self) -> str:
+        return os.path.join(self.directory, "modem*")
+
+    def start(self) -> "ModemEmulator":
+        os.makedirs(self.directory, exist_ok=True)
+        for link in glob.glob(self.pattern):
+            os.unlink(link)
+        self.modems = [
+            EmulatedModem(number, self.config, seed=self.seed * 100003 + number).start(self.directory)
+            for number in range(self.count)
+        ]
+        logger.info(f"{self.count} emulated modems in {self.directory}")
+        return self
+
+    def stop(self) -> None:
+        for modem in self.modems:
+            modem.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self) -> dict:
+        total: Dict[str, int] = {}
+        commands: Dict[str, int] = {}
+        for modem in self.modems:
+            for key, value in modem.stats.items():
+                total[key] = total.get(key, 0) + value
+            for key, value in modem.command_counts.items():
+                commands[key] = commands.get(key, 0) + value
+        return {**total, "modems": len(self.modems), "inbox": sum(len(modem.inbox) for modem in self.modems), "by_command": commands}
+
+
+def add_emulator_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--modems", type=int, default=10, help="number of emulated modems")
+    parser.add_argument("--dir", default="/tmp/gsm-emulator", help="directory for the modemNNN links")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per command")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra uniform(0, jitter) seconds per command")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected ERROR")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="probability of an unanswered command")
+    parser.add_argument("--inbox", type=int, default=0, help="messages on every SIM at start")
+    parser.add_argument("--sms-interval", type=float, default=0.0, help="mean seconds between incoming SMS per modem")
+    parser.add_argument("--cusd-delay", type=float, default=1.0, help="seconds before the +CUSD answer")
+    parser.add_argument("--no-compound", action="store_true", help="answer ERROR to compound command lines")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def emulator_from_args(args) -> ModemEmulator:
+    config = EmulatorConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        inbox_size=args.inbox,
+        sms_interval=args.sms_interval,
+        cusd_delay=args.cusd_delay,
+        compound_at=not args.no_compound,
+    )
+    return ModemEmulator(args.modems, config, directory=args.dir, seed=args.seed)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Emulated GSM modems on pseudo-terminals")
+    add_emulator_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    emulator = emulator_from_args(args).start()
+    print(f"EXTRA_SERIAL_PORTS={emulator.pattern}")
+    try:
+        while True:
+            time.sleep(10)
+            stats = emulator.stats()
+            print(f"commands: {stats['commands']}, urcs: {stats['urcs']}, sent: {stats['sent']}, inbox: {stats['inbox']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())